@@ -5,11 +5,12 @@ from .schemas import *
 
 from common import deps, error_code
 
+from common.codec import CodecRoute
 from common.resp import respSuccessJson, respErrorJson
 
 from core import constants
 
-router = APIRouter()
+router = APIRouter(route_class=CodecRoute)
 
 @router.get("/", summary="")
 async def get(*,
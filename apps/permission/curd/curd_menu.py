@@ -1,9 +1,8 @@
 from typing import Optional, Tuple, List
 
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import asc, desc, func, select
+from sqlalchemy import asc, bindparam, desc, func, select
 from common.curd_base import CRUDBase
 from db.base_class import dt2ts
 from ..models.menu import Menus
@@ -48,12 +47,13 @@ class CURDMenu(CRUDBase):
         return await __get_children()
 
     async def get_max_order_num(self, db: AsyncSession, parent_id: int = None) -> int:
-        filters = (self.model.is_deleted == 0,) if parent_id is None else (self.model.parent_id == parent_id,
-                                                                          self.model.is_deleted == 0)
-        data = (await db.execute(
-            select(func.max(self.model.order_num).label('max_order_num')).where(*filters)
-        )).first()
-        return data['max_order_num'] if data else 0
+        if parent_id is None:
+            return await super().get_max_order_num(db)
+        data = (await db.execute(self.cached_sql("get_max_order_num_by_parent", lambda: 
+            select(func.max(self.model.order_num).label('max_order_num'))
+            .where(self.model.parent_id == bindparam("parent_id"), self.model.is_deleted == 0)
+        ), {"parent_id": parent_id})).scalar()
+        return data or 0
 
 
 curd_menu = CURDMenu(Menus)
\ No newline at end of file
@@ -7,10 +7,9 @@ try:
     from redis.asyncio import Redis
 except ImportError:
     from aioredis import Redis
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
-from sqlalchemy import asc, desc, func, distinct, select, insert
-from common.curd_base import CRUDBase
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import asc, bindparam, desc, func, distinct, select, insert
+from common.curd_base import AssociationChanges, CRUDBase, sync_association
 from core import constants
 from ..models import Roles, UserRole
 from ..models.perm_label import PermLabel, PermLabelRole
@@ -20,9 +19,10 @@ class CURDPermLabel(CRUDBase):
 
     async def get(self, db: AsyncSession, _id: int, to_dict: bool = True):
         """ 通过id获取 """
-        label = (await db.execute(
-            select(self.model).where(self.model.id == _id, self.model.is_deleted == 0)
-        )).scalar()
+        label = (await db.execute(self.cached_sql("get", lambda: self.read_sql(
+            select(self.model).where(self.model.id == bindparam("id"), self.model.is_deleted == 0)
+            .options(selectinload(self.model.label_role))
+        )), {"id": _id})).scalar()
         return label if not (label and to_dict) else {
             'id': label.id,
             'label': label.label,
@@ -32,7 +32,7 @@ class CURDPermLabel(CRUDBase):
         }
 
     async def create(self, db: AsyncSession, *, obj_in, creator_id: int = 0):
-        obj_in_data = obj_in if isinstance(obj_in, dict) else jsonable_encoder(obj_in)
+        obj_in_data = self.encode(obj_in, extra_fields=("roles",))
         if (await db.execute(
             select(self.model)
             .where(self.model.label == obj_in_data['label'], self.model.is_deleted == 0)
@@ -40,28 +40,27 @@ class CURDPermLabel(CRUDBase):
             return None
         roles = (await db.execute(
             select(Roles).where(Roles.id.in_(obj_in_data.get('roles', [])))
-        )).all()
+        )).scalars().all()
         if 'roles' in obj_in_data:
             del obj_in_data['roles']
         obj_in_data['creator_id'] = creator_id
         db_obj = self.model(**obj_in_data)  # type: PermLabel
         db_obj.label_role = roles
-        await db.add(db_obj)
+        db.add(db_obj)
         await db.commit()
         await db.refresh(db_obj)
         return db_obj
 
     async def update(self, db: AsyncSession, *, _id: int, obj_in, updater_id: int = 0):
-        print(obj_in.roles)
-        obj_in_data = obj_in if isinstance(obj_in, dict) else jsonable_encoder(obj_in)
-        del obj_in_data['roles']
+        obj_in_data = self.encode(obj_in, extra_fields=("roles",))
+        role_ids = obj_in_data.pop('roles', None)
         res = await super().update(db, _id=_id, obj_in=obj_in_data, modifier_id=updater_id)
-        if res:
-            await self.set_label_roles(db, label_id=_id, role_ids=obj_in.roles, ctl_id=updater_id)
+        if res and role_ids is not None:
+            await self.set_label_roles(db, label_id=_id, role_ids=role_ids, ctl_id=updater_id)
         return res
 
-    async def search(self, db: AsyncSession, *, label: str = "", remark: str = "", 
-                     status: int = None, page: int = 1, page_size: int = 25) -> dict:
+    def search_filters(self, *, label: str = "", remark: str = "", status: int = None) -> list:
+        """ 权限标识列表/导出的查询条件 """
         filters = []
         if status is not None:
             filters.append(self.model.status == status)
@@ -69,14 +68,24 @@ class CURDPermLabel(CRUDBase):
             filters.append(self.model.label.like(f"%{label}%"))
         if remark:
             filters.append(self.model.remark.like(f"%{remark}%"))
-        user_data, total, _, _ = await self.get_multi(db, page=page, page_size=page_size, filters=filters)
+        return filters
+
+    async def search(self, db: AsyncSession, *, label: str = "", remark: str = "", 
+                     status: int = None, page: int = 1, page_size: int = 25, 
+                     after: Optional[str] = None, to_dict: bool = True) -> dict:
+        filters = self.search_filters(label=label, remark=remark, status=status)
+        if after is not None:   # 游标分页
+            user_data, next_cursor = await self.get_multi_by_cursor(
+                db, after=after, page_size=page_size, filters=filters, to_dict=to_dict)
+            return {'results': user_data, 'next': next_cursor}
+        user_data, total, _, _ = await self.get_multi(db, page=page, page_size=page_size, filters=filters,
+                                                     to_dict=to_dict)
         return {'results': user_data, 'total': total}
 
-    async def set_label_roles(self, db: AsyncSession, *, label_id: int, role_ids: List[int], ctl_id: int = 0):
-        db.query(PermLabelRole).filter(PermLabelRole.label_id == label_id).delete()
-        db_objs = [PermLabelRole(creator_id=ctl_id, role_id=i, label_id=label_id) for i in role_ids]
-        await db.add_all(db_objs)
-        await db.commit()
+    async def set_label_roles(self, db: AsyncSession, *, label_id: int, role_ids: List[int],
+                              ctl_id: int = 0) -> AssociationChanges:
+        return await sync_association(db, PermLabelRole, owner_col=PermLabelRole.label_id, owner_id=label_id, 
+                                      target_col=PermLabelRole.role_id, target_ids=role_ids, ctl_id=ctl_id)
         
     async def get_labels_by_roles_id(self, db: AsyncSession, roles_id: Union[Tuple[int], List[int]]):
         status_in = (0,)
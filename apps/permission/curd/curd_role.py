@@ -1,11 +1,10 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy import func, select, delete, insert
+from sqlalchemy import bindparam, func, select, delete, insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
-from common.curd_base import CRUDBase, CreateSchemaType
+from common.curd_base import AssociationChanges, CRUDBase, CreateSchemaType, sync_association
 from ..models.role import Roles, RoleMenu
 from ..models.menu import Menus
 from ..models.user import UserRole
@@ -14,24 +13,24 @@ from ..models.user import UserRole
 class CURDRole(CRUDBase):
 
     async def create(self, db: AsyncSession, *, obj_in: CreateSchemaType, creator_id: int = 0):
+        obj_in_data = self.encode(obj_in, extra_fields=("menus",))
         menus = (await db.execute(
-            select(Menus).where(Menus.id.in_(obj.menus))
-        )).all()
-        obj_in_data = obj_in if isinstance(obj_in, dict) else jsonable_encoder(obj_in)
-        del obj_in_data['menus']
+            select(Menus).where(Menus.id.in_(obj_in_data.pop('menus', [])))
+        )).scalars().all()
         obj_in_data['creator_id'] = creator_id
         obj = self.model(**obj_in_data)   # type: Roles
         obj.role_menu = menus
-        await db.add(obj)
+        db.add(obj)
         await db.commit()
         await db.refresh(obj)
         return obj
 
     async def get(self, db: AsyncSession, _id: int, to_dict: bool = True):
-        role = (await db.execute(
-            select(self.model).where(self.model.id == _id, self.model.is_deleted == 0)    
-        )).scalar()
-        return role if not to_dict else {
+        role = (await db.execute(self.cached_sql("get", lambda: self.read_sql(
+            select(self.model).where(self.model.id == bindparam("id"), self.model.is_deleted == 0)
+            .options(selectinload(self.model.role_menu))
+        )), {"id": _id})).scalar()
+        return role if not (role and to_dict) else {
             'id': role.id,
             'key': role.key,
             'name': role.name,
@@ -40,8 +39,8 @@ class CURDRole(CRUDBase):
             'menus': [{'id': i.id} for i in role.role_menu]
         }
 
-    async def search(self, db: AsyncSession, *, key: str = "", name: str = "", 
-                     status: int = None, page: int = 1, page_size: int = 25) -> dict:
+    def search_filters(self, *, key: str = "", name: str = "", status: int = None) -> list:
+        """ 角色列表/导出的查询条件 """
         filters = []
         if status is not None:
             filters.append(self.model.status == status)
@@ -49,22 +48,29 @@ class CURDRole(CRUDBase):
             filters.append(self.model.name.like(f"%{name}%"))
         if key:
             filters.append(self.model.key.like(f"%{key}%"))
+        return filters
+
+    async def search(self, db: AsyncSession, *, key: str = "", name: str = "", 
+                     status: int = None, page: int = 1, page_size: int = 25, 
+                     after: Optional[str] = None, to_dict: bool = True) -> dict:
+        filters = self.search_filters(key=key, name=name, status=status)
+        if after is not None:   # 游标分页
+            user_data, next_cursor = await self.get_multi_by_cursor(
+                db, after=after, page_size=page_size, filters=filters, to_dict=to_dict)
+            return {'results': user_data, 'next': next_cursor}
         user_data, total, _, _ = await self.get_multi(
-            db, page=page, page_size=page_size, filters=filters)
+            db, page=page, page_size=page_size, filters=filters, to_dict=to_dict)
         return {'results': user_data, 'total': total}
 
     async def set_role_menu(self, db: AsyncSession, role_id: int, menu_ids: List[int], 
-                            *, ctl_id: int = 0):
-        await db.execute(delete(RoleMenu).where(RoleMenu.role_id == role_id))
-        db_objs = [{'creator_id': ctl_id, 'role_id': role_id, 'menu_id': menu_id} for menu_id in menu_ids]
-        await db.execute(insert(RoleMenu).values(*db_objs))
-        await db.commit()
+                            *, ctl_id: int = 0) -> AssociationChanges:
+        return await sync_association(db, RoleMenu, owner_col=RoleMenu.role_id, owner_id=role_id, 
+                                      target_col=RoleMenu.menu_id, target_ids=menu_ids, ctl_id=ctl_id)
         
-    async def set_role_users(self, db: AsyncSession, *, role_id: int, user_ids: List[int], ctl_id: int = 0):
-        await db.execute(delete(UserRole).where(UserRole.role_id == role_id))
-        db_objs = [dict(creator_id=ctl_id, role_id=role_id, user_id=user_id) for user_id in user_ids]
-        await db.execute(insert(UserRole).values(*db_objs))
-        db.commit()
+    async def set_role_users(self, db: AsyncSession, *, role_id: int, user_ids: List[int],
+                             ctl_id: int = 0) -> AssociationChanges:
+        return await sync_association(db, UserRole, owner_col=UserRole.role_id, owner_id=role_id, 
+                                      target_col=UserRole.user_id, target_ids=user_ids, ctl_id=ctl_id)
 
     async def get_select_list(self, db: AsyncSession, status_in: List[int] = None):
         status_in = status_in or (0, )
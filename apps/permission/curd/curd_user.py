@@ -1,14 +1,17 @@
-from typing import List
+from typing import AsyncIterable, Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy import delete, desc, func, insert, select
+from pydantic import ValidationError
+from sqlalchemy import bindparam, delete, desc, func, insert, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, selectinload
 
-from common.curd_base import CRUDBase
-from common.security import get_password_hash   
+from common.curd_base import AssociationChanges, CRUDBase, sync_association
+from common.security import get_password_hash_async, get_password_hash_many
+from core import constants
+from db.base_class import ts_range
 from ..models import Roles
 from ..models.user import Users, UserRole
+from ..schemas import UserImportSchema
 
 
 class CURDUser(CRUDBase):
@@ -17,10 +20,10 @@ class CURDUser(CRUDBase):
 
     async def get(self, db: AsyncSession, _id: int, to_dict: bool = True):
         """ 通过id获取 """
-        user = (await db.execute(
-            select(self.model).where(self.model.id == _id, self.model.is_deleted == 0)
+        user = (await db.execute(self.cached_sql("get", lambda: self.read_sql(
+            select(self.model).where(self.model.id == bindparam("id"), self.model.is_deleted == 0)
             .options(selectinload(self.model.user_role))
-        )).scalar()     # type: Users
+        )), {"id": _id})).scalar()     # type: Users
         return  user if not (user and to_dict) else {
             'id': user.id,
             'username': user.username,
@@ -36,45 +39,146 @@ class CURDUser(CRUDBase):
         }
 
     async def create(self, db: AsyncSession, *, obj_in, creator_id: int = 0):
+        obj_in_data = self.encode(obj_in, extra_fields=("roles", "password"))
         roles = (await db.execute(
-            select(Roles).where(Roles.id.in_(obj_in.roles))
-        )).all()
-        obj_in_data = obj_in if isinstance(obj_in, dict) else jsonable_encoder(obj_in)
-        del obj_in_data['roles']
+            select(Roles).where(Roles.id.in_(obj_in_data.pop('roles', None) or []))
+        )).scalars().all()
         if 'password' in obj_in_data:
-            obj_in_data['hashed_password'] = get_password_hash(obj_in_data['password'])
+            obj_in_data['hashed_password'] = await get_password_hash_async(obj_in_data['password'])
             del obj_in_data['password']
         else:
             obj_in_data['hashed_password'] = ""
         obj_in_data['creator_id'] = creator_id
         db_obj = self.model(**obj_in_data)  # type: Users
         db_obj.user_role = roles
-        await db.add(db_obj)
+        db.add(db_obj)
         await db.commit()
         await db.refresh(db_obj)
         return db_obj
 
+    @staticmethod
+    def _parse_import_row(row: dict) -> dict:
+        """ 导入的一行数据预处理: 去掉空值使用默认值, csv 中的角色id "1,2" 转为列表 """
+        row = {k: v.strip() if isinstance(v, str) else v for k, v in row.items() if k}
+        row = {k: v for k, v in row.items() if v not in ("", None)}
+        if isinstance(row.get('roles'), str):
+            row['roles'] = [int(i) for i in row['roles'].replace("|", ",").replace(";", ",").split(",") if i.strip()]
+        return row
+
+    async def import_users(self, db: AsyncSession, *, batches: AsyncIterable[List[dict]], creator_id: int = 0,
+                           default_password: str = "", 
+                           on_progress: Optional[Callable[[dict], Awaitable[None]]] = None) -> dict:
+        """
+        批量导入用户, 按批处理: 校验数据 -> 批量检查用户名/邮箱/手机号是否已存在 -> 进程池中并行哈希密码 -> 分块插入。
+        每批单独提交, 某一批插入失败不影响其他批
+        :param batches: 每次返回一批行数据(字典)的异步迭代器
+        :param default_password: 行数据中没有密码时使用的密码, 都为空则该行报错
+        :param on_progress: 每批处理完后回调, 参数为当前进度
+        :return {'total', 'created', 'failed', 'errors': [{'row': 行号(从1开始, 不含表头), 'errors': [...]}]}
+        """
+        result = {'total': 0, 'created': 0, 'failed': 0, 'errors': []}
+        seen = {'username': set(), 'email': set(), 'phone': set()}  # type: Dict[str, Set[str]]
+        role_ids = set((await db.execute(select(Roles.id).where(Roles.is_deleted == 0))).scalars().all())
+
+        def add_error(row_num: int, errors: List[str]):
+            result['failed'] += 1
+            if len(result['errors']) < constants.USER_IMPORT_MAX_ERRORS:
+                result['errors'].append({'row': row_num, 'errors': errors})
+
+        async for batch in batches:
+            valid = []  # type: List[Tuple[int, UserImportSchema]]
+            for row in batch:
+                result['total'] += 1
+                row_num = result['total']
+                try:
+                    obj = UserImportSchema(**self._parse_import_row(row))
+                except ValidationError as e:
+                    add_error(row_num, [f"{'.'.join(map(str, i['loc']))}: {i['msg']}" for i in e.errors()])
+                    continue
+                except ValueError as e:    # roles 不是数字
+                    add_error(row_num, [str(e)])
+                    continue
+                errors = []
+                if not (obj.password or default_password):
+                    errors.append("password is required")
+                for field in ('username', 'email', 'phone'):
+                    if getattr(obj, field) in seen[field]:
+                        errors.append(f"{field} '{getattr(obj, field)}' is duplicated")
+                if set(obj.roles) - role_ids:
+                    errors.append(f"roles {sorted(set(obj.roles) - role_ids)} not found")
+                if errors:
+                    add_error(row_num, errors)
+                    continue
+                for field in ('username', 'email', 'phone'):
+                    seen[field].add(getattr(obj, field))
+                valid.append((row_num, obj))
+            # 一条语句检查这一批的 用户名(包括已删除的用户, 有唯一索引)/邮箱/手机号 是否已存在
+            if valid:
+                exists = (await db.execute(select(Users.username, Users.email, Users.phone, Users.is_deleted).where(or_(
+                    Users.username.in_([obj.username for _, obj in valid]),
+                    Users.email.in_([obj.email for _, obj in valid]),
+                    Users.phone.in_([obj.phone for _, obj in valid]),
+                )))).all()
+                exists_values = {
+                    'username': {i.username for i in exists},
+                    'email': {i.email for i in exists if not i.is_deleted},
+                    'phone': {i.phone for i in exists if not i.is_deleted},
+                }
+                checked = []
+                for row_num, obj in valid:
+                    errors = [f"{field} '{getattr(obj, field)}' already exists" for field in exists_values 
+                              if getattr(obj, field) in exists_values[field]]
+                    if errors:
+                        add_error(row_num, errors)
+                    else:
+                        checked.append((row_num, obj))
+                valid = checked
+            if valid:
+                hashed_passwords = await get_password_hash_many([obj.password or default_password for _, obj in valid])
+                users = []
+                for (_, obj), hashed_password in zip(valid, hashed_passwords):
+                    data = self.encode(obj)
+                    data['hashed_password'] = hashed_password
+                    users.append(data)
+                try:
+                    await self.create_many(db, objs_in=users, creator_id=creator_id, commit=False)
+                    user_roles = {obj.username: obj.roles for _, obj in valid if obj.roles}
+                    if user_roles:
+                        user_ids = (await db.execute(select(Users.username, Users.id).where(
+                            Users.username.in_(list(user_roles)), Users.is_deleted == 0))).all()
+                        await db.execute(insert(UserRole), [
+                            dict(creator_id=creator_id, role_id=role_id, user_id=user_id) 
+                            for username, user_id in user_ids for role_id in user_roles[username]])
+                    await db.commit()
+                    result['created'] += len(valid)
+                except Exception as e:
+                    await db.rollback()
+                    for row_num, _ in valid:
+                        add_error(row_num, [f"insert failed: {e}"])
+            if on_progress is not None:
+                await on_progress({k: v for k, v in result.items() if k != 'errors'})
+        return result
+
     async def change_password(self, db: AsyncSession, *, _id: int, new_password: str, updater_id: int = 0):
         # print(new_password)
-        obj_in = {'hashed_password': get_password_hash(new_password)}
+        obj_in = {'hashed_password': await get_password_hash_async(new_password)}
         return await super().update(db, _id=_id, obj_in=obj_in, modifier_id=updater_id)
 
     async def update(self, db: AsyncSession, *, _id: int, obj_in, updater_id: int = 0):
-        obj_in_data = obj_in if isinstance(obj_in, dict) else jsonable_encoder(obj_in)
+        obj_in_data = self.encode(obj_in, extra_fields=("roles", "password"))
         del obj_in_data['roles']
         if 'password' in obj_in_data:
-            obj_in_data['hashed_password'] = get_password_hash(obj_in_data['password'])
+            obj_in_data['hashed_password'] = await get_password_hash_async(obj_in_data['password'])
             del obj_in_data['password']
         res = await super().update(db, _id=_id, obj_in=obj_in_data, modifier_id=updater_id)
         if res:
             await self.set_user_roles(db, user_id=_id, role_ids=obj_in.roles, ctl_id=updater_id)
         return res
 
-    async def set_user_roles(self, db: AsyncSession, *, user_id: int, role_ids: List[int], ctl_id: int = 0):
-        await db.execute(delete(UserRole).where(UserRole.user_id == user_id))
-        db_objs = [dict(creator_id=ctl_id, role_id=i, user_id=user_id) for i in role_ids]
-        await db.execute(insert(UserRole).values(db_objs))
-        await db.commit()
+    async def set_user_roles(self, db: AsyncSession, *, user_id: int, role_ids: List[int],
+                             ctl_id: int = 0) -> AssociationChanges:
+        return await sync_association(db, UserRole, owner_col=UserRole.user_id, owner_id=user_id, 
+                                      target_col=UserRole.role_id, target_ids=role_ids, ctl_id=ctl_id)
 
     async def get_roles(self, db: AsyncSession, _id: int):
         u = (await db.execute(select(Users).where(Users.id == _id))).scalar()  # type: Users
@@ -83,10 +187,10 @@ class CURDUser(CRUDBase):
     async def set_user_is_active(self, db: AsyncSession, *, user_id: int, is_active: bool, modifier_id: int = 0):
         return await super().update(db, _id=user_id, obj_in={'is_active': is_active}, modifier_id=modifier_id)
 
-    async def search(self, db: AsyncSession, *, _id: int = None, username: str = "", 
-                    nickname: str = "", email: str = "", phone: str = "",
-                    status: int = None, created_after_ts: int = None, created_before_ts: int = None,
-                    page: int = 1, page_size: int = 25):
+    def search_filters(self, *, _id: int = None, username: str = "", nickname: str = "", email: str = "", 
+                       phone: str = "", status: int = None, created_after_ts: int = None, 
+                       created_before_ts: int = None) -> list:
+        """ 用户列表/导出的查询条件 """
         filters = []
         if _id is not None:
             filters.append(self.model.id == _id)
@@ -99,13 +203,24 @@ class CURDUser(CRUDBase):
         if email:
             filters.append(self.model.email.like(f"{email}%"))
         if phone:
-            filters.append(self.model.email.like(f"{phone}%"))
-        if created_before_ts is not None:
-            filters.append(func.unix_timestamp(self.model.created_time) <= created_before_ts)
-        if created_after_ts is not None:
-            filters.append(func.unix_timestamp(self.model.created_time) >= created_after_ts)
+            filters.append(self.model.phone.like(f"{phone}%"))
+        filters.extend(ts_range(self.model.created_time, ge_ts=created_after_ts, le_ts=created_before_ts))
+        return filters
+
+    async def search(self, db: AsyncSession, *, _id: int = None, username: str = "", 
+                    nickname: str = "", email: str = "", phone: str = "",
+                    status: int = None, created_after_ts: int = None, created_before_ts: int = None,
+                    page: int = 1, page_size: int = 25, after: Optional[str] = None, to_dict: bool = True):
+        filters = self.search_filters(_id=_id, username=username, nickname=nickname, email=email, phone=phone, 
+                                      status=status, created_after_ts=created_after_ts, 
+                                      created_before_ts=created_before_ts)
+        if after is not None:   # 游标分页
+            user_data, next_cursor = await self.get_multi_by_cursor(
+                db, after=after, page_size=page_size, filters=filters, order_bys=[desc(self.model.id)],
+                to_dict=to_dict)
+            return {'results': user_data, 'next': next_cursor}
         user_data, total, _, _ = await self.get_multi(
-            db, page=page, page_size=page_size, filters=filters, order_bys=[desc(self.model.id)])
+            db, page=page, page_size=page_size, filters=filters, order_bys=[desc(self.model.id)], to_dict=to_dict)
         return {'results': user_data, 'total': total}
 
 
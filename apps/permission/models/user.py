@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Date
+from sqlalchemy import Boolean, Column, Index, Integer, String, ForeignKey, Date
 from sqlalchemy.orm import relationship
 from core.config import settings
 
@@ -20,6 +20,13 @@ class Users(Base):
 
     user_role = relationship("Roles", secondary=f"{settings.SQL_TABLE_PREFIX}user_role", backref="user")
 
+    # 用户列表按创建时间范围过滤 (curd_user.search_filters 中的 ts_range)。
+    # 已经建好的表需要手动执行 (表前缀为默认的 t_ 时):
+    #   CREATE INDEX ix_t_users_created_time ON t_users (created_time);
+    __table_args__ = (
+        Index(f"ix_{settings.SQL_TABLE_PREFIX or ''}users_created_time", "created_ts"),
+    )
+
 
 class UserRole(Base):
     """用户-权限组-中间表"""
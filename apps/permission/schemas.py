@@ -14,6 +14,10 @@ class UserSchema(BaseModel):
     roles: List[int] = []
 
 
+class UserImportSchema(UserSchema):
+    password: str = ""
+
+
 class UserRolesSchema(BaseModel):
     roles: List[int] = []
 
@@ -1,8 +1,18 @@
+import json
 import os
+from datetime import timedelta
 
-from fastapi import APIRouter, Depends, Query, File, UploadFile
+from typing import List, Literal
+
+from fastapi import APIRouter, Depends, Query, File, Form, UploadFile
+from sqlalchemy import desc
 from sqlalchemy.orm import Session
+try:
+    from redis.asyncio import Redis as asyncRedis
+except ImportError:
+    from aioredis import Redis as asyncRedis
 from utils.encrypt import get_uuid
+from utils.file_reader import get_upload_format, iter_upload_rows
 from .models import Users
 from .schemas import *
 from .curd.curd_user import curd_user
@@ -11,12 +21,34 @@ from .curd.curd_menu import curd_menu
 from .curd.curd_perm_label import curd_perm_label
 
 from common import deps, error_code
+from common.batch_router import create_batch_router
+from common.perm_matrix import perm_matrix
+from common.principal import principal_cache
 
-from common.resp import respSuccessJson, respErrorJson
+from common.codec import CodecRoute
+from common.resp import respSuccessJson, respErrorJson, respExportStream
 
 from core import constants
 
-router = APIRouter()
+router = APIRouter(route_class=CodecRoute)
+
+
+@router.get("/user/export", summary="导出用户")
+async def export_user(*,
+                      u: Users = Depends(deps.user_perm(["perm:user:export"])),
+                      fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                      username: str = Query(""),
+                      nickname: str = Query(""),
+                      email: str = Query(""),
+                      phone: str = Query(""),
+                      status: int = Query(None),
+                      created_after_ts: int = None,
+                      created_before_ts: int = None,
+                      ):
+    filters = curd_user.search_filters(username=username, nickname=nickname, email=email, phone=phone, 
+                                       status=status, created_after_ts=created_after_ts, 
+                                       created_before_ts=created_before_ts)
+    return respExportStream(curd_user.stream(filters=filters, order_bys=[desc(Users.id)]), fmt, filename="users")
 
 
 @router.get("/user/{user_id}", summary="获取用户信息")
@@ -30,7 +62,7 @@ async def get_user(*,
 
 @router.get("/user", summary="获取用户列表")
 async def list_user(*,
-                    db: Session = Depends(deps.get_db),
+                    db: Session = Depends(deps.get_read_db),
                     u: Users = Depends(deps.user_perm(["perm:user:get"])),
                     id: int = Query(None, gt=0),
                     username: str = Query(""),
@@ -42,11 +74,12 @@ async def list_user(*,
                     created_before_ts: int = None,
                     page: int = Query(1, gt=0),
                     page_size: int = Query(20, gt=0),
+                    after: str = Query(None, description=deps.AFTER_QUERY_DESCRIPTION),
                     ):
     return respSuccessJson(await curd_user.search(
         db, _id=id, username=username, nickname=nickname, email=email, phone=phone, 
         status=status, created_after_ts=created_after_ts, created_before_ts=created_before_ts,
-        page=page, page_size=page_size))
+        page=page, page_size=page_size, after=after, to_dict=False))
 
 
 @router.post("/user", summary="添加用户")
@@ -59,6 +92,47 @@ async def add_user(*,
     return respSuccessJson()
 
 
+@router.post("/user/import", summary="批量导入用户")
+async def import_user(*,
+                      db: Session = Depends(deps.get_db),
+                      r: asyncRedis = Depends(deps.get_redis),
+                      u: Users = Depends(deps.user_perm(["perm:user:import"])),
+                      file: UploadFile = File(..., description="csv(第一行为表头) 或 ndjson 文件, 字段同添加用户, "
+                                                               "另外有 password 字段, roles 在 csv 中用逗号分隔"),
+                      default_password: str = Form("", description="行数据中没有密码时使用的密码"),
+                      task_id: str = Form("", description="任务id, 导入过程中可以通过它查询进度, 不传自动生成"),
+                      ):
+    try:
+        fmt = get_upload_format(file)
+    except ValueError as e:
+        return respErrorJson(error_code.ERROR_PARAMETER_ERROR, msg_append=f": {e}")
+    task_id = task_id or get_uuid()
+    progress_key = constants.REDIS_KEY_USER_IMPORT_PROGRESS + task_id
+    progress_expire = timedelta(minutes=constants.USER_IMPORT_PROGRESS_EXPIRE_MINUTES)
+
+    async def on_progress(progress: dict):
+        if r:
+            await r.setex(progress_key, progress_expire, json.dumps({'status': "running", **progress}))
+
+    result = await curd_user.import_users(
+        db, batches=iter_upload_rows(file, fmt, constants.USER_IMPORT_BATCH_SIZE), creator_id=u['id'], 
+        default_password=default_password, on_progress=on_progress)
+    if r:
+        await r.setex(progress_key, progress_expire, json.dumps(
+            {'status': "finished", **{k: v for k, v in result.items() if k != 'errors'}}))
+    return respSuccessJson({'task_id': task_id, **result})
+
+
+@router.get("/user/import/{task_id}", summary="查询批量导入用户的进度")
+async def get_import_user_progress(*,
+                                   r: asyncRedis = Depends(deps.get_redis),
+                                   u: Users = Depends(deps.user_perm(["perm:user:import"])),
+                                   task_id: str,
+                                   ):
+    progress = await r.get(constants.REDIS_KEY_USER_IMPORT_PROGRESS + task_id) if r else None
+    return respSuccessJson(json.loads(progress) if progress else {'status': "not_found"})
+
+
 @router.post("/user/file/avatar", summary="上传头像照片")
 async def upload_avatar(img: UploadFile):
     img_data = img.file.read()
@@ -85,62 +159,84 @@ async def set_password(*,
 async def set_is_active(*,
                         user_id: int,
                         db: Session = Depends(deps.get_db),
+                        r: asyncRedis = Depends(deps.get_redis),
                         u: Users = Depends(deps.user_perm(["perm:user:get"])),
                         obj: UserIsActiveSchema
                         ):
     await curd_user.set_user_is_active(db, user_id=user_id, is_active=obj.is_active, modifier_id=u['id'])
+    await principal_cache.invalidate(r, [user_id])
     return respSuccessJson()
 
 
 @router.put("/user/{user_id}", summary="修改用户信息")
 async def set_user(*,
                     db: Session = Depends(deps.get_db),
+                    r: asyncRedis = Depends(deps.get_redis),
                     u: Users = Depends(deps.user_perm(["perm:user:put"])),
                     obj: UserSchema,
                     user_id: int,
                     ):
     await curd_user.update(db, _id=user_id, obj_in=obj, updater_id=u['id'])
+    await principal_cache.invalidate(r, [user_id])
     return respSuccessJson()
 
 
 @router.put("/user/{user_id}/roles", summary="修改用户角色")
 async def set_user_roles(*,
                         db: Session = Depends(deps.get_db),
+                        r: asyncRedis = Depends(deps.get_redis),
                         u: Users = Depends(deps.user_perm(["perm:user:put"])),
                         obj: UserRolesSchema,
                         user_id: int,
                         ):
-    await curd_user.set_user_roles(db, user_id=user_id, role_ids=obj.roles, ctl_id=u['id'])
+    if (await curd_user.set_user_roles(db, user_id=user_id, role_ids=obj.roles, ctl_id=u['id'])).changed:
+        await principal_cache.invalidate(r, [user_id])
     return respSuccessJson()
 
 
 @router.delete("/user/{user_id}", summary="删除用户")
 async def del_user(*,
                     db: Session = Depends(deps.get_db),
+                    r: asyncRedis = Depends(deps.get_redis),
                     u: Users = Depends(deps.user_perm(["perm:user:delete"])),
                     user_id: int,
                     ):
     await curd_user.delete(db, _id=user_id, deleter_id=u['id'])
+    await principal_cache.invalidate(r, [user_id])
+    perm_matrix.invalidate()    # token中带有权限信息(TOKEN_PERM_CLAIMS)时, 让已删除用户的token不能再跳过查询用户
     return respSuccessJson()
 
 
 @router.get("/role", summary="获取所有权限角色")
 async def list_role(*,
-                    db: Session = Depends(deps.get_db),
+                    db: Session = Depends(deps.get_read_db),
                     u: Users = Depends(deps.user_perm(["perm:role:get"])),
                     key: str = Query(""),
                     name: str = Query(""),
                     status: int = Query(None),
                     page: int = Query(1, gt=0),
                     page_size: int = Query(25, gt=0),
+                    after: str = Query(None, description=deps.AFTER_QUERY_DESCRIPTION),
                     ):
     return respSuccessJson(await curd_role.search(
-        db, name=name, key=key, status=status, page=page, page_size=page_size))
+        db, name=name, key=key, status=status, page=page, page_size=page_size, after=after, to_dict=False))
+
+
+@router.get("/role/export", summary="导出权限角色")
+async def export_role(*,
+                      u: Users = Depends(deps.user_perm(["perm:role:export"])),
+                      fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                      key: str = Query(""),
+                      name: str = Query(""),
+                      status: int = Query(None),
+                      ):
+    filters = curd_role.search_filters(key=key, name=name, status=status)
+    return respExportStream(curd_role.stream(filters=filters), fmt, filename="roles")
 
 
 @router.get("/role/select/list", summary="获取权限角色选择列表")
 async def get_role_select_list(*,
-                                db: Session = Depends(deps.get_db)
+                                db: Session = Depends(deps.get_read_db)
                                 ):
     return respSuccessJson({'roles': await curd_role.get_select_list(db)})
 
@@ -185,11 +281,13 @@ async def set_role(*,
 @router.put("/role/{role_id}/users", summary="修改角色用户")
 async def set_role_users(*,
                         db: Session = Depends(deps.get_db),
+                        r: asyncRedis = Depends(deps.get_redis),
                         u: Users = Depends(deps.user_perm(["perm:role:put"])),
                         role_id: int,
                         obj: RoleUsersSchema
                         ):
-    await curd_role.set_role_users(db, role_id=role_id, user_ids=obj.users, ctl_id=u['id'])
+    changes = await curd_role.set_role_users(db, role_id=role_id, user_ids=obj.users, ctl_id=u['id'])
+    await principal_cache.invalidate(r, changes.added | changes.removed)
     return respSuccessJson()
 
 
@@ -205,7 +303,7 @@ async def del_role(*,
 
 @router.get("/menu", summary="菜单列表")
 async def list_menus(*,
-                    db: Session = Depends(deps.get_db),
+                    db: Session = Depends(deps.get_read_db),
                     u: Users = Depends(deps.user_perm(["perm:menu:get"])),
                     title: str = Query(""),
                     status: int = Query(None)
@@ -215,7 +313,7 @@ async def list_menus(*,
 
 @router.get("/menu/simple/list", summary="获取简易结构的菜单列表")
 async def get_menu_simple_list(*,
-                                db: Session = Depends(deps.get_db),
+                                db: Session = Depends(deps.get_read_db),
                                 u: Users = Depends(deps.user_perm(["perm:menu:get"])),
                                 ):
     return respSuccessJson({'menus': await curd_menu.get_simple_list(db)})
@@ -223,7 +321,7 @@ async def get_menu_simple_list(*,
 
 @router.get("/menu/simple/tree", summary="获取简易结构的菜单树状列表")
 async def get_menu_simple_tree(*,
-                                db: Session = Depends(deps.get_db),
+                                db: Session = Depends(deps.get_read_db),
                                 u: Users = Depends(deps.user_perm(["perm:menu:get"])),
                                 ):
     return respSuccessJson({'menus': await curd_menu.get_simple_tree(db)})
@@ -291,19 +389,32 @@ async def set_role_menu(*,
 
 @router.get("/perm-label", summary="获取权限标识")
 async def list_perm_label(*,
-                            db: Session = Depends(deps.get_db),
+                            db: Session = Depends(deps.get_read_db),
                             u: Users = Depends(deps.user_perm(["perm:label:get"])),
                             status: int = Query(None),
                             label: str = Query(None),
                             remark: str = Query(None),
                             page: int = Query(1, gt=0),
                             page_size: int = Query(20, gt=0),
+                            after: str = Query(None, description=deps.AFTER_QUERY_DESCRIPTION),
                             ):
     res = await curd_perm_label.search(
-        db, label=label, remark=remark, status=status, page=page, page_size=page_size)
+        db, label=label, remark=remark, status=status, page=page, page_size=page_size, after=after, to_dict=False)
     return respSuccessJson(res)
 
 
+@router.get("/perm-label/export", summary="导出权限标识")
+async def export_perm_label(*,
+                            u: Users = Depends(deps.user_perm(["perm:label:export"])),
+                            fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                            status: int = Query(None),
+                            label: str = Query(None),
+                            remark: str = Query(None),
+                            ):
+    filters = curd_perm_label.search_filters(label=label, remark=remark, status=status)
+    return respExportStream(curd_perm_label.stream(filters=filters), fmt, filename="perm_labels")
+
+
 @router.get("/perm-label/{_id}", summary="通过ID获取权限标识")
 async def get_perm_label(*,
                         db: Session = Depends(deps.get_db),
@@ -344,3 +455,14 @@ async def del_perm_label(*,
                         ):
     await curd_perm_label.delete(db, _id=_id, deleter_id=u['id'])
     return respSuccessJson()
+
+
+async def _invalidate_users(db: Session, r: asyncRedis, ids: List[int]):
+    await principal_cache.invalidate(r, ids)
+    perm_matrix.invalidate()
+
+
+router.include_router(create_batch_router(curd_user, "perm:user", fields=("status", "is_active"),
+                                          after_change=_invalidate_users), prefix="/user")
+router.include_router(create_batch_router(curd_role, "perm:role", fields=("status", "order_num")), prefix="/role")
+router.include_router(create_batch_router(curd_perm_label, "perm:label"), prefix="/perm-label")
@@ -1,6 +1,7 @@
 from datetime import timedelta
 import json
-from sqlalchemy import func, select
+from typing import List, Optional
+from sqlalchemy import bindparam, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 try:
@@ -16,12 +17,13 @@ class CURDConfigSetting(CRUDBase):
     CACHE_ID_KEY = "curd_config_setting_key_ID_"
     EXPIRE_TIME = timedelta(minutes=15)
 
-    async def get_by_key(self, db: AsyncSession, key: str) -> dict:
+    async def get_by_key(self, db: AsyncSession, key: str, status_in: Optional[List[int]] = None) -> dict:
         status_in = status_in or (0,)
-        obj = (await db.execute(
+        obj = (await db.execute(self.cached_sql("get_by_key", lambda: 
             select(self.model).where(
-                self.model.key == key, self.model.is_deleted == 0, self.model.status.in_(status_in))
-        )).scalar()
+                self.model.key == bindparam("key"), self.model.is_deleted == 0, 
+                self.model.status.in_(bindparam("status_in", expanding=True)))
+        ), {"key": key, "status_in": list(status_in)})).scalar()
         return {} if not obj else {
             'id': obj.id,
             'key': obj.key, 
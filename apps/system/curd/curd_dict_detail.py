@@ -1,7 +1,7 @@
 from typing import List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import func, select
+from sqlalchemy.sql import bindparam, func, select
 from common.curd_base import CRUDBase
 from ..models.dictionaries import DictDetails, DictData
 
@@ -10,19 +10,30 @@ class CURDDictDetail(CRUDBase):
         
     async def get(self, db: AsyncSession, _id: int, to_dict: bool = True):
         """ 通过id获取 """
-        obj = (await db.execute(
+        obj = (await db.execute(self.cached_sql("get", lambda: self.read_sql(
             select(*self.query_columns, DictData.dict_name, DictData.dict_type)
             .join(DictData, self.model.dict_data_id == DictData.id, isouter=True)    # join(..., isouter=True) == LEFT JOIN， join(...) == INNER JOIN， 不支持 RIGHT JOIN (可以考虑表顺序实现), 有外键的时候可以省略 指定关联字段即第二个参数
-            .where(self.model.id == _id, self.model.is_deleted == 0)
-        )).first()
+            .where(self.model.id == bindparam("id"), self.model.is_deleted == 0)
+        )), {"id": _id})).first()
         return dict(obj._mapping) if to_dict else obj
     
+    def search_filters(self, *, dict_data_id: int = 0, label: str = "", status: int = None) -> list:
+        """ 字典值列表/导出的查询条件 """
+        filters = []
+        if dict_data_id:
+            filters.append(self.model.dict_data_id == dict_data_id)
+        if label:
+            filters.append(self.model.dict_label.like(f"%{label}%"))
+        if status is not None:
+            filters.append(self.model.status == status)
+        return filters
+
     async def get_max_order_num(self, db: AsyncSession, *, dict_data_id: int ) -> int:
-        res = (await db.execute(
+        res = (await db.execute(self.cached_sql("get_max_order_num", lambda: 
             select(func.max(DictDetails.order_num).label('max_order_num'))
-            .where(DictDetails.dict_data_id == dict_data_id, DictDetails.is_deleted == 0)
-        )).first()
-        return res['max_order_num'] if res else 0
+            .where(DictDetails.dict_data_id == bindparam("dict_data_id"), DictDetails.is_deleted == 0)
+        ), {"dict_data_id": dict_data_id})).scalar()
+        return res or 0
 
 
 curd_dict_detail = CURDDictDetail(DictDetails)
\ No newline at end of file
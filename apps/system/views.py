@@ -1,36 +1,42 @@
-from typing import Any, Optional
+from typing import Any, List, Literal, Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from core.logger import logger
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import asc
+from sqlalchemy import asc, select
 try:
     from redis.asyncio import Redis as asyncRedis
 except ImportError:
     from aioredis import Redis as asyncRedis
-from common.resp import respSuccessJson
+from common.batch_router import create_batch_router
+from common.codec import CodecRoute
+from common.resp import respSuccessJson, respExportStream
 from .models import DictData, DictDetails, ConfigSettings
 from .schemas import ConfigSettingSchema, DictDataSchema, DictDetailSchema
 from .curd.curd_config_setting import curd_config_setting
 from .curd.curd_dict_data import curd_dict_data
 from .curd.curd_dict_detail import curd_dict_detail
 from common import deps
+from db.session import async_session_manager
+from db.slow_query import slow_query_recorder
+from db.sql_stats import sql_stats_summary
 from ..permission.models import Users
 
-router = APIRouter()
+router = APIRouter(route_class=CodecRoute)
 
 
 @router.get("/config-setting", summary="获取配置设置列表")
 async def get_config_settings_list(*,
-                                    db: AsyncSession = Depends(deps.get_db),
+                                    db: AsyncSession = Depends(deps.get_read_db),
                                     u: Users = Depends(deps.user_perm(["system:config-setting:get"])),
                                     page: int = 1,
                                     page_size: int = 20,
                                     name: str = "",
                                     key: str = "",
-                                    status: int = None
+                                    status: int = None,
+                                    after: str = Query(None, description=deps.AFTER_QUERY_DESCRIPTION),
                                     ):
     filters = []
     if name:
@@ -39,8 +45,13 @@ async def get_config_settings_list(*,
         filters.append(ConfigSettings.key.like(f"%{key}%"))
     if status is not None:
         filters.append(ConfigSettings.status == status)
+    if after is not None:   # 游标分页
+        data, next_cursor = await curd_config_setting.get_multi_by_cursor(
+            db, filters=filters, after=after, page_size=page_size, order_bys=[asc(ConfigSettings.order_num)],
+            to_dict=False)
+        return respSuccessJson({'data': data, 'next': next_cursor, 'limit': page_size})
     data, total, offset, limit = await curd_config_setting.get_multi(
-        db, filters=filters, page=page, page_size=page_size, order_bys=[asc(ConfigSettings.order_num)])
+        db, filters=filters, page=page, page_size=page_size, order_bys=[asc(ConfigSettings.order_num)], to_dict=False)
     return respSuccessJson({'data': data, 'total': total, 'offset': offset, 'limit': limit})
 
 
@@ -116,7 +127,7 @@ async def del_config_setting_by_id(*,
 async def get_dict(*,
                   _type: str,
                   r: asyncRedis = Depends(deps.get_redis),
-                  db: AsyncSession = Depends(deps.get_db)
+                  db: AsyncSession = Depends(deps.get_read_db)
                   ):
     if r: 
         result = await curd_dict_data.get_by_type_with_cache(r, db, _type=_type)
@@ -127,13 +138,14 @@ async def get_dict(*,
 
 @router.get("/dict/data", summary="获取字典")
 async def list_dict_data(*, 
-                        db: AsyncSession = Depends(deps.get_db),
+                        db: AsyncSession = Depends(deps.get_read_db),
                         u: Users = Depends(deps.user_perm(["system:dict:get"])),
                         page: int = 1,
                         page_size: int = 20,
                         dict_name: str = "",
                         dict_type: str = "",
                         status: int = None,
+                        after: str = Query(None, description=deps.AFTER_QUERY_DESCRIPTION),
                         ):
     filters = []
     if dict_name:
@@ -142,8 +154,12 @@ async def list_dict_data(*,
         filters.append(DictData.dict_type.like(f"%{dict_type}%"))
     if status is not None:
         filters.append(DictData.status == status)
+    if after is not None:   # 游标分页
+        data, next_cursor = await curd_dict_data.get_multi_by_cursor(
+            db, after=after, page_size=page_size, filters=filters, order_bys=[asc(DictData.order_num)], to_dict=False)
+        return respSuccessJson({'data': data, 'next': next_cursor, 'limit': page_size})
     data, total, offset, limit = await curd_dict_data.get_multi(
-        db, page=page, page_size=page_size, filters=filters, order_bys=[asc(DictData.order_num)])
+        db, page=page, page_size=page_size, filters=filters, order_bys=[asc(DictData.order_num)], to_dict=False)
     return respSuccessJson({'data': data, 'total': total, 'offset': offset, 'limit': limit})
 
 
@@ -202,26 +218,39 @@ async def del_dict_data(*,
 
 @router.get("/dict/detail", summary="获取字典值")
 async def list_dict_detail(*, 
-                            db: AsyncSession = Depends(deps.get_db),
+                            db: AsyncSession = Depends(deps.get_read_db),
                             u: Users = Depends(deps.user_perm(["system:dict:detail:get"])),
                             page: int = 1,
                             page_size: int = 20,
                             dict_data_id: int = 0,
                             label: str = "",
-                            status: int = None
+                            status: int = None,
+                            after: str = Query(None, description=deps.AFTER_QUERY_DESCRIPTION),
                             ):
-    filters = []
-    if dict_data_id:
-        filters.append(DictDetails.dict_data_id == dict_data_id)
-    if label:
-        filters.append(DictDetails.dict_label.like(f"%{label}%"))
-    if status is not None:
-        filters.append(DictDetails.status == status)
+    filters = curd_dict_detail.search_filters(dict_data_id=dict_data_id, label=label, status=status)
+    if after is not None:   # 游标分页
+        data, next_cursor = await curd_dict_detail.get_multi_by_cursor(
+            db, after=after, page_size=page_size, filters=filters, order_bys=[asc(DictDetails.order_num)],
+            to_dict=False)
+        return respSuccessJson({'data': data, 'next': next_cursor, 'limit': page_size})
     data, total, offset, limit = await curd_dict_detail.get_multi(
-        db, page=page, page_size=page_size, filters=filters, order_bys=[asc(DictDetails.order_num)])
+        db, page=page, page_size=page_size, filters=filters, order_bys=[asc(DictDetails.order_num)], to_dict=False)
     return respSuccessJson({'data': data, 'total': total, 'offset': offset, 'limit': limit})
 
 
+@router.get("/dict/detail/export", summary="导出字典值")
+async def export_dict_detail(*, 
+                             u: Users = Depends(deps.user_perm(["system:dict:detail:export"])),
+                             fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+                             dict_data_id: int = 0,
+                             label: str = "",
+                             status: int = None
+                             ):
+    filters = curd_dict_detail.search_filters(dict_data_id=dict_data_id, label=label, status=status)
+    return respExportStream(curd_dict_detail.stream(filters=filters, order_bys=[asc(DictDetails.order_num)]), 
+                            fmt, filename="dict_details")
+
+
 @router.get("/dict/detail/{_id}", summary="获取单个字典值")
 async def get_dict_detail(*,
                             _id: int,
@@ -279,4 +308,62 @@ async def get_dict_detail_max_order_num(*,
                                         db: AsyncSession = Depends(deps.get_db)
                                         ):
     return respSuccessJson({
-        "max_order_num": await curd_dict_detail.get_max_order_num(db, dict_data_id=dict_data_id)})
\ No newline at end of file
+        "max_order_num": await curd_dict_detail.get_max_order_num(db, dict_data_id=dict_data_id)})
+
+
+@router.get("/monitor/db-pool", summary="获取当前worker进程的数据库连接池状态")
+async def get_db_pool_status(*,
+                            u: Users = Depends(deps.user_perm(["system:monitor:get"]))
+                            ):
+    return respSuccessJson(async_session_manager.pool_status())
+
+
+@router.get("/monitor/sql-stats", summary="获取当前worker进程按路由汇总的SQL统计")
+async def get_sql_stats(*,
+                        u: Users = Depends(deps.user_perm(["system:monitor:get"]))
+                        ):
+    return respSuccessJson(sql_stats_summary.to_dict())
+
+
+@router.delete("/monitor/sql-stats", summary="清空当前worker进程的SQL统计")
+async def clear_sql_stats(*,
+                          u: Users = Depends(deps.user_perm(["system:monitor:delete"]))
+                          ):
+    sql_stats_summary.clear()
+    return respSuccessJson()
+
+
+@router.get("/monitor/slow-queries", summary="获取当前worker进程最近的慢查询记录")
+async def get_slow_queries(*,
+                           u: Users = Depends(deps.user_perm(["system:monitor:get"]))
+                           ):
+    return respSuccessJson(list(reversed(slow_query_recorder.recent)))
+
+
+async def _clear_config_setting_cache(db: AsyncSession, r: Optional[asyncRedis], ids: List[int]):
+    if r:
+        for _id in ids:
+            await curd_config_setting.delete_cache_by_id(r, _id=_id)
+
+
+async def _clear_dict_data_cache(db: AsyncSession, r: Optional[asyncRedis], ids: List[int]):
+    if r:
+        for _id in ids:
+            await curd_dict_data.delete_cache_by_id(r, _id=_id)
+
+
+async def _clear_dict_detail_cache(db: AsyncSession, r: Optional[asyncRedis], ids: List[int]):
+    if r:
+        dict_data_ids = (await db.execute(
+            select(DictDetails.dict_data_id).where(DictDetails.id.in_(ids)).distinct()
+        )).scalars().all()
+        await _clear_dict_data_cache(db, r, dict_data_ids)
+
+
+router.include_router(create_batch_router(curd_config_setting, "system:config-setting",
+                                          before_change=_clear_config_setting_cache), prefix="/config-setting")
+router.include_router(create_batch_router(curd_dict_data, "system:dict", fields=("status", "order_num"),
+                                          before_change=_clear_dict_data_cache), prefix="/dict/data")
+router.include_router(create_batch_router(curd_dict_detail, "system:dict:detail",
+                                          fields=("status", "order_num", "is_default"),
+                                          before_change=_clear_dict_detail_cache), prefix="/dict/detail")
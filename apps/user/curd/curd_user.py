@@ -1,5 +1,5 @@
 from typing import List
-from sqlalchemy import distinct, desc, asc, func, select, update
+from sqlalchemy import bindparam, distinct, desc, asc, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, selectinload
 from apps.permission.models.menu import Menus
@@ -7,8 +7,7 @@ from apps.permission.models.role import RoleMenu, Roles
 from apps.permission.models.user import Users, UserRole
 from apps.system.models import ConfigSettings
 from common.curd_base import CRUDBase
-from common.security import verify_password, get_password_hash
-from fastapi.encoders import jsonable_encoder
+from common.security import verify_password_async, verify_and_update_password_async, get_password_hash_async
 
 
 class CURDUser(CRUDBase):
@@ -16,31 +15,43 @@ class CURDUser(CRUDBase):
         """
         通过用户名获取用户
         """
-        return (await db.execute(select(Users).where(Users.username == username))).scalar()
+        return (await db.execute(self.cached_sql("get_by_username", lambda: 
+            select(Users).where(Users.username == bindparam("username"))
+        ), {"username": username})).scalar()
 
     async def get_by_email(self, db: AsyncSession, *, email: str):
         """
         通过email获取用户
         """
-        return (await db.execute(select(Users).where(Users.email == email))).scalar()
+        return (await db.execute(self.cached_sql("get_by_email", lambda: 
+            select(Users).where(Users.email == bindparam("email"))
+        ), {"email": email})).scalar()
 
     async def get_by_phone(self, db: AsyncSession, *, phone: str):
         """
         通过手机号获取用户
         """
-        return (await db.execute(select(Users).where(Users.phone == phone))).scalar()
+        return (await db.execute(self.cached_sql("get_by_phone", lambda: 
+            select(Users).where(Users.phone == bindparam("phone"))
+        ), {"phone": phone})).scalar()
 
     async def authenticate(self, db: AsyncSession, *, user: str, password: str):
         if user.find("@") > 0:
             u = await self.get_by_email(db, email=user)
         elif user.startswith('1') and user.isdigit():
-            u = await self.getByPhone(db, phone=user)
+            u = await self.get_by_phone(db, phone=user)
         else:
             u = await self.get_by_username(db, username=user)
         if not u:
             return None
-        if not verify_password(password, u.hashed_password):
+        valid, new_hash = await verify_and_update_password_async(password, u.hashed_password)
+        if not valid:
             return None
+        if new_hash:    # 哈希的算法或强度已经过时, 登录成功时用新的策略重新哈希
+            await db.execute(update(self.model).values({self.model.hashed_password: new_hash})
+                             .where(self.model.id == u.id))
+            await db.commit()
+            await db.refresh(u)
         return u
 
     async def check_username_availability(self, db: AsyncSession, *, username: str, exclude_id: int = None):
@@ -65,8 +76,8 @@ class CURDUser(CRUDBase):
         return (await db.execute(sql)).scalar() == 0
 
     async def create(self, db: AsyncSession, *, obj_in, creator_id: int = 0):
-        obj_in_data = jsonable_encoder(obj_in)
-        obj_in_data['hashed_password'] = get_password_hash(obj_in_data['password'])
+        obj_in_data = self.encode(obj_in, extra_fields=("password",))
+        obj_in_data['hashed_password'] = await get_password_hash_async(obj_in_data['password'])
         del obj_in_data['password']
         init_roles = db.query(ConfigSettings.value).filter(
             ConfigSettings.key == 'user_init_roles', ConfigSettings.is_deleted == 0, ConfigSettings.status == 0
@@ -150,7 +161,7 @@ class CURDUser(CRUDBase):
         update_data = {self.model.avatar: avatar_path}
         if modifier_id:
             update_data['modifier_id'] = modifier_id
-        await db.execute(update(self.model).values(**update_data)
+        await db.execute(update(self.model).values(update_data)
                         .where(self.model.id == _id, self.model.is_deleted == 0))
         await db.commit()
 
@@ -158,11 +169,11 @@ class CURDUser(CRUDBase):
         hashed_password = (await db.execute(
             select(self.model.hashed_password).where(self.model.id == _id, self.model.is_deleted == 0)
         )).scalar()
-        return bool(hashed_password and verify_password(pwd, hashed_password))
+        return bool(hashed_password and await verify_password_async(pwd, hashed_password))
 
     async def change_pwd(self, db: AsyncSession, _id: int, *, pwd: str):
-        update_data = {self.model.hashed_password: get_password_hash(pwd)}
-        await db.execute(update(self.model).values(**update_data)
+        update_data = {self.model.hashed_password: await get_password_hash_async(pwd)}
+        await db.execute(update(self.model).values(update_data)
                          .where(self.model.id == _id, self.model.is_deleted == 0))
         await db.commit()
 
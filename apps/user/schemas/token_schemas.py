@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -9,3 +9,7 @@ class Token(BaseModel):
 class TokenPayload(BaseModel):
     token: str
     sub: Optional[int] = None
+    # TOKEN_PERM_CLAIMS 时登录token中的权限信息: 角色id, 是否超级管理员, 签发时的权限版本号
+    roles: Optional[List[int]] = None
+    su: Optional[bool] = None
+    pv: Optional[int] = None
@@ -18,6 +18,10 @@ from core import constants
 from apps.permission.models.user import Users
 from common import error_code, deps, security
 
+from common.codec import CodecRoute
+from common.perm_matrix import perm_matrix
+from common.principal import principal_cache
+from common.token_cache import token_cache
 from common.resp import respSuccessJson, respErrorJson
 from core import constants
 from core.config import settings
@@ -26,7 +30,7 @@ from .curd.curd_user import curd_user
 from ..permission.curd.curd_perm_label import curd_perm_label
 
 
-router = APIRouter()
+router = APIRouter(route_class=CodecRoute)
 
 
 @router.post("/login", summary="用户登录")
@@ -47,8 +51,9 @@ async def login(*,
     elif not user.is_active:
         return respErrorJson(error=error_code.ERROR_USER_NOT_ACTIVATE)
     access_token_expires = timedelta(minutes=constants.ACCESS_TOKEN_EXPIRE_MINUTES)
-    # 登录token 只存放了user.id
-    token = security.create_access_token(user.id, expires_delta=access_token_expires)
+    # 登录token 只存放了user.id, TOKEN_PERM_CLAIMS 时还有权限信息
+    claims = await perm_matrix.token_claims(user.id, user.is_superuser) if settings.TOKEN_PERM_CLAIMS else None
+    token = security.create_access_token(user.id, expires_delta=access_token_expires, claims=claims)
     await redis.setex(constants.REDIS_KEY_LOGIN_TOKEN_KEY_PREFIX + token,
                       timedelta(minutes=constants.ACCESS_TOKEN_EXPIRE_MINUTES),
                       user.id)
@@ -60,8 +65,7 @@ async def logout(*,
                  token_data: str = Depends(deps.check_jwt_token),
                  redis: Redis = Depends(deps.get_redis),
                  ):
-    token = token_data.token
-    await redis.delete(constants.REDIS_KEY_LOGIN_TOKEN_KEY_PREFIX + token)
+    await token_cache.revoke(redis, token_data.token)
     return respSuccessJson()
 
 
@@ -114,11 +118,13 @@ async def get_user_info(*,
 @router.put("/info", summary="修改个人信息")
 async def change_user_info(*,
                             db: AsyncSession = Depends(deps.get_db),
+                            redis: Redis = Depends(deps.get_redis),
                             token_data=Depends(deps.check_jwt_token),
                             obj: user_info_schemas.ChangeUserInfoSchema
                             ):
     user_id = token_data.sub
     await curd_user.update(db, _id=user_id, obj_in=obj, modifier_id=user_id)
+    await principal_cache.invalidate(redis, [user_id])
     return respSuccessJson()
 
 
@@ -133,7 +139,7 @@ async def change_password(*,
     if not await curd_user.check_pwd(db, _id=user_id, pwd=obj.old_password):
         return respErrorJson(error=error_code.ERROR_USER_PASSWORD_ERROR)
     await curd_user.change_pwd(db, _id=user_id, pwd=obj.new_password)
-    await redis.delete(constants.REDIS_KEY_LOGIN_TOKEN_KEY_PREFIX + token)
+    await token_cache.revoke(redis, token)
     return respSuccessJson()
 
 
@@ -312,6 +318,7 @@ async def get_user_routers_tree(*,
 @router.post("/avatar", summary="改变头像")
 async def change_avatar(*,
                         db: AsyncSession = Depends(deps.get_db),
+                        redis: Redis = Depends(deps.get_redis),
                         token_data=Depends(deps.check_jwt_token),
                         img: UploadFile
                         ):
@@ -323,6 +330,7 @@ async def change_avatar(*,
     with open(os.path.join(constants.MEDIA_BASE_PATH, path), 'wb') as f:
         f.write(img_data)
     await curd_user.set_avatar(db, _id=user_id, avatar_path=path, modifier_id=user_id)
+    await principal_cache.invalidate(redis, [user_id])
     return respSuccessJson({'avatar': path})
 
 
@@ -0,0 +1,111 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel, conlist
+from sqlalchemy.ext.asyncio import AsyncSession
+try:
+    from redis.asyncio import Redis as asyncRedis
+except ImportError:
+    from aioredis import Redis as asyncRedis
+
+from common import deps, error_code
+from common.curd_base import CRUDBase
+from common.codec import CodecRoute
+from common.resp import respSuccessJson, respErrorJson
+from core import constants
+
+
+# 批量修改前/后的回调, 用于清理缓存等: await before_change(db, redis, ids)
+ChangeHook = Callable[[AsyncSession, Optional[asyncRedis], List[int]], Awaitable[Any]]
+
+
+# 批量操作的id列表, 1 ~ BATCH_MAX_IDS 个 (pydantic v1 的长度参数是 min_items/max_items)
+if hasattr(BaseModel, "model_dump"):
+    BatchIds = conlist(int, min_length=1, max_length=constants.BATCH_MAX_IDS)
+else:
+    BatchIds = conlist(int, min_items=1, max_items=constants.BATCH_MAX_IDS)
+
+
+class BatchIdsSchema(BaseModel):
+    ids: BatchIds
+
+
+class BatchStatusSchema(BatchIdsSchema):
+    status: int
+
+
+class BatchFieldsSchema(BatchIdsSchema):
+    data: Dict[str, Any]
+
+
+def create_batch_router(crud: CRUDBase, perm_prefix: str, *, fields: Sequence[str] = ("status",),
+                        before_change: Optional[ChangeHook] = None,
+                        after_change: Optional[ChangeHook] = None,
+                        chunk_size: Optional[int] = None) -> APIRouter:
+    """
+    为 CRUD 对象生成批量操作接口, 每 chunk_size 个id执行一条 ... WHERE id IN (...), 返回影响的行数:
+        POST /batch/delete     批量逻辑删除    权限: {perm_prefix}:delete
+        PUT  /batch/status     批量修改状态    权限: {perm_prefix}:put
+        PUT  /batch/fields     批量修改字段    权限: {perm_prefix}:put  (只能修改 fields 中的字段)
+    使用:
+        router.include_router(create_batch_router(curd_role, "perm:role", fields=("status", "order_num")),
+                              prefix="/role")
+    :param fields:          允许批量修改的字段
+    :param before_change:   修改前的回调 (清理缓存等)
+    :param after_change:    修改提交后的回调 (让带版本号的缓存失效等)
+    """
+    router = APIRouter(route_class=CodecRoute)
+    fields = frozenset(fields)
+    name = perm_prefix.replace(":", "_")
+
+    async def _before_change(db: AsyncSession, r: Optional[asyncRedis], ids: List[int]):
+        if before_change is not None:
+            await before_change(db, r, ids)
+
+    async def _after_change(db: AsyncSession, r: Optional[asyncRedis], ids: List[int]):
+        if after_change is not None:
+            await after_change(db, r, ids)
+
+    @router.post("/batch/delete", summary="批量删除", name=f"{name}_batch_delete")
+    async def batch_delete(*,
+                           db: AsyncSession = Depends(deps.get_db),
+                           r: asyncRedis = Depends(deps.get_redis),
+                           u: dict = Depends(deps.user_perm([f"{perm_prefix}:delete"])),
+                           obj: BatchIdsSchema,
+                           ):
+        await _before_change(db, r, obj.ids)
+        affected = await crud.delete_many(db, ids=obj.ids, deleter_id=u['id'], chunk_size=chunk_size)
+        await _after_change(db, r, obj.ids)
+        return respSuccessJson({'affected': affected})
+
+    @router.put("/batch/status", summary="批量修改状态", name=f"{name}_batch_status")
+    async def batch_status(*,
+                           db: AsyncSession = Depends(deps.get_db),
+                           r: asyncRedis = Depends(deps.get_redis),
+                           u: dict = Depends(deps.user_perm([f"{perm_prefix}:put"])),
+                           obj: BatchStatusSchema,
+                           ):
+        await _before_change(db, r, obj.ids)
+        affected = await crud.update_many(db, ids=obj.ids, obj_in={'status': obj.status},
+                                          modifier_id=u['id'], chunk_size=chunk_size)
+        await _after_change(db, r, obj.ids)
+        return respSuccessJson({'affected': affected})
+
+    @router.put("/batch/fields", summary="批量修改字段", name=f"{name}_batch_fields")
+    async def batch_fields(*,
+                           db: AsyncSession = Depends(deps.get_db),
+                           r: asyncRedis = Depends(deps.get_redis),
+                           u: dict = Depends(deps.user_perm([f"{perm_prefix}:put"])),
+                           obj: BatchFieldsSchema,
+                           ):
+        not_allowed = set(obj.data) - fields
+        if not obj.data or not_allowed:
+            return respErrorJson(error_code.ERROR_PARAMETER_ERROR,
+                                 msg_append=f": 只能修改字段 {', '.join(sorted(fields))}")
+        await _before_change(db, r, obj.ids)
+        affected = await crud.update_many(db, ids=obj.ids, obj_in=obj.data, modifier_id=u['id'],
+                                          chunk_size=chunk_size)
+        await _after_change(db, r, obj.ids)
+        return respSuccessJson({'affected': affected})
+
+    return router
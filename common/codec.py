@@ -0,0 +1,151 @@
+import contextvars
+import datetime
+import decimal
+import json
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from sqlalchemy.engine import Row, RowMapping
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(NamedTuple):
+    """ 接口数据的编解码器 """
+    media_type: str
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]
+
+
+def encode_default(obj: Any):
+    """
+    json/msgpack 编码不支持的类型:
+        查询结果的 Row/RowMapping 直接编码 (CRUD 查询传 to_dict=False), 忽略 _ 开头的内部字段 (_total, _cursor_0 等)
+        Decimal 和 jsonable_encoder 一致, 没有小数时为 int 否则为 float
+    """
+    if isinstance(obj, Row):
+        return {k: v for k, v in zip(obj._fields, obj) if k[0] != "_"}
+    if isinstance(obj, RowMapping):
+        return {k: v for k, v in obj.items() if k[0] != "_"}
+    if isinstance(obj, decimal.Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump() if hasattr(obj, "model_dump") else obj.dict()
+    if isinstance(obj, (datetime.date, datetime.time)):   # orjson 原生支持, 标准库 json 和 msgpack 走到这里
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def json_dumps(content: Any) -> bytes:
+    """ 直接编码为 bytes, 安装了 orjson 时使用 orjson, 否则使用标准库 json """
+    if orjson is not None:
+        return orjson.dumps(content, default=encode_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=encode_default).encode("utf-8")
+
+
+JSON_CODEC = Codec("application/json", json_dumps, orjson.loads if orjson is not None else json.loads)
+
+# media_type -> Codec, 请求没有指定或都不支持时使用 JSON_CODEC
+CODECS = {JSON_CODEC.media_type: JSON_CODEC}  # type: Dict[str, Codec]
+
+
+def register_codec(codec: Codec, *aliases: str):
+    """ 注册编解码器, aliases 为同一个编码的其他 media_type (例如 application/x-msgpack) """
+    for media_type in (codec.media_type, *aliases):
+        CODECS[media_type] = codec
+
+
+if msgpack is not None:
+    register_codec(Codec("application/msgpack",
+                         lambda content: msgpack.packb(content, default=encode_default, use_bin_type=True),
+                         lambda body: msgpack.unpackb(body, raw=False)),
+                   "application/x-msgpack", "application/vnd.msgpack")
+
+
+def negotiate(accept: Optional[str]) -> Codec:
+    """
+    根据请求头 Accept 选择返回数据的编码, 按 q 值从高到低取第一个已注册的, 都不支持时返回 json
+    """
+    if not accept:
+        return JSON_CODEC
+    best, best_q = JSON_CODEC, -1.0
+    for item in accept.split(","):
+        media_type, *params = item.split(";")
+        codec = CODECS.get(media_type.strip().lower())
+        if codec is None:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = codec, q
+    return best if best_q > 0 else JSON_CODEC
+
+
+# 当前请求返回数据使用的编码, 由 CodecRoute 根据 Accept 设置
+response_codec = contextvars.ContextVar("response_codec", default=JSON_CODEC)
+
+
+def content_type_codec(content_type: Optional[str]) -> Optional[Codec]:
+    if not content_type:
+        return None
+    return CODECS.get(content_type.split(";", 1)[0].strip().lower())
+
+
+class CodecRequest(Request):
+    """
+    支持 msgpack 请求体的 Request: FastAPI 只对 json 类型的请求体调用 request.json(),
+    所以 msgpack 请求的 Content-Type 在这里改为 application/json, json() 中用原来的编码解码
+    """
+
+    def __init__(self, scope, receive=None, send=None):
+        codec = None
+        for i, (key, value) in enumerate(scope.get("headers", ())):
+            if key == b"content-type":
+                codec = content_type_codec(value.decode("latin-1"))
+                if codec is not None and codec is not JSON_CODEC:
+                    headers = list(scope["headers"])
+                    headers[i] = (b"content-type", JSON_CODEC.media_type.encode("latin-1"))
+                    scope = dict(scope, headers=headers)
+                break
+        super().__init__(scope, receive, send)
+        self.codec = codec or JSON_CODEC
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = self.codec.loads(await self.body())
+        return self._json
+
+
+class CodecRoute(APIRoute):
+    """
+    请求体按 Content-Type 解码 (json / msgpack), 返回数据按 Accept 编码 (见 common.resp.CodecResponse):
+        router = APIRouter(route_class=CodecRoute)
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def codec_route_handler(request: Request) -> Response:
+            request = CodecRequest(request.scope, request.receive)
+            # 不需要 reset: 每个请求在单独的 context 中, 请求中抛出的异常返回的错误信息也使用同样的编码
+            response_codec.set(negotiate(request.headers.get("accept")))
+            return await handler(request)
+
+        return codec_route_handler
@@ -1,11 +1,21 @@
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union, Tuple
-from fastapi.encoders import jsonable_encoder
+import base64
+import datetime
+import decimal
+import json
+from typing import Any, AsyncGenerator, Callable, Dict, Generic, Iterable, List, NamedTuple, Optional, Set, Type, TypeVar, Union, Tuple
 from pydantic import BaseModel
-from sqlalchemy import func, select, update, delete, insert
+from sqlalchemy import and_, bindparam, func, or_, select, update, delete, insert
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.engine import Row
+from sqlalchemy.sql import Executable, operators
+from sqlalchemy.sql.elements import UnaryExpression
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 from db.base_class import Base, dt2ts
+from core.config import settings
+from db.count_cache import count_cache
+from db.session import async_session_manager, release_read_connection
+from common.exceptions import CursorInvalidError
 
 
 ModelType = TypeVar("ModelType", bound=Base)
@@ -26,10 +36,90 @@ custom_encoder_datetime2str_fn = lambda x : x.strftime("%Y-%m-%d %H:%M:%S")
 # END
 
 
+def _cursor_value_encode(v):
+    if isinstance(v, datetime.datetime):
+        return {'$dt': v.isoformat()}
+    if isinstance(v, datetime.date):
+        return {'$d': v.isoformat()}
+    if isinstance(v, decimal.Decimal):
+        return {'$dec': str(v)}
+    return v
+
+
+def _cursor_value_decode(v):
+    if isinstance(v, dict):
+        if '$dt' in v:
+            return datetime.datetime.fromisoformat(v['$dt'])
+        if '$d' in v:
+            return datetime.date.fromisoformat(v['$d'])
+        if '$dec' in v:
+            return decimal.Decimal(v['$dec'])
+    return v
+
+
+def encode_cursor(keys: List[str], values: list) -> str:
+    """
+    游标分页的游标: 排序字段名和最后一行排序字段值的 json 做 base64url 编码 (对前端是不透明的字符串)
+    """
+    data = json.dumps({'k': keys, 'v': [_cursor_value_encode(v) for v in values]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(keys: List[str], cursor: str) -> list:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = [_cursor_value_decode(v) for v in data['v']]
+    except Exception:
+        raise CursorInvalidError()
+    if data.get('k') != keys or len(values) != len(keys):  # 游标和当前的排序方式不一致
+        raise CursorInvalidError()
+    return values
+
+
+class AssociationChanges(NamedTuple):
+    """ sync_association 的结果: 新增和删除的关联id """
+    added: Set[int]
+    removed: Set[int]
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.removed)
+
+
+async def sync_association(db: AsyncSession, model: Type[Base], *, owner_col, owner_id: int, target_col, 
+                           target_ids: Iterable[int], ctl_id: int = 0, commit: bool = True) -> AssociationChanges:
+    """
+    同步中间表的关联: 读取当前关联的id, 只删除去掉的、插入新增的, 不再整体删除后重新插入
+        await sync_association(db, UserRole, owner_col=UserRole.user_id, owner_id=user_id, 
+                               target_col=UserRole.role_id, target_ids=role_ids)
+    :param owner_col: 关联的所属字段 (例如 UserRole.user_id)
+    :param target_col: 关联的目标字段 (例如 UserRole.role_id)
+    :return AssociationChanges(added, removed) 用于精确地清理缓存
+    """
+    rows = (await db.execute(select(target_col, model.is_deleted).where(owner_col == owner_id))).all()
+    current = {i[0] for i in rows if not i[1]}
+    deleted = {i[0] for i in rows if i[1]}   # 逻辑删除了的关联一起清理掉
+    target = set(target_ids)
+    added, removed = target - current, current - target
+    if removed or deleted:
+        await db.execute(delete(model).where(owner_col == owner_id, target_col.in_(removed | deleted)))
+    if added:
+        await db.execute(insert(model), [{owner_col.key: owner_id, target_col.key: i, 'creator_id': ctl_id} 
+                                         for i in sorted(added)])
+    if commit:
+        await db.commit()
+    return AssociationChanges(added, removed)
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
+    use_replica = True  # 查询方法(get/query/get_multi)是否允许走从库 (见 db.session.RoutingSession)
 
     def __init__(self, model: Type[ModelType]):
         self.model = model
+        self._sql_cache = {}  # type: Dict[str, Executable]
+        # 可写入的字段名白名单, 初始化时计算一次; 按 (schema类, extra_fields) 缓存 model_dump 的 include
+        self.write_fields = frozenset(self.model.__mapper__.column_attrs.keys())
+        self._encode_includes = {}  # type: Dict[Tuple[Any, Tuple[str, ...]], frozenset]
         self.query_columns = self.model.list_columns() # 取model中的有Column
         self.exclude_columns = [
             self.model.created_time, self.model.modified_time, self.model.is_deleted]
@@ -47,6 +137,24 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         """
         pass
 
+    def read_sql(self, sql):
+        """
+        标记查询语句可以走只读从库 (读写分离)
+        """
+        return sql.execution_options(use_replica=self.use_replica)
+
+    def cached_sql(self, name: str, build: Callable[[], Executable]) -> Executable:
+        """
+        预先构建的语句(参数用 bindparam), 每个CRUD实例只构建一次, 执行时传入参数:
+            sql = self.cached_sql("get", lambda: select(...).where(self.model.id == bindparam("id")))
+            await db.execute(sql, {"id": _id})
+        重复执行同一个语句对象时 SQLAlchemy 不需要重新构建表达式和计算缓存key, 直接命中编译缓存
+        """
+        sql = self._sql_cache.get(name)
+        if sql is None:
+            sql = self._sql_cache[name] = build()
+        return sql
+
     async def get(self, db: AsyncSession, _id: int, 
                   to_dict: bool = True) -> Union[ModelType, dict]:
         """ 通过id获取 """
@@ -55,9 +163,10 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         #     select(self.model).where(self.model.id == _id, self.model.is_deleted == 0)
         # )).scalar()  # type: Base
         # 字段的方式查询
-        obj = (await db.execute(
-            select(*self.query_columns).where(self.model.id == _id, self.model.is_deleted == 0)
-        )).first()   # type: Row
+        obj = (await db.execute(self.cached_sql("get", lambda: self.read_sql(
+            select(*self.query_columns).where(self.model.id == bindparam("id"), self.model.is_deleted == 0)
+        )), {"id": _id})).first()   # type: Row
+        await release_read_connection(db)
         return dict(obj._mapping) if obj and to_dict else obj
 
     async def query(self, db: AsyncSession, *, queries: Optional[list] = None, 
@@ -68,59 +177,287 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         queries = queries or self.query_columns
         sql = select(*queries).where(*filters)
         if order_bys:
-            sql.order_by(*order_bys)
-        obj = (await db.execute(sql)).all()
+            sql = sql.order_by(*order_bys)
+        obj = (await db.execute(self.read_sql(sql))).all()
+        await release_read_connection(db)
         return [dict(i._mapping) for i in obj] if obj and to_dict else obj
 
+    async def stream(self, db: Optional[AsyncSession] = None, *, queries: Optional[list] = None, 
+                     filters: Optional[list] = None, order_bys: Optional[list] = None, 
+                     batch_size: Optional[int] = None, to_dict: bool = True
+                     ) -> AsyncGenerator[Union[dict, Row], None]:
+        """
+        流式查询: 使用服务端游标每次从数据库读取 batch_size(默认 SQL_STREAM_BATCH_SIZE) 行, 不会把整个结果集读到内存中
+            async for row in curd.stream(filters=[...]):
+                ...
+        :param db: 不传时使用单独的只读session (用于 StreamingResponse, 请求的依赖在响应发送前就已经关闭)
+        """
+        if db is None:
+            async with async_session_manager.read_session() as db:
+                async for row in self.stream(db, queries=queries, filters=filters, order_bys=order_bys, 
+                                             batch_size=batch_size, to_dict=to_dict):
+                    yield row
+            return
+        filters = (filters or []) + [self.model.is_deleted == 0]
+        sql = select(*(queries or self.query_columns)).where(*filters)
+        if order_bys:
+            sql = sql.order_by(*order_bys)
+        sql = sql.execution_options(yield_per=batch_size or settings.SQL_STREAM_BATCH_SIZE)
+        result = await db.stream(self.read_sql(sql))
+        async for partition in result.partitions():
+            for row in partition:
+                yield dict(row._mapping) if to_dict else row
+
+    @staticmethod
+    def support_window_count(db: AsyncSession) -> bool:
+        """
+        数据库是否支持 COUNT(*) OVER() 窗口函数 (mysql 需要 8.0 以上, 还未连接过数据库不知道版本时返回 False)
+        """
+        if not settings.SQL_PAGE_WINDOW_COUNT:
+            return False
+        dialect = db.get_bind().dialect
+        version = dialect.server_version_info or ()
+        if dialect.name in ("mysql", "mariadb"):
+            return bool(version) and version >= ((10, 2) if getattr(dialect, "is_mariadb", False) else (8, 0))
+        if dialect.name == "sqlite":
+            return version >= (3, 25)
+        return dialect.name in ("postgresql", "mssql", "oracle")
+
+    async def count(self, db: AsyncSession, *, filters: Optional[list] = None) -> int:
+        """
+        符合条件的数量, 开启了 SQL_COUNT_CACHE_SECONDS 时使用缓存
+        """
+        filters = (filters or []) + [self.model.is_deleted == 0]
+        sql = select(func.count(self.model.id)).where(*filters)
+        fp = count_cache.fingerprint(sql) if count_cache.enable else None
+        if fp is not None:
+            total = count_cache.get(self.model.__tablename__, fp)
+            if total is not None:
+                return total
+        total = (await db.execute(self.read_sql(sql))).scalar()
+        if fp is not None:
+            count_cache.set(self.model.__tablename__, fp, total)
+        return total
+
     async def get_multi(self, db: AsyncSession, *, queries: Optional[list] = None, 
                         filters: Optional[list] = None, order_bys: Optional[list] = None, 
                         page: int = 1, page_size: int = 25, to_dict: bool = True
                        ) -> Tuple[List[ModelType], int, int, int]:
         """
         分页查询
+        总数的获取: 1. 有总数缓存时使用缓存  2. 数据库支持窗口函数时和数据在同一条语句中用 COUNT(*) OVER() 查出
+                   3. 单独执行一次 COUNT  (页数超出时 2 查不到数据也拿不到总数, 会再执行 3)
         :return (data, total, offset, limit)
         """
+        base_filters = filters
         filters = (filters or []) + [self.model.is_deleted == 0]
         queries = queries or self.query_columns
         sql = select(*queries).where(*filters)
         if order_bys:
-            sql.order_by(*order_bys)
+            sql = sql.order_by(*order_bys)
         temp_page = ((page if page > 0 else 1) - 1) * page_size
-        total = (await db.execute(select(func.count(self.model.id)).where(*filters))).scalar()
+        total, obj = None, None
+        count_sql = select(func.count(self.model.id)).where(*filters)
+        fp = count_cache.fingerprint(count_sql) if count_cache.enable else None
+        if fp is not None:
+            total = count_cache.get(self.model.__tablename__, fp)
+        if total is None and self.support_window_count(db):
+            obj = (await db.execute(self.read_sql(
+                sql.add_columns(func.count().over().label("_total")).offset(temp_page).limit(page_size)
+            ))).all()
+            if obj:
+                total = obj[0]._total
+                if fp is not None:
+                    count_cache.set(self.model.__tablename__, fp, total)
+        if total is None:
+            total = await self.count(db, filters=base_filters)
         if temp_page + page_size > total:   # 页数超出后显示最后一页， 不需要可以注释掉
-            temp_page = total - (total % page_size)
-        sql = sql.offset(temp_page).limit(page_size)
-        obj = (await db.execute(sql)).all()
-        return [dict(i._mapping) for i in obj] if  obj and to_dict else obj, total, temp_page, page_size
+            last_page = total - (total % page_size)
+            if last_page != temp_page:
+                temp_page, obj = last_page, None
+        if obj is None:
+            obj = (await db.execute(self.read_sql(sql.offset(temp_page).limit(page_size)))).all()
+        await release_read_connection(db)
+        if not (obj and to_dict):
+            return obj, total, temp_page, page_size
+        data = []
+        for i in obj:
+            item = dict(i._mapping)
+            item.pop("_total", None)
+            data.append(item)
+        return data, total, temp_page, page_size
+
+    def _keyset_columns(self, order_bys: Optional[list] = None) -> List[Tuple[Any, bool]]:
+        """
+        游标分页的排序字段 [(字段, 是否倒序), ...], 最后补上 id 保证排序唯一
+        """
+        columns = []
+        for ob in order_bys or []:
+            if isinstance(ob, UnaryExpression) and ob.modifier in (operators.desc_op, operators.asc_op):
+                columns.append((ob.element, ob.modifier is operators.desc_op))
+            else:
+                columns.append((ob, False))
+        id_col = self.model.id.expression
+        if not any(id_col.compare(getattr(col, 'expression', col)) for col, _ in columns):
+            columns.append((self.model.id, columns[-1][1] if columns else False))
+        return columns
+
+    async def get_multi_by_cursor(self, db: AsyncSession, *, queries: Optional[list] = None, 
+                                  filters: Optional[list] = None, order_bys: Optional[list] = None, 
+                                  after: Optional[str] = None, page_size: int = 25, to_dict: bool = True
+                                  ) -> Tuple[List[ModelType], Optional[str]]:
+        """
+        游标(keyset)分页查询, 不使用 OFFSET 和 COUNT, 翻到多深的页都只读取 page_size 行。
+        排序字段需要非空, 并且最好有包含排序字段和id的索引
+        :param after:   上一页返回的游标, 不传(或空字符串)从第一页开始
+        :return (data, next) next 为下一页的游标, 没有下一页时为 None
+        """
+        columns = self._keyset_columns(order_bys)
+        keys = [getattr(col, "key", None) or str(col) for col, _ in columns]
+        filters = (filters or []) + [self.model.is_deleted == 0]
+        if after:
+            values = decode_cursor(keys, after)
+            conditions = []
+            for i, (col, is_desc) in enumerate(columns):
+                eqs = [c == v for (c, _), v in zip(columns[:i], values[:i])]
+                conditions.append(and_(*eqs, col < values[i] if is_desc else col > values[i]))
+            filters.append(or_(*conditions))
+        queries = queries or self.query_columns
+        cursor_labels = [f"_cursor_{i}" for i in range(len(columns))]
+        sql = select(*queries, *[col.label(label) for (col, _), label in zip(columns, cursor_labels)]
+                     ).where(*filters).order_by(*[col.desc() if is_desc else col.asc() for col, is_desc in columns]
+                     ).limit(page_size + 1)
+        obj = (await db.execute(self.read_sql(sql))).all()
+        await release_read_connection(db)
+        next_cursor = None
+        if len(obj) > page_size:
+            obj = obj[:page_size]
+            next_cursor = encode_cursor(keys, [getattr(obj[-1], label) for label in cursor_labels])
+        if not to_dict:
+            return obj, next_cursor
+        data = []
+        for i in obj:
+            item = dict(i._mapping)
+            for label in cursor_labels:
+                item.pop(label, None)
+            data.append(item)
+        return data, next_cursor
+
+    def _encode_include(self, key: Any, fields: Iterable[str], extra_fields: Tuple[str, ...]) -> frozenset:
+        include = self._encode_includes.get((key, extra_fields))
+        if include is None:
+            include = self._encode_includes[(key, extra_fields)] = \
+                frozenset(fields) & (self.write_fields | frozenset(extra_fields))
+        return include
+
+    def encode(self, obj_in: Union[BaseModel, Dict[str, Any]], *, extra_fields: Tuple[str, ...] = ()) -> dict:
+        """
+        新增/修改的数据转为字典, 只保留表中的字段 (和 extra_fields, 例如 roles 等由子类处理的关联数据)。
+        pydantic 对象直接 model_dump(include=...), 字段白名单按 schema 类只计算一次 (替代 jsonable_encoder)
+        """
+        if isinstance(obj_in, BaseModel):
+            schema = type(obj_in)
+            if hasattr(obj_in, "model_dump"):
+                return obj_in.model_dump(include=self._encode_include(schema, schema.model_fields, extra_fields))
+            return obj_in.dict(include=self._encode_include(schema, schema.__fields__, extra_fields))  # pydantic v1
+        include = self._encode_include(None, self.write_fields.union(extra_fields), extra_fields)
+        return {k: v for k, v in obj_in.items() if k in include}
+
+    def encode_obj_in(self, obj_in: Union[CreateSchemaType, Dict[str, Any]], creator_id: int = 0) -> dict:
+        """ 新增数据转为字典 """
+        obj_in_data = self.encode(obj_in)
+        obj_in_data['creator_id'] = creator_id
+        return obj_in_data
 
     async def create(self, db: AsyncSession, *, obj_in: Union[CreateSchemaType, Dict[str, Any]], 
                      creator_id: int = 0, commit: bool = True) -> Union[List[int], int]:
-        """ 创建 """
+        """ 创建 (传入列表时等于 create_many(..., return_ids=True)) """
         if isinstance(obj_in, (tuple, list)):
-            obj_in_data = []
-            for _obj_in in obj_in:
-                _obj_in_data = jsonable_encoder(
-                    _obj_in, custom_encoder={dict: custom_encoder_dict_fn})
-                _obj_in_data['creator_id'] = creator_id
-                obj_in_data.append(_obj_in_data)
-            result = (await db.execute(
-                insert(self.model).values(obj_in_data).returning(self.model.id))).scalars().all()
-        else:
-            obj_in_data = jsonable_encoder(obj_in, custom_encoder={dict: custom_encoder_dict_fn})
-            obj_in_data['creator_id'] = creator_id
-            result = (await db.execute(
-                insert(self.model).values(**obj_in_data).returning(self.model.id))).scalar()  
+            return await self.create_many(db, objs_in=obj_in, creator_id=creator_id, return_ids=True, commit=commit)
+        res = await db.execute(insert(self.model).values(**self.encode_obj_in(obj_in, creator_id)))
+        result = res.inserted_primary_key[0]
         if commit:
             await db.commit()
         return result 
 
+    @staticmethod
+    def _chunks(data: List[Any], chunk_size: Optional[int] = None):
+        chunk_size = chunk_size or settings.SQL_BULK_CHUNK_SIZE
+        for i in range(0, len(data), chunk_size):
+            yield data[i: i + chunk_size]
+
+    async def create_many(self, db: AsyncSession, *, objs_in: List[Union[CreateSchemaType, Dict[str, Any]]], 
+                          creator_id: int = 0, chunk_size: Optional[int] = None, return_ids: bool = False, 
+                          commit: bool = True) -> Union[List[int], int]:
+        """
+        批量创建, 按 chunk_size(默认 SQL_BULK_CHUNK_SIZE) 分批, 每批一条多行 INSERT 语句。每条数据的字段需要一致
+        :param return_ids: 是否返回新增的id, 数据库不支持 INSERT ... RETURNING (mysql) 时逐行插入获取id
+        :return 新增的id列表 (return_ids=True) 或 新增的行数
+        """
+        data = [self.encode_obj_in(obj_in, creator_id) for obj_in in objs_in]
+        if not data:
+            return [] if return_ids else 0
+        ids, rowcount = [], 0
+        support_returning = db.get_bind().dialect.insert_returning
+        for chunk in self._chunks(data, chunk_size):
+            if not return_ids:
+                await db.execute(insert(self.model), chunk)
+                rowcount += len(chunk)
+            elif support_returning:
+                ids.extend((await db.execute(
+                    insert(self.model).values(chunk).returning(self.model.id))).scalars().all())
+            else:
+                for row in chunk:
+                    ids.append((await db.execute(insert(self.model).values(**row))).inserted_primary_key[0])
+        if commit:
+            await db.commit()
+        return ids if return_ids else rowcount
+
+    async def upsert_many(self, db: AsyncSession, *, objs_in: List[Union[CreateSchemaType, Dict[str, Any]]], 
+                          index_elements: List[str], update_fields: Optional[List[str]] = None, 
+                          ctl_id: int = 0, chunk_size: Optional[int] = None, commit: bool = True) -> int:
+        """
+        批量新增或更新: mysql 使用 ON DUPLICATE KEY UPDATE, postgresql/sqlite 使用 ON CONFLICT DO UPDATE。
+        已存在(逻辑删除)的数据会恢复为未删除
+        :param index_elements: 唯一索引的字段 (postgresql/sqlite 的 ON CONFLICT 需要, mysql 使用表上所有的唯一索引)
+        :param update_fields: 冲突时更新的字段, 默认为除了 index_elements 以外的所有传入的字段
+        :return 影响的行数 (mysql 中更新的行计为2行)
+        """
+        data = [self.encode_obj_in(obj_in, ctl_id) for obj_in in objs_in]
+        if not data:
+            return 0
+        if update_fields is None:
+            update_fields = [k for k in data[0] if k not in index_elements and k not in ('id', 'creator_id')]
+        dialect_name = db.get_bind().dialect.name
+        if dialect_name in ("mysql", "mariadb"):
+            dialect_insert = mysql.insert
+        elif dialect_name == "postgresql":
+            dialect_insert = postgresql.insert
+        elif dialect_name == "sqlite":
+            dialect_insert = sqlite.insert
+        else:
+            raise NotImplementedError(f"upsert_many does not support {dialect_name}")
+        rowcount = 0
+        for chunk in self._chunks(data, chunk_size):
+            sql = dialect_insert(self.model).values(chunk)
+            new_values = sql.inserted if dialect_name in ("mysql", "mariadb") else sql.excluded
+            set_ = {k: new_values[k] for k in update_fields}
+            set_.update({'modifier_id': ctl_id, 'is_deleted': 0})
+            if dialect_name in ("mysql", "mariadb"):
+                sql = sql.on_duplicate_key_update(set_)
+            else:
+                sql = sql.on_conflict_do_update(index_elements=index_elements, set_=set_)
+            rowcount += (await db.execute(sql)).rowcount
+        if commit:
+            await db.commit()
+        return rowcount
+
     async def update(self, db: AsyncSession, *, _id: Union[int, List[int]], 
                      obj_in: Union[UpdateSchemaType, Dict[str, Any]],
                      modifier_id: int = 0, commit: bool = True) -> int:
         """ 更新 """
-        update_data = jsonable_encoder(obj_in, custom_encoder={dict: custom_encoder_dict_fn})
+        update_data = self.encode(obj_in)
         update_data['modifier_id'] = modifier_id
-        update_data = {getattr(self.model, k): v for k, v in update_data.items() if hasattr(self.model, k)}
         sql = update(self.model).values(update_data).where(self.model.is_deleted != 1)
         if isinstance(_id, (list, tuple, set)):
             sql = sql.where(self.model.id.in_(_id))
@@ -160,10 +497,32 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             await db.commit()
         return res.rowcount
 
+    async def update_many(self, db: AsyncSession, *, ids: List[int], obj_in: Dict[str, Any],
+                          modifier_id: int = 0, chunk_size: Optional[int] = None, commit: bool = True) -> int:
+        """
+        批量更新: 每 chunk_size 个id执行一条 UPDATE ... WHERE id IN (...), 所有分批在同一个事务中, 返回影响的行数。
+        不经过子类重写的 update (不处理角色等关联数据), obj_in 只能是本表的字段
+        """
+        update_data = self.encode(obj_in)
+        update_data['modifier_id'] = modifier_id
+        rowcount = 0
+        for chunk in self._chunks(sorted(set(ids)), chunk_size):
+            sql = update(self.model).values(update_data).where(self.model.is_deleted != 1, self.model.id.in_(chunk))
+            rowcount += (await db.execute(sql)).rowcount
+        if commit:
+            await db.commit()
+        return rowcount
+
+    async def delete_many(self, db: AsyncSession, *, ids: List[int], deleter_id: int = 0,
+                          chunk_size: Optional[int] = None, commit: bool = True) -> int:
+        """ 批量逻辑删除, 分批方式同 update_many, 返回影响的行数 """
+        return await self.update_many(db, ids=ids, obj_in={'is_deleted': 1}, modifier_id=deleter_id,
+                                      chunk_size=chunk_size, commit=commit)
+
     async def get_max_order_num(self, db: AsyncSession) -> int:
-        data = (await db.execute(
+        data = (await db.execute(self.cached_sql("get_max_order_num", lambda: 
             select(func.max(self.model.order_num).label('max_order_num'))
             .where(self.model.is_deleted == 0)
-        )).first()
-        return data[0] if data and data else 0
+        ))).scalar()
+        return data or 0
 
@@ -17,20 +17,36 @@ from core import constants
 from apps.permission.curd.curd_user import curd_user
 from apps.user.schemas import token_schemas
 from core.config import settings
-from db.session import async_session_manager
+from db.session import async_session_manager, set_db_route_key
 from common import exceptions
-from apps.permission.curd.curd_perm_label import curd_perm_label
+from common.perm_matrix import perm_matrix
+from common.principal import principal_cache
+from common.token_cache import token_cache
+
+
+# 列表接口游标分页参数 after 的说明
+AFTER_QUERY_DESCRIPTION = "游标分页: 第一页传空字符串, 之后传上一页返回的 next, 传了 after 时忽略 page 且不返回 total"
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """
     get SQLAlchemy session to curd
+    session 是懒加载的: 执行第一条SQL时才从连接池取连接, 只读的请求结束时不会 commit
     :return: SQLAlchemy Session
     """
     async with async_session_manager.session() as db:
         yield db      
 
 
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    get SQLAlchemy read only session, 配置了从库(SQL_REPLICA_HOSTS)时查询走从库, 用于只读的接口
+    :return: SQLAlchemy Session
+    """
+    async with async_session_manager.read_session() as db:
+        yield db
+
+
 async def get_redis(request: Request) -> Optional[Redis]:
     redis = request.app.state.redis
     if redis: 
@@ -62,25 +78,34 @@ async def check_jwt_token(redis: Redis = Depends(get_redis), token: Optional[str
     """
     if not token:
         raise exceptions.UserTokenError()
+    token_data = token_cache.get(token)     # 已经验证过的token (见 common.token_cache)
+    if token_data is not None:
+        set_db_route_key(token_data.sub)
+        return token_data
     if redis:
         uid = await redis.get(constants.REDIS_KEY_LOGIN_TOKEN_KEY_PREFIX + token)
         if not uid:
             raise exceptions.UserTokenError()
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=settings.JWT_ALGORITHM)
-        return token_schemas.TokenPayload(token=token, **payload)
+        token_data = token_schemas.TokenPayload(token=token, **payload)
+        set_db_route_key(token_data.sub)  # 读写分离: 同一用户写入后短时间内读主库
+        token_cache.set(token, token_data, payload.get('exp'))
+        return token_data
     except (jwt.JWTError, jwt.ExpiredSignatureError, ValidationError) as e:
         raise exceptions.UserTokenError() from e
 
 
-async def get_current_user(db: Session = Depends(get_db), token_data=Depends(check_jwt_token)):
+async def get_current_user(db: Session = Depends(get_db), redis: Redis = Depends(get_redis),
+                           token_data=Depends(check_jwt_token)):
     """
-    根据header中token 获取当前用户
+    根据header中token 获取当前用户, 有缓存 (见 common.principal), 命中缓存时不查询数据库
     :param db:
+    :param redis:
     :param token_data:
     :return:
     """
-    user = await curd_user.get(db, _id=token_data.sub)
+    user = await principal_cache.get(redis, token_data.sub, lambda: curd_user.get(db, _id=token_data.sub))
     if not user:
         raise exceptions.UserTokenError() 
     return user
@@ -89,29 +114,31 @@ async def get_current_user(db: Session = Depends(get_db), token_data=Depends(che
 def user_perm(perm_labels: Union[str, Tuple[str], List[str]] = None):
     """
     用户路由权限 (不要和 get_current_user() 共用，以免影响速度)
+    AUTO_ADD_PERM_LABEL 时权限标识在程序启动时统一添加到数据库 (见 common.perm_registry), 请求中不再添加
     :param perm_labels:     权限标识
     :return:
     """
     perm_labels = (perm_labels,) if isinstance(perm_labels, str) else tuple(perm_labels)
 
     async def check_perm(db: Session = Depends(get_db), redis: Redis = Depends(get_redis),
-                        user=Depends(get_current_user)):
+                         token_data=Depends(check_jwt_token)):
         """
         是否有某权限
+        token中带有权限信息(TOKEN_PERM_CLAIMS)且签发后权限没有修改过时直接用token中的角色判断, 不查询用户,
+        这时返回的用户只有 id/is_superuser/roles
         """
-        if settings.AUTO_ADD_PERM_LABEL:
-            for label in perm_labels:
-                await curd_perm_label.create(db, obj_in={'label': label})
+        if await perm_matrix.claims_valid(token_data.pv):
+            if token_data.su or perm_matrix.roles_have_perm(token_data.roles or (), perm_labels):
+                return {'id': token_data.sub, 'is_superuser': bool(token_data.su), 'roles': token_data.roles or []}
+            raise exceptions.UserPermError()
+        user = await get_current_user(db, redis, token_data)
         if user['is_superuser']:
             return user
-        role_ids = set(await curd_perm_label.get_labels_role_ids(db, labels=perm_labels, redis=redis))
-        if not role_ids:
-            raise exceptions.UserPermError()
-        user_roles_ids = set([r.id for r in curd_user.get_roles(db, user['id'])])
-        if len(role_ids & user_roles_ids) > 0:
+        if await perm_matrix.has_perm(user['id'], perm_labels):   # 进程内的权限矩阵, 不查询数据库
             return user
         raise exceptions.UserPermError()
 
+    check_perm.perm_labels = perm_labels    # 用于 collect_perm_labels 收集所有路由的权限标识
     return check_perm
 
 
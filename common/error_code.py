@@ -13,6 +13,7 @@ ERROR_INTERNAL = ErrorBase(code=500, msg="内部错误")
 ERROR_NOT_FOUND = ErrorBase(code=404, msg="api 路径错误")
 # 参数错误
 ERROR_PARAMETER_ERROR = ErrorBase(code=400, msg="参数错误")
+ERROR_PARAMETER_CURSOR_INVALID = ErrorBase(code=4001, msg="分页游标无效, 请从第一页重新获取")
 
 # 用户相关
 ERROR_USER_TOKEN_FAILURE = ErrorBase(code=5004, msg="未登录或登录过期")
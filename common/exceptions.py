@@ -1,8 +1,8 @@
-import json
 import traceback
 from typing import Optional, Dict, Any
 from core.logger import logger
 from fastapi import FastAPI, status, HTTPException
+from fastapi.encoders import jsonable_encoder
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.exceptions import RequestValidationError
 from .error_code import *
@@ -22,7 +22,7 @@ def customExceptions(app: FastAPI):
     @app.exception_handler(RequestValidationError)
     async def http_exception_handle(request: Request, exc: RequestValidationError):
         err = ERROR_PARAMETER_ERROR
-        return respErrorJson(error=err, status_code=err.code, data={'errors': json.loads(exc.json())})
+        return respErrorJson(error=err, status_code=err.code, data={'errors': jsonable_encoder(exc.errors())})
     
     # 重写所有错误返回项目需要的格式错误 需要的时候可以用作错误消息推送
     @app.exception_handler(Exception)
@@ -53,3 +53,7 @@ class UserTokenError(CustomErrorBase):
 
 class UserPermError(CustomErrorBase):
     err = ERROR_USER_PREM_ERROR
+
+
+class CursorInvalidError(CustomErrorBase):
+    err = ERROR_PARAMETER_CURSOR_INVALID
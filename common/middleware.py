@@ -1,18 +1,35 @@
 import datetime
+import gzip
+import hashlib
 import json
 import os
 import time
 import traceback
+import zlib
+from collections import OrderedDict
+from typing import Optional, Tuple
 from fastapi import Request, Response
 from fastapi.responses import StreamingResponse
 from starlette.concurrency import iterate_in_threadpool
-from starlette.datastructures import URL, Headers
-from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.datastructures import URL, Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 import logging
 
+from core.config import settings
 from db.mongo import mongo_manager
+from db.session import async_session_manager
+from db.slow_query import slow_query_recorder
+from db.sql_stats import start_request_sql_stats, end_request_sql_stats, sql_stats_summary
 
 
 async def set_body(request: Request):
@@ -106,5 +123,186 @@ class RequestsLoggerMiddleware:
             if mongo is not None:
                 mongo.get_collection("requests_log").insert_one(log_data)
         return response
+
+
+class SqlStatsMiddleware:
+    """
+    统计每个请求执行的SQL (语句数, 数据库耗时, 最慢语句), 按路由汇总到 sql_stats_summary, 
+    添加 Server-Timing 响应头, 并对 N+1 查询记录警告日志。
+    请求结束后把这期间的慢查询交给 slow_query_recorder 获取执行计划并写入记录
+    """
     
-    
\ No newline at end of file
+    def __init__(self, logger: logging.Logger = None, n_plus_one_threshold: int = None):
+        self.logger = logger or logging.getLogger("api")
+        self.n_plus_one_threshold = settings.SQL_N_PLUS_ONE_THRESHOLD if n_plus_one_threshold is None \
+            else n_plus_one_threshold
+
+    async def __call__(self, request: Request, call_next: callable) -> Response:
+        stats, token = start_request_sql_stats(f"{request.method} {request.url.path}")
+        try:
+            response = await call_next(request)
+        finally:
+            end_request_sql_stats(token)
+        route = request.scope.get("route")
+        stats.route = f"{request.method} {getattr(route, 'path', request.url.path)}"
+        slow_query_recorder.schedule_flush(async_session_manager.engine)
+        if not settings.SQL_STATS_ENABLE:
+            return response
+        if stats.count:
+            response.headers.append("Server-Timing", stats.server_timing())
+        n_plus_one = stats.n_plus_one(self.n_plus_one_threshold)
+        for sql, num in n_plus_one:
+            self.logger.warning(f"N+1 query: {stats.route} executed {num} times: {sql}")
+        sql_stats_summary.add(stats, n_plus_one)
+        return response
+
+
+
+def no_compression(endpoint):
+    """
+    接口不使用 CompressionMiddleware 压缩响应 (例如返回已经压缩过的文件), 放在路由装饰器下面:
+        @router.get("/download")
+        @no_compression
+        async def download(): ...
+    """
+    endpoint.__no_compression__ = True
+    return endpoint
+
+
+class _StreamCompressor:
+    """ 流式响应的压缩器, 每个分块压缩后 flush, 客户端可以边接收边解压 """
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip 格式
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data) + self._obj.flush()
+        if self.encoding == "zstd":
+            return self._obj.compress(data) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+class CompressionMiddleware:
+    """
+    响应压缩 (纯ASGI中间件, 放在最外层): 根据 Accept-Encoding 选择 br > zstd > gzip (br/zstd 需要安装对应的包),
+    小于 COMPRESS_MIN_SIZE 的响应、已经压缩的响应、图片等不可压缩的类型和 no_compression 的接口不压缩。
+    完整的响应体按内容哈希缓存压缩结果 (字典、菜单等相同的内容不重复压缩), 流式响应(导出)边发送边压缩不缓存
+    """
+    COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/msgpack",
+                          "application/javascript", "application/xml", "image/svg+xml")
+
+    def __init__(self, app: ASGIApp, min_size: int = None, cache_size: int = None, cache_max_body: int = None):
+        self.app = app
+        self.min_size = settings.COMPRESS_MIN_SIZE if min_size is None else min_size
+        self.cache_size = settings.COMPRESS_CACHE_SIZE if cache_size is None else cache_size
+        self.cache_max_body = settings.COMPRESS_CACHE_MAX_BODY if cache_max_body is None else cache_max_body
+        self.levels = {'gzip': settings.COMPRESS_GZIP_LEVEL}
+        if brotli is not None:
+            self.levels['br'] = settings.COMPRESS_BROTLI_QUALITY
+        if zstandard is not None:
+            self.levels['zstd'] = settings.COMPRESS_ZSTD_LEVEL
+        self._cache = OrderedDict()  # type: OrderedDict[Tuple[str, bytes], bytes]
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        accepted = set()
+        for item in accept_encoding.lower().split(","):
+            encoding, _, params = item.partition(";")
+            params = params.replace(" ", "")
+            if params.startswith("q=") and params[2:] in ("0", "0.0", "0.00", "0.000"):
+                continue
+            accepted.add(encoding.strip())
+        for encoding in ("br", "zstd", "gzip"):
+            if encoding in self.levels and (encoding in accepted or "*" in accepted):
+                return encoding
+        return None
+
+    def compress(self, encoding: str, body: bytes) -> bytes:
+        level = self.levels[encoding]
+        if encoding == "br":
+            return brotli.compress(body, quality=level)
+        if encoding == "zstd":
+            return zstandard.ZstdCompressor(level=level).compress(body)
+        return gzip.compress(body, compresslevel=level, mtime=0)
+
+    def compress_cached(self, encoding: str, body: bytes) -> bytes:
+        if not self.cache_size or len(body) > self.cache_max_body:
+            return self.compress(encoding, body)
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        data = self._cache.get(key)
+        if data is not None:
+            self._cache.move_to_end(key)
+            return data
+        data = self._cache[key] = self.compress(encoding, body)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return data
+
+    def skip(self, scope: Scope, message: Message, headers: MutableHeaders) -> bool:
+        status_code = message["status"]
+        if status_code < 200 or status_code in (204, 206, 304) or "content-encoding" in headers:
+            return True
+        if getattr(scope.get("endpoint"), "__no_compression__", False):
+            return True
+        content_length = headers.get("content-length")
+        if content_length is not None and int(content_length) < self.min_size:
+            return True
+        return not headers.get("content-type", "").startswith(self.COMPRESSIBLE_TYPES)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = self.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        start_message = None    # 响应头延迟到第一个响应体分块时发送, 以便根据响应体决定是否压缩
+        compressor = None   # type: Optional[_StreamCompressor]
+        passthrough = False
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message, compressor, passthrough
+            if passthrough:
+                return await send(message)
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if compressor is not None:
+                data = compressor.compress(body) if body else b""
+                if not more_body:
+                    data += compressor.finish()
+                return await send({"type": "http.response.body", "body": data, "more_body": more_body})
+            headers = MutableHeaders(raw=start_message["headers"])
+            if self.skip(scope, start_message, headers) or (not more_body and len(body) < self.min_size):
+                passthrough = True
+                await send(start_message)
+                return await send(message)
+            headers["Content-Encoding"] = encoding
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body:   # 完整的响应体
+                body = self.compress_cached(encoding, body)
+                headers["Content-Length"] = str(len(body))
+                start_message["headers"] = headers.raw
+                await send(start_message)
+                return await send({"type": "http.response.body", "body": body})
+            if "content-length" in headers:     # 流式响应
+                del headers["Content-Length"]
+            compressor = _StreamCompressor(encoding, self.levels[encoding])
+            start_message["headers"] = headers.raw
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressor.compress(body), "more_body": True})
+
+        await self.app(scope, receive, send_wrapper)
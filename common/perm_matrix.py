@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+try:
+    from redis.asyncio import Redis
+except ImportError:
+    from aioredis import Redis
+from sqlalchemy import select
+
+from apps.permission.models import Roles, UserRole
+from apps.permission.models.perm_label import PermLabel, PermLabelRole
+from core import constants
+from core.config import settings
+from db.session import async_session_manager, on_commit_tables
+
+
+class PermMatrix:
+    """
+    worker进程内的权限矩阵: 权限标识 -> 角色位图, 用户 -> 角色位图 (第 n 位表示 id 为 n 的角色),
+    判断权限只需要按位与, 不查询redis/数据库。
+    权限标识/角色/用户角色相关的表提交了写操作时 (见 db.session.on_commit_tables) 本进程的矩阵马上标记为过期,
+    并把redis中的版本号 REDIS_KEY_PERM_MATRIX_VERSION 加1, 其他worker每 PERM_MATRIX_REFRESH_SECONDS 秒检查一次版本号,
+    所以所有worker最多延迟 PERM_MATRIX_REFRESH_SECONDS 秒重新加载。没有redis时每 PERM_MATRIX_REFRESH_SECONDS 秒重新加载
+    """
+    TABLES = frozenset(m.__table__.name for m in (PermLabel, PermLabelRole, UserRole, Roles))
+
+    def __init__(self, refresh_seconds: int = 5):
+        self.refresh_seconds = refresh_seconds
+        self.redis = None   # type: Optional[Redis]
+        self.version = None     # type: Optional[int]
+        self.label_roles = {}   # type: Dict[str, int]
+        self.user_roles = {}    # type: Dict[int, int]
+        self._label_masks = {}  # type: Dict[Tuple[str, ...], int]
+        self._stale = True
+        self._next_check = 0.0
+        self._lock = asyncio.Lock()
+        self._tasks = set()     # type: Set[asyncio.Task]
+
+    async def init(self, r: Optional[Redis] = None):
+        """ 程序启动时调用, 加载失败(例如还没有建表)时在第一次判断权限时再加载 """
+        self.redis = r
+        try:
+            await self.refresh()
+        except Exception:
+            logging.getLogger("api").exception("load permission matrix failed")
+
+    async def _get_version(self) -> Optional[int]:
+        if self.redis is None:
+            return None
+        return int(await self.redis.get(constants.REDIS_KEY_PERM_MATRIX_VERSION) or 0)
+
+    async def _load(self):
+        label_roles, user_roles = {}, {}
+        async with async_session_manager.session() as db:
+            rows = (await db.execute(
+                select(PermLabel.label, PermLabelRole.role_id)
+                .join(PermLabelRole, PermLabelRole.label_id == PermLabel.id)
+                .join(Roles, Roles.id == PermLabelRole.role_id)
+                .where(PermLabel.status.in_((0,)), PermLabel.is_deleted == 0,
+                       PermLabelRole.is_deleted == 0, Roles.is_deleted == 0)
+            )).all()
+            for label, role_id in rows:
+                label_roles[label] = label_roles.get(label, 0) | (1 << role_id)
+            rows = (await db.execute(
+                select(UserRole.user_id, UserRole.role_id)
+                .join(Roles, Roles.id == UserRole.role_id)
+                .where(UserRole.is_deleted == 0, Roles.is_deleted == 0)
+            )).all()
+            for user_id, role_id in rows:
+                user_roles[user_id] = user_roles.get(user_id, 0) | (1 << role_id)
+        self.label_roles, self.user_roles, self._label_masks = label_roles, user_roles, {}
+
+    async def refresh(self, force: bool = False):
+        """ 过期或者redis中的版本号变了时重新加载, 每 refresh_seconds 秒最多检查一次版本号 """
+        if not (force or self._stale or time.monotonic() >= self._next_check):
+            return
+        async with self._lock:
+            if not (force or self._stale or time.monotonic() >= self._next_check):
+                return
+            # 等本进程的修改通知(版本号加1)完成, 否则会用旧版本号标记新数据, 修改前签发的token仍然有效 (TOKEN_PERM_CLAIMS)
+            if self._tasks:
+                await asyncio.gather(*self._tasks)
+            # 先读版本号再加载, 加载期间有修改时版本号不一致, 下次检查会再加载一次
+            version = await self._get_version()
+            if force or self._stale or version is None or version != self.version:
+                self._stale = False
+                try:
+                    await self._load()
+                except Exception:
+                    self._stale = True
+                    raise
+                self.version = version
+            self._next_check = time.monotonic() + self.refresh_seconds
+
+    def label_mask(self, labels: Tuple[str, ...]) -> int:
+        mask = self._label_masks.get(labels)
+        if mask is None:
+            mask = 0
+            for label in labels:
+                mask |= self.label_roles.get(label, 0)
+            self._label_masks[labels] = mask
+        return mask
+
+    async def has_perm(self, user_id: int, labels: Tuple[str, ...]) -> bool:
+        """ 用户的角色中是否有一个拥有 labels 中的任意一个权限标识 """
+        await self.refresh()
+        return bool(self.label_mask(labels) & self.user_roles.get(int(user_id), 0))
+
+    def roles_have_perm(self, role_ids: Iterable[int], labels: Tuple[str, ...]) -> bool:
+        """ role_ids 中是否有一个角色拥有 labels 中的任意一个权限标识 """
+        mask = self.label_mask(labels)
+        return any(mask >> role_id & 1 for role_id in role_ids)
+
+    async def token_claims(self, user_id: int, is_superuser: bool) -> Dict[str, Any]:
+        """
+        登录token中的权限信息 (TOKEN_PERM_CLAIMS): 角色id, 是否超级管理员, 权限版本号 pv。
+        没有redis时没有全局的版本号, 不能判断token中的权限是否过期, 返回空
+        """
+        await self.refresh()
+        if self.version is None or self._stale:
+            return {}
+        mask = self.user_roles.get(int(user_id), 0)
+        return {'roles': [i for i in range(mask.bit_length()) if mask >> i & 1], 'su': bool(is_superuser),
+                'pv': self.version}
+
+    async def claims_valid(self, pv: Optional[int]) -> bool:
+        """ token签发后权限没有修改过 (版本号相同), token中的角色可以直接用于判断权限 """
+        if pv is None:
+            return False
+        await self.refresh()
+        return not self._stale and pv == self.version
+
+    async def _bump_version(self):
+        try:
+            await self.redis.incr(constants.REDIS_KEY_PERM_MATRIX_VERSION)
+        except Exception:
+            logging.getLogger("api").exception("bump permission matrix version failed")
+
+    def invalidate(self, tables: Optional[Set[str]] = None):
+        """ 提交的事务写了权限相关的表时: 本进程的矩阵过期, 通知其他worker (redis中的版本号加1) """
+        if tables is not None and not (tables & self.TABLES):
+            return
+        self._stale = True
+        if self.redis is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._bump_version())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+perm_matrix = PermMatrix(settings.PERM_MATRIX_REFRESH_SECONDS)
+on_commit_tables(perm_matrix.invalidate)
@@ -0,0 +1,62 @@
+from typing import Iterable, List, Optional
+try:
+    from redis.asyncio import Redis
+except ImportError:
+    from aioredis import Redis
+from fastapi.dependencies.models import Dependant
+from fastapi.routing import APIRoute
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from apps.permission.curd.curd_perm_label import curd_perm_label
+from core import constants
+from db.session import async_session_manager
+
+
+def _dependant_perm_labels(dependant: Dependant, labels: set):
+    labels.update(getattr(dependant.call, "perm_labels", ()))
+    for sub_dependant in dependant.dependencies:
+        _dependant_perm_labels(sub_dependant, labels)
+
+
+def collect_perm_labels(routes: Iterable) -> List[str]:
+    """
+    收集路由中所有 deps.user_perm([...]) 依赖使用的权限标识 (包括 include_router 的路由和路由级别的依赖):
+        collect_perm_labels(app.routes)
+    """
+    labels = set()
+    for route in routes:
+        if isinstance(route, APIRoute):
+            _dependant_perm_labels(route.dependant, labels)
+    return sorted(labels)
+
+
+async def get_missing_perm_labels(db: AsyncSession, labels: List[str]) -> List[str]:
+    """ 数据库中还没有的权限标识 """
+    exists = set((await db.execute(
+        select(curd_perm_label.model.label)
+        .where(curd_perm_label.model.label.in_(labels), curd_perm_label.model.is_deleted == 0)
+    )).scalars().all()) if labels else set()
+    return [i for i in labels if i not in exists]
+
+
+async def register_perm_labels(labels: List[str], r: Optional[Redis] = None) -> List[str]:
+    """
+    把路由的权限标识一次性写入数据库 (只插入还没有的), 程序启动时调用, 请求中不再逐个检查添加。
+    多个worker同时启动时用redis锁保证只有一个在写入 (权限标识的 label 字段没有唯一索引, 不能依赖数据库去重)
+    :return 新增的权限标识
+    """
+    if not labels:
+        return []
+
+    async def register() -> List[str]:
+        async with async_session_manager.session() as db:
+            missing = await get_missing_perm_labels(db, labels)
+            if missing:
+                await curd_perm_label.create_many(db, objs_in=[{'label': i} for i in missing])
+            return missing
+
+    if r is None:
+        return await register()
+    async with r.lock(constants.REDIS_KEY_PERM_LABEL_REGISTER_LOCK, timeout=60, blocking_timeout=60):
+        return await register()
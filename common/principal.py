@@ -0,0 +1,87 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+try:
+    from redis.asyncio import Redis
+except ImportError:
+    from aioredis import Redis
+
+from core import constants
+from core.config import settings
+
+
+class PrincipalCache:
+    """
+    登录用户(get_current_user 的返回值: 用户信息和角色id)缓存, 两级: worker进程内的LRU + redis。
+    每个用户在redis中有一个版本号 REDIS_KEY_PRINCIPAL_VERSION{id}, 修改用户/用户角色时 invalidate() 把版本号加1,
+    缓存的数据带着读取时的版本号, 版本号不一致时重新查询数据库, 所以所有worker的缓存都会立即失效:
+        命中内存缓存:   1 次redis GET (版本号), 不查询数据库
+        命中redis缓存:  2 次redis GET
+        都没有命中:     查询数据库后写入两级缓存
+    版本号在查询数据库之前读取, 查询期间用户被修改时缓存的是旧版本号, 下次请求会重新查询
+    """
+
+    def __init__(self, size: int = 1024, expire_seconds: int = 600):
+        self.size = size
+        self.expire_seconds = expire_seconds
+        self._cache = OrderedDict()     # type: OrderedDict[int, Tuple[int, float, Dict[str, Any]]]
+
+    @staticmethod
+    def _version_key(user_id: int) -> str:
+        return f"{constants.REDIS_KEY_PRINCIPAL_VERSION}{user_id}"
+
+    @staticmethod
+    def _cache_key(user_id: int) -> str:
+        return f"{constants.REDIS_KEY_PRINCIPAL_CACHE}{user_id}"
+
+    def _set_local(self, user_id: int, version: int, user: Dict[str, Any]):
+        self._cache[user_id] = (version, time.monotonic() + self.expire_seconds, user)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+
+    async def get(self, r: Optional[Redis], user_id: int,
+                  load: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """
+        获取用户, 缓存中没有时调用 load() 查询数据库
+        :param load: 查询数据库, 返回 curd_user.get() 的字典, 用户不存在时返回 None (不缓存)
+        """
+        if r is None or not self.size:
+            return await load()
+        user_id = int(user_id)
+        version = int(await r.get(self._version_key(user_id)) or 0)
+        cached = self._cache.get(user_id)
+        if cached is not None and cached[0] == version and cached[1] > time.monotonic():
+            self._cache.move_to_end(user_id)
+            return cached[2]
+        data = await r.get(self._cache_key(user_id))
+        if data:
+            data = json.loads(data)
+            if data['version'] == version:
+                self._set_local(user_id, version, data['user'])
+                return data['user']
+        user = await load()
+        if user is not None:
+            await r.setex(self._cache_key(user_id), self.expire_seconds,
+                          json.dumps({'version': version, 'user': user}))
+            self._set_local(user_id, version, user)
+        return user
+
+    async def invalidate(self, r: Optional[Redis], user_ids: Iterable[int]):
+        """ 修改了用户信息/用户角色/删除用户后调用, 所有worker中这些用户的缓存失效 """
+        user_ids = set(int(i) for i in user_ids)
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            self._cache.pop(user_id, None)
+        if r is None:
+            return
+        async with r.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.incr(self._version_key(user_id))
+                pipe.delete(self._cache_key(user_id))
+            await pipe.execute()
+
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_EXPIRE_SECONDS)
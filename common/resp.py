@@ -1,8 +1,13 @@
+import csv
+import io
+import json
+from urllib.parse import quote
 from fastapi import status
-from fastapi.responses import JSONResponse  # , ORJSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse  # , ORJSONResponse
 from pydantic import BaseModel
-from typing import Union, Optional
+from typing import Any, AsyncIterable, List, Mapping, Union, Optional
 
+from common.codec import Codec, response_codec
 from common.error_code import ErrorBase
 
 
@@ -12,9 +17,25 @@ class respJsonBase(BaseModel):
     data: Union[dict, list]
 
 
+class CodecResponse(JSONResponse):
+    """
+    按当前请求协商的编码 (common.codec.CodecRoute 根据 Accept 设置) 返回, 默认 json (orjson), 
+    客户端 Accept: application/msgpack 时返回 msgpack。查询结果(Row)不需要先转成字典
+    """
+
+    def __init__(self, content: Any, status_code: int = 200, headers: Optional[Mapping[str, str]] = None,
+                 codec: Optional[Codec] = None, **kwargs):
+        self.codec = codec or response_codec.get()
+        self.media_type = self.codec.media_type
+        super().__init__(content, status_code=status_code, headers=headers, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        return self.codec.dumps(content)
+
+
 def respSuccessJson(data: Union[list, dict, str] = None, msg: str = "Success"):
     """ 接口成功返回 """
-    return JSONResponse(
+    return CodecResponse(
         status_code=status.HTTP_200_OK,
         content={
             'code': 0,
@@ -27,11 +48,61 @@ def respSuccessJson(data: Union[list, dict, str] = None, msg: str = "Success"):
 def respErrorJson(error: ErrorBase, *, msg: Optional[str] = None, msg_append: str = "", 
                   data: Union[list, dict, str] = None, status_code: int = status.HTTP_200_OK):
     """ 错误接口返回 """
-    return JSONResponse(
+    return CodecResponse(
         status_code=status_code,
         content={
             'code': error.code,
             'msg': (msg or error.msg) + msg_append,
             'data': data or {}
         }
-    )
\ No newline at end of file
+    )
+
+
+async def _iterNDJSON(rows: AsyncIterable[dict], batch_size: int):
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False, default=str))
+        if len(lines) >= batch_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+async def _iterCSV(rows: AsyncIterable[dict], columns: Optional[List[str]], batch_size: int):
+    buf = io.StringIO()
+    buf.write("\ufeff")   # BOM, 让 Excel 正确识别 utf-8 编码
+    writer = csv.writer(buf)
+    if columns:
+        writer.writerow(columns)
+    n = 0
+    async for row in rows:
+        if columns is None:     # 没有指定字段时使用第一行的字段
+            columns = list(row.keys())
+            writer.writerow(columns)
+        writer.writerow([row.get(c) for c in columns])
+        n += 1
+        if n % batch_size == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def respExportStream(rows: AsyncIterable[dict], fmt: str = "ndjson", *, filename: str = "export", 
+                     columns: Optional[List[str]] = None, batch_size: int = 500):
+    """
+    流式导出, 边从数据库读取边发送, 内存占用和数据量无关
+    :param rows: 数据的异步迭代器, 一般为 CRUDBase.stream(...)
+    :param fmt: ndjson (每行一个json) 或 csv
+    :param columns: csv 的字段, 不传使用第一行数据的字段
+    :param batch_size: 每多少行发送一次
+    """
+    if fmt == "csv":
+        content, media_type = _iterCSV(rows, columns, batch_size), "text/csv; charset=utf-8"
+    else:
+        fmt, content, media_type = "ndjson", _iterNDJSON(rows, batch_size), "application/x-ndjson"
+    return StreamingResponse(content, media_type=media_type, headers={
+        'Content-Disposition': f"attachment; filename*=utf-8''{quote(filename)}.{fmt}"
+    })
@@ -1,19 +1,131 @@
+import asyncio
+import json
+import math
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Any, Union
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
 
 from jose import jwt
 from passlib.context import CryptContext
 import redis
 
+from core import constants
 from core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+class PasswordHashPolicy(NamedTuple):
+    """ 密码哈希策略 """
+    scheme: str         # argon2 或 bcrypt
+    rounds: int         # bcrypt: cost (2^rounds 次迭代), argon2: time_cost
+    memory_cost: int = 0    # 只对 argon2 有效, 单位 KiB
 
+    def dumps(self) -> str:
+        return json.dumps(self._asdict())
 
-def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None) -> str:
-    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode = {"exp": expire, "sub": str(subject)}
+
+PASSWORD_HASH_SCHEMES = ("argon2", "bcrypt")
+PASSWORD_HASH_DEFAULT_ROUNDS = {'bcrypt': 12, 'argon2': 3}
+PASSWORD_HASH_MIN_ROUNDS = {'bcrypt': 10, 'argon2': 2}     # 校准的下限, 再快就不安全了
+PASSWORD_HASH_MAX_ROUNDS = {'bcrypt': 16, 'argon2': 20}
+
+
+def build_pwd_context(policy: PasswordHashPolicy) -> CryptContext:
+    """
+    policy.scheme 用于新的哈希, 其他算法只用于校验旧的哈希。
+    旧算法或强度低于 policy 的哈希 needs_update 为 True, 登录时会重新哈希 (见 verify_and_update_password)
+    """
+    schemes = [policy.scheme] + [i for i in PASSWORD_HASH_SCHEMES if i != policy.scheme]
+    kwargs = {f"{policy.scheme}__default_rounds": policy.rounds, f"{policy.scheme}__min_rounds": policy.rounds}
+    if policy.scheme == "argon2" and policy.memory_cost:
+        kwargs['argon2__memory_cost'] = policy.memory_cost
+    return CryptContext(schemes=schemes, deprecated="auto", **kwargs)
+
+
+pwd_policy = PasswordHashPolicy(
+    settings.PASSWORD_HASH_SCHEME, 
+    settings.PASSWORD_HASH_ROUNDS or PASSWORD_HASH_DEFAULT_ROUNDS[settings.PASSWORD_HASH_SCHEME],
+    settings.PASSWORD_HASH_ARGON2_MEMORY_KB if settings.PASSWORD_HASH_SCHEME == "argon2" else 0)
+pwd_context = build_pwd_context(pwd_policy)
+
+
+def set_password_policy(policy: PasswordHashPolicy):
+    """ 修改当前进程的密码哈希策略 (也作为进程池的 initializer, 让子进程使用同样的策略) """
+    global pwd_policy, pwd_context
+    pwd_policy, pwd_context = policy, build_pwd_context(policy)
+
+
+def measure_verify_ms(policy: PasswordHashPolicy, samples: int = 3) -> float:
+    """ 单核校验一次密码的耗时(毫秒), 取多次中最快的一次 """
+    context = build_pwd_context(policy)
+    hashed = context.hash("benchmark")
+    cost = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.verify("benchmark", hashed)
+        cost.append(time.perf_counter() - start)
+    return min(cost) * 1000
+
+
+def calibrate_password_policy(scheme: str, target_ms: int, memory_cost: int = 0) -> PasswordHashPolicy:
+    """
+    按当前机器的速度校准哈希强度, 使校验一次密码的耗时接近 target_ms:
+    bcrypt 的耗时随 rounds 指数增长 (每加 1 翻倍), argon2 的耗时随 time_cost 线性增长
+    """
+    base = PASSWORD_HASH_MIN_ROUNDS[scheme]
+    cost_ms = measure_verify_ms(PasswordHashPolicy(scheme, base, memory_cost))
+    if scheme == "bcrypt":
+        rounds = base + max(0, round(math.log2(target_ms / cost_ms)))
+    else:
+        rounds = round(base * target_ms / cost_ms)
+    rounds = min(max(rounds, base), PASSWORD_HASH_MAX_ROUNDS[scheme])
+    return PasswordHashPolicy(scheme, rounds, memory_cost)
+
+
+async def _get_cached_password_policy(r: Any, scheme: str, target_ms: int, memory_cost: int) -> Optional[PasswordHashPolicy]:
+    """ redis中保存的校准结果, 算法或目标耗时不同时返回 None """
+    cached = await r.get(constants.REDIS_KEY_PASSWORD_HASH_POLICY)
+    if not cached:
+        return None
+    data = json.loads(cached)
+    if data.pop('target_ms', None) == target_ms and data['scheme'] == scheme and data['memory_cost'] == memory_cost:
+        return PasswordHashPolicy(**data)
+    return None
+
+
+async def init_password_policy(r: Optional[Any] = None) -> PasswordHashPolicy:
+    """
+    程序启动时调用: 配置了 PASSWORD_HASH_TARGET_MS 并且没有固定 PASSWORD_HASH_ROUNDS 时按目标耗时校准哈希强度。
+    校准结果保存在redis中, 所有worker进程(和重启后)使用同一个强度, 避免各worker校准结果不同导致登录时反复重新哈希。
+    多个worker同时启动时用redis锁保证只有一个在校准, 其他worker拿到锁后读取它保存的结果。
+    修改了算法或目标耗时会重新校准, 需要重新校准时删除redis中的 REDIS_KEY_PASSWORD_HASH_POLICY
+    """
+    if settings.PASSWORD_HASH_ROUNDS or not settings.PASSWORD_HASH_TARGET_MS:
+        return pwd_policy
+    scheme, target_ms, memory_cost = settings.PASSWORD_HASH_SCHEME, settings.PASSWORD_HASH_TARGET_MS, pwd_policy.memory_cost
+    if r is None:
+        set_password_policy(await asyncio.to_thread(calibrate_password_policy, scheme, target_ms, memory_cost))
+        return pwd_policy
+    policy = await _get_cached_password_policy(r, scheme, target_ms, memory_cost)
+    if policy is None:
+        async with r.lock(constants.REDIS_KEY_PASSWORD_HASH_POLICY_LOCK, timeout=60, blocking_timeout=60):
+            policy = await _get_cached_password_policy(r, scheme, target_ms, memory_cost)
+            if policy is None:
+                policy = await asyncio.to_thread(calibrate_password_policy, scheme, target_ms, memory_cost)
+                await r.set(constants.REDIS_KEY_PASSWORD_HASH_POLICY, 
+                            json.dumps(dict(policy._asdict(), target_ms=target_ms)))
+    set_password_policy(policy)
+    return pwd_policy
+
+
+def create_access_token(subject: Union[str, Any], expires_delta: timedelta = None, 
+                        claims: Optional[Dict[str, Any]] = None) -> str:
+    """
+    :param claims: 额外放到token中的数据, 例如权限信息 {'roles': [...], 'su': False, 'pv': 3} (见 PermMatrix.token_claims)
+    """
+    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=constants.ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode = dict(claims or {}, exp=expire, sub=str(subject))
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
 
 
@@ -23,3 +135,81 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    校验密码, 密码正确并且哈希使用的是旧的算法或强度时同时返回用新策略计算的哈希
+    :return (是否正确, 新的哈希 或 None)
+    """
+    if not hashed_password:
+        return False, None
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _get_password_hash_batch(passwords: List[str]) -> List[str]:
+    return [pwd_context.hash(password) for password in passwords]
+
+
+_password_hash_process_pool = None  # type: Optional[ProcessPoolExecutor]
+_password_hash_processes = 0    # 进程池的进程数
+
+
+def get_password_hash_process_pool() -> ProcessPoolExecutor:
+    """
+    批量哈希密码(PASSWORD_HASH_EXECUTOR 为 process 时单个密码也)用的进程池(第一次使用时创建), 进程数为 PASSWORD_HASH_PROCESSES, 0 为CPU核数
+    """
+    global _password_hash_process_pool, _password_hash_processes
+    if _password_hash_process_pool is None:
+        _password_hash_processes = settings.PASSWORD_HASH_PROCESSES or os.cpu_count() or 1
+        _password_hash_process_pool = ProcessPoolExecutor(_password_hash_processes,
+                                                          initializer=set_password_policy, initargs=(pwd_policy,))
+    return _password_hash_process_pool
+
+
+async def get_password_hash_many(passwords: List[str]) -> List[str]:
+    """
+    批量哈希密码, 分成多份在进程池中并行计算, 不阻塞事件循环 (用于批量导入用户)
+    """
+    if not passwords:
+        return []
+    pool = get_password_hash_process_pool()
+    size = -(-len(passwords) // _password_hash_processes)
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*[loop.run_in_executor(pool, _get_password_hash_batch, passwords[i: i + size]) 
+                                     for i in range(0, len(passwords), size)])
+    return [h for batch in results for h in batch]
+
+
+_password_hash_thread_pool = None  # type: Optional[ThreadPoolExecutor]
+
+
+def get_password_hash_executor() -> Executor:
+    """
+    单个密码哈希/校验用的执行器: PASSWORD_HASH_EXECUTOR 为 process 时使用批量哈希的进程池, 
+    否则使用 PASSWORD_HASH_MAX_WORKERS 个线程的线程池, 超过上限的请求排队等待, 不会占满默认线程池
+    """
+    global _password_hash_thread_pool
+    if settings.PASSWORD_HASH_EXECUTOR == "process":
+        return get_password_hash_process_pool()
+    if _password_hash_thread_pool is None:
+        _password_hash_thread_pool = ThreadPoolExecutor(settings.PASSWORD_HASH_MAX_WORKERS or os.cpu_count(), 
+                                                        thread_name_prefix="password_hash")
+    return _password_hash_thread_pool
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """ verify_password 的异步版本, 在执行器中计算, 不阻塞事件循环 """
+    return await asyncio.get_running_loop().run_in_executor(
+        get_password_hash_executor(), verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """ get_password_hash 的异步版本, 在执行器中计算, 不阻塞事件循环 """
+    return await asyncio.get_running_loop().run_in_executor(get_password_hash_executor(), get_password_hash, password)
+
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """ verify_and_update_password 的异步版本, 在执行器中计算, 不阻塞事件循环 """
+    return await asyncio.get_running_loop().run_in_executor(
+        get_password_hash_executor(), verify_and_update_password, plain_password, hashed_password)
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+try:
+    from redis.asyncio import Redis
+except ImportError:
+    from aioredis import Redis
+
+from core import constants
+from core.config import settings
+
+
+class TokenCache:
+    """
+    worker进程内已经验证过的登录token缓存 (token -> TokenPayload), 命中时 check_jwt_token 不访问redis也不重新验证签名。
+    缓存时间为 TOKEN_CACHE_SECONDS, 且不超过token本身的过期时间 exp。
+    退出登录/修改密码时 revoke() 在redis频道 REDIS_CHANNEL_TOKEN_REVOKE 中发布作废的token, 所有worker订阅(listen)后从缓存中删除。
+    redis的订阅是"最多一次"的, 断线重连时清空整个缓存, 丢失的通知最多影响 TOKEN_CACHE_SECONDS 秒
+    """
+
+    def __init__(self, size: int = 10000, ttl: int = 60):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # type: OrderedDict[str, Tuple[float, Any]]
+        self._task = None   # type: Optional[asyncio.Task]
+
+    @property
+    def enable(self) -> bool:
+        """ 订阅了作废通知(start)后才缓存 """
+        return self._task is not None and self.size > 0 and self.ttl > 0
+
+    def get(self, token: str) -> Optional[Any]:
+        item = self._entries.get(token)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._entries[token]
+            return None
+        return item[1]
+
+    def set(self, token: str, payload: Any, exp: Optional[float] = None):
+        """ :param exp: token的过期时间戳(秒) """
+        if not self.enable:
+            return
+        ttl = self.ttl if exp is None else min(self.ttl, exp - time.time())
+        if ttl <= 0:
+            return
+        self._entries[token] = (time.monotonic() + ttl, payload)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def discard(self, token: str):
+        self._entries.pop(token, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def revoke(self, r: Optional[Redis], token: str):
+        """ 作废token: 删除redis中的登录状态, 通知所有worker删除缓存 """
+        self.discard(token)
+        if r is None:
+            return
+        await r.delete(constants.REDIS_KEY_LOGIN_TOKEN_KEY_PREFIX + token)
+        await r.publish(constants.REDIS_CHANNEL_TOKEN_REVOKE, token)
+
+    async def listen(self, r: Redis):
+        """ 订阅作废token的通知, 断线后清空缓存并重新订阅 """
+        while True:
+            pubsub = r.pubsub()
+            try:
+                await pubsub.subscribe(constants.REDIS_CHANNEL_TOKEN_REVOKE)
+                # 订阅成功前缓存的token可能错过了通知
+                self.clear()
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        data = message['data']
+                        self.discard(data.decode() if isinstance(data, bytes) else data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.getLogger("api").exception("token revoke subscription failed, retry in 1s")
+                self.clear()
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def start(self, r: Optional[Redis]):
+        """ 程序启动时调用, 没有redis时token不缓存 (没有办法通知其他worker) """
+        if r is None or self.size <= 0 or self.ttl <= 0:
+            return
+        self._task = asyncio.get_running_loop().create_task(self.listen(r))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.clear()
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_SECONDS)
@@ -21,7 +21,7 @@ class Settings(BaseSettings):
     USE_CAPTCHA: bool = True
     LOGGING_CONFIG_FILE: FilePath = os.path.join(constants.BASE_DIR, 'configs/logging_config.conf')   # log格式配置文件路径
     ECHO_SQL: bool = False  # 是否打印sql语句
-    AUTO_ADD_PERM_LABEL: bool = False  # 是否在访问到有权限标识的路径的时候自动添加权限标识到数据库
+    AUTO_ADD_PERM_LABEL: bool = False  # 是否在程序启动时自动添加所有路由的权限标识到数据库 (也可以用 python manage.py perm-labels sync)
 
     API_DOMAIN: str = "http://127.0.0.1:9898"  # 本api程序的域名
     WEB_DOMAIN: str = "http://127.0.0.1:8080"  # 前端vue程序的域名
@@ -29,9 +29,39 @@ class Settings(BaseSettings):
     # 跨域
     BACKEND_CORS_ORIGINS: List[str] = ['*']
 
+    # 响应压缩 (br 需要 pip install brotli, zstd 需要 pip install zstandard, 没有安装时只用 gzip)
+    COMPRESS_ENABLE: bool = True
+    COMPRESS_MIN_SIZE: int = 1024   # 响应体小于多少字节不压缩
+    COMPRESS_GZIP_LEVEL: int = 6
+    COMPRESS_BROTLI_QUALITY: int = 4
+    COMPRESS_ZSTD_LEVEL: int = 3
+    COMPRESS_CACHE_SIZE: int = 256  # 压缩结果缓存条数(按响应体内容哈希, 相同的内容不重复压缩), 0 为不缓存
+    COMPRESS_CACHE_MAX_BODY: int = 1024 * 1024  # 超过多少字节的响应体不缓存压缩结果
+
     # jwt加密算法
     JWT_ALGORITHM: str = "HS256"
 
+    # 密码哈希
+    PASSWORD_HASH_SCHEME: str = "bcrypt"    # 新密码使用的哈希算法: bcrypt 或 argon2 (需要 pip install argon2-cffi), 旧算法的哈希在登录成功时自动重新哈希
+    PASSWORD_HASH_ROUNDS: int = 0   # 哈希强度 (bcrypt 的 cost / argon2 的 time_cost), 0 为默认值或按 PASSWORD_HASH_TARGET_MS 校准, 可以用 python manage.py benchmark-hash 测试
+    PASSWORD_HASH_TARGET_MS: int = 0    # 启动时按校验一次密码的目标耗时(毫秒)校准哈希强度, 0 为不校准
+    PASSWORD_HASH_ARGON2_MEMORY_KB: int = 65536     # argon2 的 memory_cost (KiB)
+    PASSWORD_HASH_PROCESSES: int = 0    # 批量导入用户时并行哈希密码的进程数, 0 为CPU核数
+    PASSWORD_HASH_EXECUTOR: str = "thread"   # 登录/修改密码时哈希和校验密码的执行器: thread (bcrypt 计算时释放GIL) 或 process (使用上面的进程池)
+    PASSWORD_HASH_MAX_WORKERS: int = 4  # thread 执行器的线程数, 即每个worker进程同时计算密码哈希的上限
+
+    # 登录用户缓存 (get_current_user 查询到的用户信息和角色id, 需要redis, 没有redis时每次请求都查询数据库)
+    PRINCIPAL_CACHE_SIZE: int = 1024    # 每个worker进程内存中缓存的用户数, 0 为不缓存
+    PRINCIPAL_CACHE_EXPIRE_SECONDS: int = 600   # 缓存过期秒数 (修改用户/用户角色时会立即失效, 这里只是兜底)
+
+    # 登录token缓存 (每个worker进程内存中缓存已经验证过的token, 退出登录/修改密码时通过redis频道通知所有worker, 需要redis)
+    TOKEN_CACHE_SIZE: int = 10000   # 每个worker进程缓存的token数, 0 为不缓存
+    TOKEN_CACHE_SECONDS: int = 60   # 缓存秒数 (不超过token的过期时间), 也是作废通知丢失时(redis断线)最多延迟生效的时间
+
+    # 权限矩阵 (每个worker进程内存中的 权限标识/用户 -> 角色位图, 见 common.perm_matrix)
+    PERM_MATRIX_REFRESH_SECONDS: int = 5    # 检查权限数据是否有修改的间隔秒数, 即其他worker修改权限后最多多久生效
+    TOKEN_PERM_CLAIMS: bool = False     # 登录token中带上角色id/是否超级管理员/权限版本号, 版本号没变时判断权限不需要查询用户 (需要redis)
+
     # FastAPI (Only takes effect in run "python main.py". Don't want to take effect when running with "uvicorn/gunicorn main:app")
     HOST: IPvAnyAddress = "0.0.0.0"     # 允许访问程序的ip， 只允许本地访问使用 127.0.0.1， 只在直接允许程序时候生效
     PORT: int = 9898    # 程序端口，只在直接运行程序的时候生效
@@ -46,10 +76,38 @@ class Settings(BaseSettings):
     SQL_DATABASE: Optional[str] = "dev"       # 关系型数据库数据库名
     SQL_TABLE_PREFIX: Optional[str] = 't_'  # 数据库表前缀， 不需要前缀可以置空
     SQLALCHEMY_ENGINE: str = 'mysql+aiomysql'   # SQL引擎需要加上异步引擎，修改此处可以快速改变SQL数据库(mysql+aiomysql postgres+asyncpg sqlite+aiosqlite...)
+    SQL_TS_CONVERT_IN_PYTHON: bool = False  # 查询输出的时间戳字段(dt2ts/ts2dt)是否在Python中转换, False 时在SQL中用数据库函数转换
+    # 连接池 (每个gunicorn/uvicorn worker进程各自一个连接池, 数据库总连接数约为 worker数 * (SQL_POOL_SIZE + SQL_POOL_MAX_OVERFLOW))
+    SQL_POOL_ENABLE: bool = True    # 是否使用连接池, False 时使用 NullPool 每次请求都重新建立数据库连接
+    SQL_POOL_SIZE: int = 10     # 连接池保持的连接数
+    SQL_POOL_MAX_OVERFLOW: int = 20     # 连接池满后允许额外创建的连接数
+    SQL_POOL_TIMEOUT: int = 30  # 从连接池获取连接的超时时间(秒)
+    SQL_POOL_PRE_PING: bool = True  # 取出连接时是否先检测连接可用
+    SQL_POOL_RECYCLE: int = 3600    # 连接回收时间(秒), 需要小于数据库的 wait_timeout
+    # 读写分离
+    SQL_REPLICA_HOSTS: List[str] = []   # 只读从库地址列表 ["host:port", ...], 用户名密码和数据库名与主库相同, 为空则不使用读写分离
+    SQL_READ_YOUR_WRITES_SECONDS: int = 5   # 同一用户提交写操作后多少秒内读取仍然走主库, 避免主从延迟读到旧数据
+    # SQL统计
+    SQL_STATS_ENABLE: bool = True   # 是否统计每个请求的SQL语句数和耗时(响应头 Server-Timing, 接口 /system/monitor/sql-stats)
+    SQL_N_PLUS_ONE_THRESHOLD: int = 5   # 一个请求中同一语句执行次数达到多少次视为 N+1 查询并记录警告日志, 0 为不检测
+    # 慢查询
+    SQL_SLOW_QUERY_MS: int = 500    # 执行时间超过多少毫秒的语句记录为慢查询, 0 为不记录
+    SQL_SLOW_QUERY_EXPLAIN: bool = True     # 慢查询是否在请求结束后获取 EXPLAIN 执行计划(只对SELECT语句)
+    SQL_SLOW_QUERY_SINK: str = "file"   # 慢查询记录写到哪里: file (./log/slow_query.log) 或 mongo (需要配置MongoDB, 集合 slow_queries)
+    # 分页
+    SQL_PAGE_WINDOW_COUNT: bool = True  # 分页时用 COUNT(*) OVER() 在一条语句中同时查出数据和总数 (需要数据库支持窗口函数: mysql8+ mariadb10.2+ postgresql sqlite3.25+)
+    SQL_COUNT_CACHE_SECONDS: int = 0    # 分页总数缓存秒数, 表有写操作时自动失效, 0 为不缓存
+    # 语句缓存
+    SQL_QUERY_CACHE_SIZE: int = 500     # sqlalchemy 编译缓存(语句 -> 编译后的SQL)大小
+    SQL_PREPARED_STATEMENT_CACHE_SIZE: int = 100    # 数据库驱动预处理语句缓存大小 (目前只有 asyncpg 支持, aiomysql 没有预处理语句), 0 为不缓存
+    SQL_BULK_CHUNK_SIZE: int = 500  # 批量新增/更新(create_many/upsert_many)时每条语句的行数
+    SQL_STREAM_BATCH_SIZE: int = 1000   # 流式查询(导出)时每次从数据库读取的行数
 
-    def getSqlalchemyURL(self):
+    def getSqlalchemyURL(self, host: Optional[str] = None, port: Optional[int] = None):
         """
         获取sqlachemy的连接语句, 有些数据库url可能不一样的时候请重写。
+        :param host: 不传使用 SQL_HOST
+        :param port: 不传使用 SQL_PORT
         """
         user = ""
         if self.SQL_USERNAME:
@@ -58,13 +116,39 @@ class Settings(BaseSettings):
             user += f":{self.SQL_PASSWORD}"
         if user:
             user += "@"
-        url = f"{self.SQLALCHEMY_ENGINE}://{user}{self.SQL_HOST}"
-        if self.SQL_PORT:
-            url += f":{self.SQL_PORT}"
+        url = f"{self.SQLALCHEMY_ENGINE}://{user}{host or self.SQL_HOST}"
+        if port or self.SQL_PORT:
+            url += f":{port or self.SQL_PORT}"
         if self.SQL_DATABASE:
             url += f"/{self.SQL_DATABASE}"
+        if "asyncpg" in self.SQLALCHEMY_ENGINE:
+            url += f"?prepared_statement_cache_size={self.SQL_PREPARED_STATEMENT_CACHE_SIZE}"
         return url
 
+    def getSqlalchemyReplicaURLs(self) -> List[str]:
+        """
+        获取只读从库的sqlalchemy连接语句
+        """
+        urls = []
+        for replica in self.SQL_REPLICA_HOSTS:
+            host, _, port = replica.partition(":")
+            urls.append(self.getSqlalchemyURL(host, int(port) if port else None))
+        return urls
+
+    def getSqlalchemyPoolKwargs(self) -> Dict[str, Any]:
+        """
+        获取sqlalchemy连接池相关参数, sqlite 使用sqlalchemy默认的连接池
+        """
+        if not self.SQL_POOL_ENABLE or self.SQLALCHEMY_ENGINE.startswith("sqlite"):
+            return {}
+        return {
+            'pool_size': self.SQL_POOL_SIZE,
+            'max_overflow': self.SQL_POOL_MAX_OVERFLOW,
+            'pool_timeout': self.SQL_POOL_TIMEOUT,
+            'pool_pre_ping': self.SQL_POOL_PRE_PING,
+            'pool_recycle': self.SQL_POOL_RECYCLE,
+        }
+
     # redis
     REDIS_HOST: str     # Redis Host地址
     REDIS_PASSWORD: Optional[str] = None    # Redis 密码
@@ -14,6 +14,10 @@ FORGET_PWD_TOKEN_EXPIRE_HOURS = 24
 USER_FORGET_PWD_SUBMIT_NUM_LIMIT = 2
 USER_FORGET_PWD_SUBMIT_EXPIRE_MINUTES = 5
 USER_PERM_LABEL_CACHE_EXPIRE_MINUTES = 3
+USER_IMPORT_BATCH_SIZE = 1000   # 批量导入用户时每批处理的行数
+USER_IMPORT_MAX_ERRORS = 1000   # 批量导入用户最多返回多少条错误
+USER_IMPORT_PROGRESS_EXPIRE_MINUTES = 60
+BATCH_MAX_IDS = 10000   # 批量操作接口一次最多提交的id数
 
 CELERY_PRINT_DATETIME = timedelta(seconds=10)
 
@@ -25,6 +29,14 @@ REDIS_KEY_USER_CAPTCHA_CODE_KEY_PREFIX = "user_captcha_code_"
 REDIS_KEY_USER_REGISTER_NUM_OF_TIME = "user_register_time_num_IP_"
 REDIS_KEY_USER_FORGET_PWD_NUM_OF_TIME = "user_forget_pwd_time_num_EMAIL_"
 REDIS_KEY_USER_PERM_LABEL_CACHE = "user_perm_label_cache_"
+REDIS_KEY_USER_IMPORT_PROGRESS = "user_import_progress_"
+REDIS_KEY_PASSWORD_HASH_POLICY = "password_hash_policy"
+REDIS_KEY_PASSWORD_HASH_POLICY_LOCK = "password_hash_policy_lock"
+REDIS_KEY_PRINCIPAL_CACHE = "user_principal_"
+REDIS_KEY_PRINCIPAL_VERSION = "user_principal_version_"
+REDIS_KEY_PERM_MATRIX_VERSION = "perm_matrix_version"
+REDIS_KEY_PERM_LABEL_REGISTER_LOCK = "perm_label_register_lock"
+REDIS_CHANNEL_TOKEN_REVOKE = "user_token_revoke"
 
 
 MEDIA_BASE_PATH = os.path.join(BASE_DIR, 'media/')
@@ -1,38 +1,155 @@
-from sqlalchemy import Column, Integer, DateTime
+import datetime
+from typing import Optional
+
+from sqlalchemy import Column, Integer, DateTime, TypeDecorator, bindparam, type_coerce
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import InstrumentedAttribute, properties 
 from sqlalchemy.sql import func, cast
+from sqlalchemy.sql.functions import FunctionElement
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 
 from core.config import settings
 from utils.transform import camel_case_2_underscore
 
 
+class _DtToTs(FunctionElement):
+    """ 数据库时间转时间戳, 按数据库方言编译 """
+    type = Integer()
+    inherit_cache = True
+
+
+class _TsToDt(FunctionElement):
+    """ 时间戳转数据库时间, 按数据库方言编译 """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(_DtToTs)
+def _dt2ts_default(element, compiler, **kw):  # mysql
+    return "unix_timestamp(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(_DtToTs, "postgresql")
+def _dt2ts_postgresql(element, compiler, **kw):
+    return "CAST(EXTRACT(EPOCH FROM %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(_DtToTs, "sqlite")
+def _dt2ts_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%%s', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(_TsToDt)
+def _ts2dt_default(element, compiler, **kw):  # mysql
+    return "from_unixtime(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(_TsToDt, "postgresql")
+def _ts2dt_postgresql(element, compiler, **kw):
+    return "to_timestamp(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(_TsToDt, "sqlite")
+def _ts2dt_sqlite(element, compiler, **kw):
+    return "datetime(%s, 'unixepoch')" % compiler.process(element.clauses, **kw)
+
+
+def _naive_is_utc(dialect) -> bool:
+    """
+    数据库中不带时区的时间按哪个时区和时间戳互相转换, 和上面的SQL保持一致:
+    sqlite (CURRENT_TIMESTAMP 和 strftime('%s') 都是UTC) 和 postgresql (EXTRACT(EPOCH) 按UTC计算, 数据库时区需要设为UTC) 为UTC;
+    mysql 的 unix_timestamp/from_unixtime 按会话时区, 这里按本地时区 (程序和数据库的时区需要一致)
+    """
+    return dialect.name in ("sqlite", "postgresql")
+
+
+def _ts_to_naive(ts: int, dialect) -> datetime.datetime:
+    if _naive_is_utc(dialect):
+        return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None)
+    return datetime.datetime.fromtimestamp(ts)
+
+
+def _naive_to_ts(value: datetime.datetime, dialect) -> int:
+    if value.tzinfo is None and _naive_is_utc(dialect):
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+
+class PyTimestamp(TypeDecorator):
+    """
+    SQL中原样查询时间字段, 读取结果时在Python中转换为时间戳 (SQL_TS_CONVERT_IN_PYTHON=True 时 dt2ts 使用)
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        return _naive_to_ts(value, dialect) if value is not None else None
+
+
+class PyDatetime(TypeDecorator):
+    """
+    SQL中原样查询时间戳字段, 读取结果时在Python中转换为时间 (SQL_TS_CONVERT_IN_PYTHON=True 时 ts2dt 使用)
+    """
+    impl = Integer
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return _ts_to_naive(value, dialect) if value is not None else None
+
+
+class TimestampParam(TypeDecorator):
+    """
+    时间戳参数, 执行时按数据库方言转为和时间字段比较的时间 (ts_range 使用, 和 dt2ts 的时区一致)
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return _ts_to_naive(value, dialect) if value is not None else None
+
+
 def dt2ts(col: Column, label: str = None):
     """
-    使用原生SQL把数据库时间转换为时间戳(使用时间戳解决时区问题)
+    把数据库时间转换为时间戳(使用时间戳解决时区问题), 根据数据库方言生成SQL (mysql/postgresql/sqlite);
+    SQL_TS_CONVERT_IN_PYTHON=True 时不在SQL中转换, 读取结果时在Python中转换
+    只用于查询输出, 不要用在 where 条件中(会导致索引失效), 条件使用 ts_range
     :param column:  type: Column    需要转换的数据库日期字段
     :param label:   type: string    转后时间戳的的字段名(相当于 sql 中的 AS )
     """
-    # ts = func.strftime('%%s', col)  # sqlite
-    # ts = cast(func.date_part('EPOCH', col), Integer) # pgsql
-    ts = func.unix_timestamp(col) # mysql
+    ts = type_coerce(col, PyTimestamp()) if settings.SQL_TS_CONVERT_IN_PYTHON else _DtToTs(col)
     return ts.label(label) if label else ts
 
 
 def ts2dt(col: Column, label: str = None):
     """
-    ts2dt 使用原生sql把时间戳转为时间输出， 参数同上
+    ts2dt 把时间戳转为时间输出， 参数同上
     """
-    # dt = func.datetime(col,'unixepoch')  # sqlite
-    # dt =  func.to_timestamp(col)    # pgsql
-    dt = func.from_unixtime(col)  # mysql
+    dt = type_coerce(col, PyDatetime()) if settings.SQL_TS_CONVERT_IN_PYTHON else _TsToDt(col)
     return dt.label(label) if label else dt
 
 
+def ts_range(col: Column, ge_ts: Optional[int] = None, le_ts: Optional[int] = None) -> list:
+    """
+    时间字段按时间戳范围过滤的条件, 时间戳在Python中转成时间后和字段直接比较, 可以使用字段上的索引
+    (按数据库方言转换, 时区和 dt2ts 输出的时间戳一致)
+    :param col:     type: Column    数据库日期字段
+    :param ge_ts:   type: int       大于等于的时间戳
+    :param le_ts:   type: int       小于等于的时间戳
+    """
+    filters = []
+    if ge_ts is not None:
+        filters.append(col >= bindparam(None, ge_ts, type_=TimestampParam()))
+    if le_ts is not None:
+        filters.append(col <= bindparam(None, le_ts, type_=TimestampParam()))
+    return filters
+
 
 @as_declarative()
 class Base:
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    # 时间字段默认不建索引 (每个表多两个索引会拖慢写入), 需要按时间范围(ts_range)过滤的表在模型中单独加索引, 例如 Users
     created_time = Column('created_time', DateTime, key='created_ts', default=func.now(), 
                           server_default=func.now(), comment="创建时间")
     creator_id = Column(Integer, default=0, server_default='0', comment="创建人id")
@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+from sqlalchemy.sql import Select
+
+from core.config import settings
+
+
+class CountCache:
+    """
+    分页总数(COUNT)缓存: key 为 表名 + 查询条件指纹(语句结构 + 参数值), 缓存 SQL_COUNT_CACHE_SECONDS 秒。
+    表有写操作时(见 db.session 中的 session 事件)该表的版本号加一, 旧的缓存失效。
+    缓存在当前worker进程内, 其他worker中的缓存最多延迟 SQL_COUNT_CACHE_SECONDS 秒失效
+    """
+    MAX_ENTRIES = 10000
+
+    def __init__(self, ttl: int = 0):
+        self.ttl = ttl
+        self._entries = OrderedDict()  # type: OrderedDict[Tuple[str, Hashable], Tuple[float, int, int]]
+        self._generations = {}  # type: Dict[str, int]
+
+    @property
+    def enable(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def fingerprint(sql: Select) -> Optional[Hashable]:
+        """
+        查询条件指纹, 语句无法生成缓存key时返回 None (不缓存)
+        """
+        cache_key = sql._generate_cache_key()
+        if cache_key is None:
+            return None
+        return cache_key.key, repr([bp.effective_value for bp in cache_key.bindparams])
+
+    def get(self, table: str, fp: Hashable) -> Optional[int]:
+        item = self._entries.get((table, fp))
+        if item is None:
+            return None
+        expire, generation, total = item
+        if expire < time.monotonic() or generation != self._generations.get(table, 0):
+            del self._entries[(table, fp)]
+            return None
+        self._entries.move_to_end((table, fp))
+        return total
+
+    def set(self, table: str, fp: Hashable, total: int):
+        self._entries[(table, fp)] = (time.monotonic() + self.ttl, self._generations.get(table, 0), total)
+        self._entries.move_to_end((table, fp))
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None):
+        """
+        使表的缓存失效, tables 为 None 时(无法确定写了哪些表, 例如 text() 原生SQL)所有缓存失效
+        """
+        if not self.enable:
+            return
+        if tables is None:
+            self._entries.clear()
+            return
+        for table in tables:
+            self._generations[table] = self._generations.get(table, 0) + 1
+
+    def clear(self):
+        self._entries.clear()
+
+
+count_cache = CountCache(settings.SQL_COUNT_CACHE_SECONDS)
@@ -1,12 +1,58 @@
 import contextlib
+import os
+import random
+import time
 import warnings
-from typing import Any, Generator, AsyncGenerator 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
-from sqlalchemy.pool import NullPool
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Generator, AsyncGenerator, List, Optional, Set
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.orm import ORMExecuteState, Session, SessionTransactionOrigin, object_mapper, sessionmaker
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.sql import Executable
+from sqlalchemy.pool import NullPool, QueuePool, AsyncAdaptedQueuePool
 
 from core.config import settings
+from db.count_cache import count_cache
+from db.sql_stats import instrument_engine
+
+
+class StatsAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """
+    记录取连接耗时的异步连接池, 用于观察连接池是否够用 (等待时间长/超时次数多 说明 pool_size 太小)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_count = 0
+        self.checkout_timeout_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.checkout_timeout_count += 1
+            raise
+        finally:
+            wait_time = time.perf_counter() - start
+            self.checkout_count += 1
+            self.wait_time_total += wait_time
+            if wait_time > self.wait_time_max:
+                self.wait_time_max = wait_time
+
+    def wait_stats(self) -> dict:
+        return {
+            'checkout_count': self.checkout_count,
+            'checkout_timeout_count': self.checkout_timeout_count,
+            'wait_time_total_ms': round(self.wait_time_total * 1000, 3),
+            'wait_time_avg_ms': round(self.wait_time_total * 1000 / self.checkout_count, 3) 
+                                if self.checkout_count else 0,
+            'wait_time_max_ms': round(self.wait_time_max * 1000, 3),
+        }
+
 
 class SessionManager:
     def __init__(self, host: str, **engine_kwargs):
@@ -50,26 +96,182 @@ class SessionManager:
 session_manager = SessionManager(
     settings.getSqlalchemyURL(), 
     echo = settings.ECHO_SQL,
-    pool_pre_ping=True, 
-    pool_size=15, 
-    max_overflow=20,
-    pool_timeout=30, 
-    pool_recycle=3600,
+    **settings.getSqlalchemyPoolKwargs()
 )
     
     
+_db_route_key: ContextVar[Optional[str]] = ContextVar("db_route_key", default=None)
+
+
+def set_db_route_key(key: Any):
+    """
+    设置当前请求的读写分离路由标识(一般为用户id), 同一标识提交写操作后的一段时间内读取走主库
+    """
+    _db_route_key.set(None if key is None else str(key))
+
+
+class RoutingSession(Session):
+    """
+    读写分离的Session (没有配置从库时和普通Session一样):
+        1. 标记了 use_replica 执行参数的查询语句 (CRUDBase 的查询方法) 走从库, 其他语句走主库
+        2. read_only 的 session (deps.get_read_db) 所有语句都走从库
+        3. 本session已经有写操作, 或者同一用户刚提交过写操作(SQL_READ_YOUR_WRITES_SECONDS内)时, 读取也走主库
+    """
+
+    def __init__(self, *args, manager: "AsyncSessionManager" = None, read_only: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manager = manager
+        self.info['read_only'] = read_only
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.manager is None or not self.manager.replica_engines:
+            return super().get_bind(mapper=mapper, clause=clause, **kw)
+        if self._use_replica(clause):
+            return self.manager.choice_replica().sync_engine
+        return self.manager.engine.sync_engine
+
+    def _use_replica(self, clause) -> bool:
+        if self._flushing or self.info.get('has_writes'):
+            return False
+        if self.manager.in_write_window(_db_route_key.get()):
+            return False
+        if self.info.get('read_only'):
+            return True
+        return isinstance(clause, Executable) and getattr(clause, "is_select", False) \
+            and bool(clause.get_execution_options().get('use_replica'))
+
+
+# 事务提交后的回调 callback(tables), tables 为提交的事务写过的表名 (None 表示无法确定写了哪些表)
+_commit_listeners = []  # type: List[Callable[[Optional[Set[str]]], Any]]
+
+
+def on_commit_tables(callback: Callable[[Optional[Set[str]]], Any]) -> Callable[[Optional[Set[str]]], Any]:
+    """
+    注册事务提交后的回调, 用于按表使进程内缓存失效 (例如 common.perm_matrix):
+        on_commit_tables(lambda tables: ...)
+    """
+    _commit_listeners.append(callback)
+    return callback
+
+
+# has_writes: 本session有过写操作(读写分离用)   pending_writes: 有未提交的写操作(请求结束时需要commit)
+# written_tables: 本事务写过的表, 写入时和提交后各使分页总数缓存失效一次, 提交后传给 on_commit_tables 的回调
+def _mark_written_tables(session: Session, tables: Optional[Set[str]]):
+    session.info['has_writes'] = True
+    session.info['pending_writes'] = True
+    written = session.info.get('written_tables', set())
+    if tables is None or written is None:
+        session.info['written_tables'] = None
+    else:
+        session.info['written_tables'] = written | tables
+    count_cache.invalidate(tables)
+
+
+# 除了 select 以外的语句都视为写操作 (text() 原生SQL无法区分读写, 按写操作处理)
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _mark_session_writes(orm_execute_state: ORMExecuteState):
+    if not orm_execute_state.is_select:
+        table = getattr(orm_execute_state.statement, "table", None)
+        _mark_written_tables(orm_execute_state.session, 
+                             {table.name} if getattr(table, "name", None) else None)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_session_flush(session: RoutingSession, flush_context):
+    _mark_written_tables(session, {object_mapper(o).local_table.name 
+                                   for o in (*session.new, *session.dirty, *session.deleted)})
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _record_session_commit(session: RoutingSession):
+    session.info['pending_writes'] = False
+    if 'written_tables' in session.info:
+        tables = session.info.pop('written_tables')
+        count_cache.invalidate(tables)
+        for listener in _commit_listeners:
+            listener(tables)
+    if session.info.get('has_writes') and session.manager is not None:
+        session.manager.mark_write(_db_route_key.get())
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _clear_session_pending_writes(session: RoutingSession):
+    session.info['pending_writes'] = False
+    session.info.pop('written_tables', None)
+
+
+def has_pending_writes(db: AsyncSession) -> bool:
+    """
+    session 中是否有未提交的写操作 (包括还未flush的 add/修改/删除 的模型对象)
+    """
+    return bool(db.info.get('pending_writes') or db.new or db.dirty or db.deleted)
+
+
+async def release_read_connection(db: AsyncSession):
+    """
+    只读session(get_read_db) 查询完后马上结束事务把连接还给连接池, 不需要等到请求结束(响应序列化之后)才归还。
+    用 close() 结束: 已经加载的模型对象脱离session但不会过期 (rollback 会使对象过期, 异步session中无法再加载),
+    session 之后还可以继续使用。
+    普通session(get_db) 的事务不提前结束: 先查询后写入需要在同一个事务中, 并且每次重新取连接也会多几次往返;
+    显式 db.begin() 开始的事务也不提前结束
+    """
+    if not db.info.get('read_only') or db.info.get('has_writes'):
+        return
+    transaction = db.sync_session.get_transaction()
+    if transaction is not None and transaction.origin is SessionTransactionOrigin.AUTOBEGIN:
+        await db.close()
+
+
 class AsyncSessionManager:
-    def __init__(self, host: str, **engine_kwargs):
+    WRITE_WINDOW_MAX_KEYS = 10000
+
+    def __init__(self, host: str, replica_hosts: Optional[List[str]] = None, **engine_kwargs):
         self.engine = create_async_engine(host, **engine_kwargs)
-        self.session_local = sessionmaker(autocommit=False, bind=self.engine, class_=AsyncSession)
+        self.replica_engines = [create_async_engine(h, **engine_kwargs) for h in (replica_hosts or [])]
+        if settings.SQL_STATS_ENABLE or settings.SQL_SLOW_QUERY_MS:
+            for engine in (self.engine, *self.replica_engines):
+                instrument_engine(engine.sync_engine)
+        self.session_local = sessionmaker(autocommit=False, bind=self.engine, class_=AsyncSession, 
+                                          sync_session_class=RoutingSession, manager=self)
+        self.read_session_local = sessionmaker(autocommit=False, bind=self.engine, class_=AsyncSession, 
+                                               sync_session_class=RoutingSession, manager=self, read_only=True)
+        self.read_your_writes_seconds = settings.SQL_READ_YOUR_WRITES_SECONDS
+        self._write_window = OrderedDict()  # type: OrderedDict[str, float]
         
     async def close(self):
         if self.engine is None:
             warnings.warn("Manager is not initialized")
             return
         await self.engine.dispose()
+        for replica_engine in self.replica_engines:
+            await replica_engine.dispose()
         self.engine = None
+        self.replica_engines = []
         self.session_local = None
+        self.read_session_local = None
+
+    def choice_replica(self) -> AsyncEngine:
+        return random.choice(self.replica_engines)
+
+    def mark_write(self, key: Optional[str]):
+        """
+        记录 key(用户) 提交了写操作, 在 SQL_READ_YOUR_WRITES_SECONDS 内该用户的读取走主库
+        (记录在当前worker进程内, 多worker时候依赖负载均衡的会话保持)
+        """
+        if key is None or not self.read_your_writes_seconds:
+            return
+        self._write_window.pop(key, None)
+        self._write_window[key] = time.monotonic() + self.read_your_writes_seconds
+        while len(self._write_window) > self.WRITE_WINDOW_MAX_KEYS:
+            self._write_window.popitem(last=False)
+
+    def in_write_window(self, key: Optional[str]) -> bool:
+        if key is None or key not in self._write_window:
+            return False
+        if self._write_window[key] > time.monotonic():
+            return True
+        del self._write_window[key]
+        return False
 
     @contextlib.asynccontextmanager
     async def connect(self) -> AsyncGenerator[AsyncSession, None]:
@@ -84,25 +286,87 @@ class AsyncSessionManager:
 
     @contextlib.asynccontextmanager
     async def session(self) -> AsyncGenerator[AsyncSession, None]:
+        """
+        AsyncSession 在第一次执行语句时才会从连接池取连接, 没有执行过SQL的请求(例如数据都从缓存中获取)不会占用连接。
+        结束时只有存在未提交的写操作才 commit, 只读的请求直接 close (归还连接时结束事务) 省掉一次 COMMIT。
+        """
         if self.session_local is None:
             raise Exception("Manager is not initialized")
         db = self.session_local()
         try:
             yield db
+            if has_pending_writes(db):
+                await db.commit()
         except Exception as e:
             await db.rollback()
             raise e
         finally:
-            await db.commit() 
+            await db.close()
+
+    @contextlib.asynccontextmanager
+    async def read_session(self) -> AsyncGenerator[AsyncSession, None]:
+        """
+        只读session, 配置了从库时所有语句走从库
+        """
+        if self.read_session_local is None:
+            raise Exception("Manager is not initialized")
+        db = self.read_session_local()
+        try:
+            yield db
+        finally:
             await db.close()
 
     async def create_table(self, db_base):
         async with self.connect() as conn:
             await conn.run_sync(db_base.metadata.create_all) 
 
+    @staticmethod
+    def _engine_pool_status(engine: AsyncEngine) -> dict:
+        pool = engine.pool
+        status = {'pool_class': type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            status.update({
+                'pool_size': pool.size(),
+                'max_overflow': pool._max_overflow,
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+            })
+        if isinstance(pool, StatsAsyncAdaptedQueuePool):
+            status.update(pool.wait_stats())
+        return status
+
+    def pool_status(self) -> dict:
+        """
+        当前进程(worker)的连接池状态
+        """
+        if self.engine is None:
+            return {}
+        status = {'pid': os.getpid()}
+        status.update(self._engine_pool_status(self.engine))
+        if self.replica_engines:
+            status['replicas'] = [self._engine_pool_status(e) for e in self.replica_engines]
+        return status
+
+
+def get_async_engine_kwargs() -> dict:
+    """
+    异步引擎参数, SQL_POOL_ENABLE=False 时候使用 NullPool (不使用连接池), query_cache_size 为编译缓存大小
+    """
+    kwargs = {'query_cache_size': settings.SQL_QUERY_CACHE_SIZE}
+    if not settings.SQL_POOL_ENABLE:
+        kwargs['poolclass'] = NullPool
+        return kwargs
+    pool_kwargs = settings.getSqlalchemyPoolKwargs()
+    if pool_kwargs:
+        pool_kwargs['poolclass'] = StatsAsyncAdaptedQueuePool
+    kwargs.update(pool_kwargs)
+    return kwargs
+
                                  
 async_session_manager = AsyncSessionManager(
     settings.getSqlalchemyURL(), 
+    settings.getSqlalchemyReplicaURLs(),
     echo = settings.ECHO_SQL,
-    poolclass=NullPool,  
+    **get_async_engine_kwargs()
 )
\ No newline at end of file
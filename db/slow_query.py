@@ -0,0 +1,137 @@
+import asyncio
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import time
+from collections import deque
+from typing import Any, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from core.config import settings
+from db.mongo import mongo_manager
+
+
+def params_shape(parameters: Any, executemany: bool = False) -> Any:
+    """
+    参数结构(只记录参数类型, 不记录参数值, 避免日志中出现密码等敏感数据)
+    """
+    if executemany and isinstance(parameters, (list, tuple)) and parameters:
+        return {'executemany': len(parameters), 'shape': params_shape(parameters[0])}
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
+
+
+class SlowQueryRecorder:
+    """
+    慢查询记录: 执行时间超过 SQL_SLOW_QUERY_MS 的语句记录 SQL、参数结构、耗时、路由, SELECT 语句另外获取 EXPLAIN 执行计划。
+    EXPLAIN 在请求结束后另起任务用新的连接执行, 不影响请求本身。
+    记录写入 SQL_SLOW_QUERY_SINK: file (./log/slow_query.log 滚动文件) 或 mongo (固定大小集合 slow_queries)
+    """
+    MAX_PENDING = 100
+    MONGO_COLLECTION = "slow_queries"
+    MONGO_COLLECTION_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, threshold_ms: int = 0, explain: bool = True, sink: str = "file", log_dir: str = "./log/"):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.sink = sink
+        self.log_dir = log_dir
+        self.pending = deque(maxlen=self.MAX_PENDING)
+        self.recent = deque(maxlen=self.MAX_PENDING)
+        self._logger = None  # type: Optional[logging.Logger]
+        self._tasks = set()
+
+    @property
+    def enable(self) -> bool:
+        return self.threshold > 0
+
+    @property
+    def logger(self) -> logging.Logger:
+        if self._logger is None:
+            logger = logging.getLogger("slow_query")
+            if not logger.handlers:
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                fh = logging.handlers.RotatingFileHandler(os.path.join(self.log_dir, "slow_query.log"),
+                                                          maxBytes=5*1024*1024, backupCount=5, delay=True)
+                fh.setLevel(logging.INFO)
+                logger.addHandler(fh)
+            self._logger = logger
+        return self._logger
+
+    def check(self, conn, statement: str, parameters: Any, executemany: bool, duration: float,
+              request_stats: Any = None):
+        """
+        在 after_cursor_execute 中调用, 超过阈值的语句加入待处理队列
+        """
+        if not self.enable or duration < self.threshold:
+            return
+        self.pending.append({
+            'sql': statement,
+            'params_shape': params_shape(parameters, executemany),
+            'duration_ms': round(duration * 1000, 3),
+            'dialect': conn.dialect.name,
+            'ts': int(time.time() * 1000),
+            'dt': str(datetime.datetime.now()),
+            # 以下字段写入前处理掉
+            '_params': None if executemany else parameters,
+            '_stats': request_stats,
+        })
+
+    def schedule_flush(self, engine: AsyncEngine):
+        """
+        请求结束后调用, 另起任务获取执行计划并写入记录
+        """
+        if not self.pending:
+            return
+        records = list(self.pending)
+        self.pending.clear()
+        task = asyncio.create_task(self.flush(engine, records))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, engine: AsyncEngine, records: List[dict]):
+        for record in records:
+            params, stats = record.pop('_params'), record.pop('_stats')
+            record['route'] = getattr(stats, 'route', "")
+            if self.explain and engine is not None and record['sql'].lstrip()[:6].upper() == "SELECT":
+                record['explain'] = await self.get_explain(engine, record['sql'], params)
+            self.recent.append(record)
+            try:
+                await self.write(record)
+            except Exception:
+                logging.getLogger("api").exception("write slow query record failed")
+
+    async def get_explain(self, engine: AsyncEngine, statement: str, parameters: Any) -> List[List[str]]:
+        prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+        try:
+            async with engine.connect() as conn:
+                res = await conn.exec_driver_sql(prefix + statement, parameters or ())
+                return [[str(i) for i in row] for row in res.all()]
+        except Exception as e:
+            return [[f"EXPLAIN failed: {e}"]]
+
+    async def write(self, record: dict):
+        if self.sink == "mongo":
+            await asyncio.to_thread(self._write_mongo, record)
+        else:
+            self.logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def _write_mongo(self, record: dict):
+        with mongo_manager() as mongo:
+            if mongo is None:
+                self.logger.info(json.dumps(record, ensure_ascii=False, default=str))
+                return
+            if self.MONGO_COLLECTION not in mongo.list_collection_names():
+                mongo.create_collection(self.MONGO_COLLECTION, capped=True, size=self.MONGO_COLLECTION_SIZE)
+            mongo.get_collection(self.MONGO_COLLECTION).insert_one(dict(record))
+
+
+slow_query_recorder = SlowQueryRecorder(settings.SQL_SLOW_QUERY_MS, settings.SQL_SLOW_QUERY_EXPLAIN,
+                                        settings.SQL_SLOW_QUERY_SINK)
@@ -0,0 +1,143 @@
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar, Token
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from db.slow_query import slow_query_recorder
+
+
+_request_sql_stats: ContextVar[Optional["RequestSqlStats"]] = ContextVar("request_sql_stats", default=None)
+
+
+class RequestSqlStats:
+    """
+    单个请求的SQL统计: 语句数量、数据库总耗时、最慢的语句、相同语句的执行次数(用于检测N+1查询)
+    """
+
+    def __init__(self, route: str = ""):
+        self.route = route
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_sql = ""
+        self.shapes = Counter()  # type: Counter[str]
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.total_time += duration
+        self.shapes[statement] += 1
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_sql = statement
+
+    def n_plus_one(self, threshold: int) -> List[Tuple[str, int]]:
+        """
+        同一个语句(参数化后的SQL相同)在一个请求中执行次数 >= threshold 的视为 N+1 查询
+        """
+        if threshold <= 0:
+            return []
+        return [(sql, n) for sql, n in self.shapes.most_common() if n >= threshold]
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing 响应头, 浏览器开发者工具的 Timing 中可以直接看到
+        """
+        return f'db;dur={self.total_time * 1000:.2f};desc="{self.count} queries"'
+
+
+class SqlStatsSummary:
+    """
+    当前进程(worker)按路由汇总的SQL统计
+    """
+    MAX_ROUTES = 1000
+
+    def __init__(self):
+        self.routes = OrderedDict()  # type: OrderedDict[str, dict]
+
+    def add(self, stats: RequestSqlStats, n_plus_one: List[Tuple[str, int]]):
+        item = self.routes.get(stats.route)
+        if item is None:
+            if len(self.routes) >= self.MAX_ROUTES:
+                self.routes.popitem(last=False)
+            item = self.routes[stats.route] = {
+                'requests': 0, 'statements': 0, 'max_statements': 0, 'db_time': 0.0, 'max_db_time': 0.0,
+                'slowest_time': 0.0, 'slowest_sql': "", 'n_plus_one_requests': 0, 'n_plus_one_sql': "",
+            }
+        item['requests'] += 1
+        item['statements'] += stats.count
+        item['max_statements'] = max(item['max_statements'], stats.count)
+        item['db_time'] += stats.total_time
+        item['max_db_time'] = max(item['max_db_time'], stats.total_time)
+        if stats.slowest_time > item['slowest_time']:
+            item['slowest_time'] = stats.slowest_time
+            item['slowest_sql'] = stats.slowest_sql
+        if n_plus_one:
+            item['n_plus_one_requests'] += 1
+            item['n_plus_one_sql'] = n_plus_one[0][0]
+
+    def to_dict(self) -> Dict[str, dict]:
+        result = {}
+        for route, item in self.routes.items():
+            result[route] = {
+                'requests': item['requests'],
+                'statements': item['statements'],
+                'avg_statements': round(item['statements'] / item['requests'], 2),
+                'max_statements': item['max_statements'],
+                'db_time_ms': round(item['db_time'] * 1000, 3),
+                'avg_db_time_ms': round(item['db_time'] * 1000 / item['requests'], 3),
+                'max_db_time_ms': round(item['max_db_time'] * 1000, 3),
+                'slowest_time_ms': round(item['slowest_time'] * 1000, 3),
+                'slowest_sql': item['slowest_sql'],
+                'n_plus_one_requests': item['n_plus_one_requests'],
+                'n_plus_one_sql': item['n_plus_one_sql'],
+            }
+        return result
+
+    def clear(self):
+        self.routes.clear()
+
+
+sql_stats_summary = SqlStatsSummary()
+
+
+def start_request_sql_stats(route: str = "") -> Tuple[RequestSqlStats, Token]:
+    stats = RequestSqlStats(route)
+    return stats, _request_sql_stats.set(stats)
+
+
+def end_request_sql_stats(token: Token):
+    _request_sql_stats.reset(token)
+
+
+def get_request_sql_stats() -> Optional[RequestSqlStats]:
+    return _request_sql_stats.get()
+
+
+# 开始时间记在每条语句的执行上下文上: 语句执行出错时 after_cursor_execute 不会触发, 不会影响同一连接后面的语句
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._sql_stats_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_time = getattr(context, "_sql_stats_start_time", None)
+    if start_time is None:
+        return
+    duration = time.perf_counter() - start_time
+    stats = _request_sql_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    slow_query_recorder.check(conn, statement, parameters, executemany, duration, stats)
+
+
+def instrument_engine(engine: Engine):
+    """
+    在引擎上挂载SQL统计和慢查询记录的事件监听 (异步引擎传入 engine.sync_engine)
+    """
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
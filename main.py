@@ -3,9 +3,13 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from apps import api_router
 from starlette.middleware.cors import CORSMiddleware
-from common.middleware import RequestsLoggerMiddleware
+from common.middleware import CompressionMiddleware, RequestsLoggerMiddleware, SqlStatsMiddleware
 
 from common.exceptions import customExceptions
+from common.perm_matrix import perm_matrix
+from common.perm_registry import collect_perm_labels, register_perm_labels
+from common.security import init_password_policy
+from common.token_cache import token_cache
 from core.config import settings
 from db.redis import register_redis
 from db.session import async_session_manager
@@ -14,7 +18,13 @@ from db.session import async_session_manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     async with register_redis(app):
+        await init_password_policy(app.state.redis)   # 按 PASSWORD_HASH_TARGET_MS 校准密码哈希强度
+        if settings.AUTO_ADD_PERM_LABEL:    # 所有路由的权限标识一次性添加到数据库
+            await register_perm_labels(collect_perm_labels(app.routes), app.state.redis)
+        await perm_matrix.init(app.state.redis)     # 加载权限矩阵
+        token_cache.start(app.state.redis)      # 订阅作废token的通知
         yield
+        await token_cache.stop()
     if async_session_manager.engine is not None:
         # Close the DB connection
         await async_session_manager.close()
@@ -25,6 +35,8 @@ def create_app():
     # set middleware
     # register_middleware(app)
     app.middleware("http")(RequestsLoggerMiddleware())  # http请求请求记录中间件  不需要可以注释掉，使用了可能会影响一点请求速度
+    if settings.SQL_STATS_ENABLE or settings.SQL_SLOW_QUERY_MS:
+        app.middleware("http")(SqlStatsMiddleware())   # 每个请求的SQL统计和N+1检测, Server-Timing响应头, 慢查询记录
     # api router
     app.include_router(api_router, prefix="/api/v1")
     # set socketio
@@ -34,6 +46,9 @@ def create_app():
     # allow cross domain
     app.add_middleware(CORSMiddleware, allow_origins=settings.BACKEND_CORS_ORIGINS,
                        allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+    # response compression, 最后添加的中间件在最外层, 压缩 CORS 等处理完成后的最终响应
+    if settings.COMPRESS_ENABLE:
+        app.add_middleware(CompressionMiddleware)
     # set custom exceptions
     customExceptions(app)
     # # print all path
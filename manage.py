@@ -0,0 +1,98 @@
+"""
+管理命令:
+    python manage.py benchmark-hash                         测试当前机器上不同密码哈希算法和强度的速度
+    python manage.py benchmark-hash --scheme bcrypt --rounds 10 11 12 --target-ms 250
+    python manage.py perm-labels dump [--json]                 列出所有路由使用的权限标识和是否已经在数据库中
+    python manage.py perm-labels sync                          把数据库中还没有的权限标识添加到数据库
+"""
+import argparse
+import asyncio
+import json
+import os
+
+from common import security
+from core.config import settings
+
+
+def benchmark_hash(args: argparse.Namespace):
+    """ 测试每个候选 (算法, 强度) 校验一次密码的耗时和每个CPU核每秒能计算的哈希数 """
+    cpu_count = os.cpu_count() or 1
+    print(f"current policy: {security.pwd_policy}  cpu cores: {cpu_count}")
+    print(f"{'scheme':<8}{'rounds':>8}{'memory_kb':>12}{'verify_ms':>12}{'hash/s/core':>14}{'hash/s/all':>13}")
+    for scheme in args.scheme:
+        rounds_list = args.rounds or range(security.PASSWORD_HASH_MIN_ROUNDS[scheme],
+                                           security.PASSWORD_HASH_DEFAULT_ROUNDS[scheme] + 2)
+        memory_cost = args.memory_kb if scheme == "argon2" else 0
+        for rounds in rounds_list:
+            try:
+                cost_ms = security.measure_verify_ms(security.PasswordHashPolicy(scheme, rounds, memory_cost),
+                                                     args.samples)
+            except Exception as e:     # 例如没有安装 argon2-cffi
+                print(f"{scheme:<8}{rounds:>8}  failed: {e}")
+                break
+            print(f"{scheme:<8}{rounds:>8}{memory_cost or '-':>12}{cost_ms:>12.1f}"
+                  f"{1000 / cost_ms:>14.1f}{1000 / cost_ms * cpu_count:>13.1f}")
+        if args.target_ms:
+            policy = security.calibrate_password_policy(scheme, args.target_ms, memory_cost)
+            print(f"{scheme}: rounds {policy.rounds} is closest to {args.target_ms}ms "
+                  f"(PASSWORD_HASH_SCHEME={scheme} PASSWORD_HASH_ROUNDS={policy.rounds})")
+
+
+def perm_labels(args: argparse.Namespace):
+    """ 所有路由的权限标识 (同 AUTO_ADD_PERM_LABEL 启动时添加的) """
+    from main import app
+    from common.perm_registry import collect_perm_labels, get_missing_perm_labels, register_perm_labels
+    from db.session import async_session_manager
+
+    labels = collect_perm_labels(app.routes)
+
+    async def dump():
+        async with async_session_manager.session() as db:
+            missing = set(await get_missing_perm_labels(db, labels))
+        if args.json:
+            print(json.dumps([{'label': i, 'registered': i not in missing} for i in labels], indent=2))
+        else:
+            for label in labels:
+                print(f"{label:<48}{'missing' if label in missing else 'ok'}")
+            print(f"total: {len(labels)}  missing: {len(missing)}")
+
+    async def sync():
+        added = await register_perm_labels(labels)
+        for label in added:
+            print(f"added: {label}")
+        print(f"total: {len(labels)}  added: {len(added)}")
+
+    async def run():
+        try:
+            await (sync() if args.action == "sync" else dump())
+        finally:
+            await async_session_manager.close()
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fastapi-sqlalchemy2 管理命令")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("benchmark-hash", help="测试密码哈希的速度, 用于选择 PASSWORD_HASH_SCHEME/PASSWORD_HASH_ROUNDS")
+    p.add_argument("--scheme", nargs="+", choices=security.PASSWORD_HASH_SCHEMES,
+                   default=list(security.PASSWORD_HASH_SCHEMES))
+    p.add_argument("--rounds", nargs="+", type=int, help="候选的强度, 默认从最低强度到默认强度+1")
+    p.add_argument("--memory-kb", type=int, default=settings.PASSWORD_HASH_ARGON2_MEMORY_KB, help="argon2 的 memory_cost")
+    p.add_argument("--samples", type=int, default=3, help="每个候选测试的次数")
+    p.add_argument("--target-ms", type=int, default=settings.PASSWORD_HASH_TARGET_MS,
+                   help="给出最接近这个校验耗时的强度")
+    p.set_defaults(func=benchmark_hash)
+
+    p = subparsers.add_parser("perm-labels", help="列出/同步路由使用的权限标识")
+    p.add_argument("action", choices=("dump", "sync"))
+    p.add_argument("--json", action="store_true", help="dump 输出为json")
+    p.set_defaults(func=perm_labels)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
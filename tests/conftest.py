@@ -0,0 +1,122 @@
+"""
+测试使用临时的 sqlite 数据库 (需要 pip install aiosqlite pytest), 在项目根目录运行:
+    python -m pytest -q
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP_DIR = tempfile.mkdtemp(prefix="fastapi-sqlalchemy2-test-")
+for key, value in {
+    'PROJECT_NAME': "test",
+    'REDIS_HOST': "127.0.0.1",
+    'SQLALCHEMY_ENGINE': "sqlite+aiosqlite",
+    'SQL_HOST': "/",
+    'SQL_PORT': "0",
+    'SQL_DATABASE': os.path.join(TMP_DIR, "test.db"),
+    'SQL_USERNAME': "",
+    'SQL_PASSWORD': "",
+}.items():
+    os.environ[key] = value
+os.chdir(ROOT_DIR)  # main 挂载了相对路径的 media 目录
+sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import main  # noqa: F401  先导入 main 再导入其他模块, 避免循环导入
+from common.perm_matrix import perm_matrix
+from common.principal import principal_cache
+from db.base_class import Base
+from db.count_cache import count_cache
+from db.session import async_session_manager
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class FakeRedis:
+    """ 测试用的内存redis, 只实现了用到的命令 """
+
+    def __init__(self):
+        self.data = {}
+        self.locks = {}
+
+    async def get(self, key):
+        value = self.data.get(key)
+        return None if value is None else str(value).encode()
+
+    async def set(self, key, value, nx: bool = False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def setex(self, key, seconds, value):
+        self.data[key] = value
+        return True
+
+    async def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return self.locks.setdefault(name, asyncio.Lock())
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(async_session_manager.close())
+    loop.close()
+
+
+@pytest.fixture
+def run(loop):
+    """ 在同一个事件循环中执行协程: run(coro) """
+    return loop.run_until_complete
+
+
+@pytest.fixture(autouse=True)
+def reset_db(run):
+    """ 每个测试使用空表, 清空进程内的缓存 """
+    async def reset():
+        async with async_session_manager.connect() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+    run(reset())
+    count_cache._entries.clear()
+    count_cache._generations.clear()
+    principal_cache._cache.clear()
+    perm_matrix.redis = None
+    perm_matrix.version = None
+    perm_matrix._stale = True
+    yield
+
+
+@pytest.fixture
+def redis():
+    return FakeRedis()
@@ -0,0 +1,43 @@
+from passlib.hash import bcrypt
+from sqlalchemy import insert, select
+
+from apps.permission.models import Users
+from apps.user.curd.curd_user import curd_user
+from common import security
+from db.session import async_session_manager
+
+
+def create_user(run, username: str, hashed_password: str = "") -> int:
+    async def main():
+        async with async_session_manager.session() as db:
+            res = await db.execute(insert(Users).values(
+                username=username, phone="13800000000", email=f"{username}@example.com", hashed_password=hashed_password))
+            await db.commit()
+            return res.inserted_primary_key[0]
+    return run(main())
+
+
+def test_authenticate_rehash_outdated_hash(run):
+    old_hash = bcrypt.using(rounds=10).hash("secret")
+    user_id = create_user(run, "admin", old_hash)
+    policy = security.pwd_policy
+    security.set_password_policy(security.PasswordHashPolicy("bcrypt", 11))
+    try:
+        async def main():
+            async with async_session_manager.session() as db:
+                assert await curd_user.authenticate(db, user="admin", password="wrong") is None
+                assert await curd_user.authenticate(db, user="nobody", password="secret") is None
+            async with async_session_manager.session() as db:
+                assert (await db.execute(select(Users.hashed_password))).scalar() == old_hash
+                u = await curd_user.authenticate(db, user="admin", password="secret")
+                assert u.id == user_id
+            async with async_session_manager.session() as db:
+                new_hash = (await db.execute(select(Users.hashed_password))).scalar()
+                assert new_hash.startswith("$2b$11$") and security.verify_password("secret", new_hash)
+                # 已经是新的策略时不再重新哈希
+                assert (await curd_user.authenticate(db, user="admin@example.com", password="secret")).id == user_id
+            async with async_session_manager.session() as db:
+                assert (await db.execute(select(Users.hashed_password))).scalar() == new_hash
+        run(main())
+    finally:
+        security.set_password_policy(policy)
@@ -0,0 +1,14 @@
+import pytest
+from pydantic import ValidationError
+
+from common.batch_router import BatchIdsSchema, BatchStatusSchema
+from core import constants
+
+
+def test_batch_ids_length():
+    assert BatchStatusSchema(ids=[1, 2], status=1).ids == [1, 2]
+    assert len(BatchIdsSchema(ids=list(range(constants.BATCH_MAX_IDS))).ids) == constants.BATCH_MAX_IDS
+    with pytest.raises(ValidationError):
+        BatchIdsSchema(ids=[])
+    with pytest.raises(ValidationError):
+        BatchIdsSchema(ids=list(range(constants.BATCH_MAX_IDS + 1)))
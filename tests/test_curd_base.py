@@ -0,0 +1,121 @@
+import pytest
+from sqlalchemy import event, select
+
+from apps.permission.curd.curd_menu import curd_menu
+from apps.permission.curd.curd_user import curd_user
+from apps.permission.models import UserRole
+from common.curd_base import AssociationChanges, sync_association
+from common.exceptions import CursorInvalidError
+from core.config import settings
+from db.count_cache import count_cache
+from db.session import async_session_manager
+
+
+@pytest.fixture
+def statements():
+    """ 执行过的SQL语句 """
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    engine = async_session_manager.engine.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield executed
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def create_menus(run, n: int):
+    async def main():
+        async with async_session_manager.session() as db:
+            await curd_menu.create_many(db, objs_in=[{'path': f"/m{i}", 'order_num': i % 3} for i in range(n)])
+    run(main())
+
+
+def count_statements(statements: list) -> int:
+    return sum(1 for i in statements if i.lstrip().upper().startswith("SELECT COUNT("))
+
+
+@pytest.mark.parametrize("window_count", [True, False])
+def test_get_multi_total(run, statements, monkeypatch, window_count):
+    monkeypatch.setattr(settings, "SQL_PAGE_WINDOW_COUNT", window_count)
+    create_menus(run, 7)
+
+    async def main():
+        async with async_session_manager.session() as db:
+            await db.connection()   # 连接后才知道数据库版本, 见 support_window_count
+            statements.clear()
+            data, total, offset, limit = await curd_menu.get_multi(db, page=2, page_size=3)
+            assert (len(data), total, offset, limit) == (3, 7, 3, 3)
+            assert "_total" not in data[0]
+            assert count_statements(statements) == (0 if window_count else 1)
+            # 页数超出时显示最后一页
+            data, total, offset, _ = await curd_menu.get_multi(db, page=10, page_size=3)
+            assert (len(data), total, offset) == (1, 7, 6)
+            data, total, _, _ = await curd_menu.get_multi(db, filters=[curd_menu.model.path == "/none"])
+            assert (data, total) == ([], 0)
+    run(main())
+
+
+def test_get_multi_count_cache(run, statements, monkeypatch):
+    monkeypatch.setattr(settings, "SQL_PAGE_WINDOW_COUNT", False)
+    monkeypatch.setattr(count_cache, "ttl", 60)
+    create_menus(run, 5)
+
+    async def main():
+        async with async_session_manager.session() as db:
+            statements.clear()
+            assert (await curd_menu.get_multi(db, page_size=2))[1] == 5
+            assert (await curd_menu.get_multi(db, page=2, page_size=2))[1] == 5
+            assert count_statements(statements) == 1    # 第二次使用缓存的总数
+            # 条件不同的查询分别缓存
+            assert (await curd_menu.get_multi(db, filters=[curd_menu.model.order_num == 0]))[1] == 2
+            assert count_statements(statements) == 2
+        async with async_session_manager.session() as db:
+            await curd_menu.create(db, obj_in={'path': "/new"})    # 提交后该表的缓存失效
+        async with async_session_manager.session() as db:
+            statements.clear()
+            assert (await curd_menu.get_multi(db, page_size=2))[1] == 6
+            assert count_statements(statements) == 1
+    run(main())
+
+
+def test_get_multi_by_cursor(run):
+    create_menus(run, 7)
+
+    async def main():
+        order_bys = [curd_menu.model.order_num.desc()]
+        async with async_session_manager.session() as db:
+            pages, after = [], ""
+            while after is not None:
+                data, after = await curd_menu.get_multi_by_cursor(db, after=after, page_size=3, order_bys=order_bys)
+                pages.append([(i['order_num'], i['id']) for i in data])
+            assert [len(i) for i in pages] == [3, 3, 1]
+            rows = [i for page in pages for i in page]
+            assert rows == sorted(rows, reverse=True)   # id 和最后一个排序字段同方向
+            assert len(set(rows)) == 7
+            _, after = await curd_menu.get_multi_by_cursor(db, after="", page_size=3, order_bys=order_bys)
+            with pytest.raises(CursorInvalidError):     # 排序方式和游标不一致
+                await curd_menu.get_multi_by_cursor(db, after=after, page_size=3)
+            with pytest.raises(CursorInvalidError):
+                await curd_menu.get_multi_by_cursor(db, after="not-a-cursor", page_size=3)
+    run(main())
+
+
+def test_sync_association(run):
+    async def main():
+        async with async_session_manager.session() as db:
+            sync = lambda role_ids: sync_association(db, UserRole, owner_col=UserRole.user_id, owner_id=1,
+                                                     target_col=UserRole.role_id, target_ids=role_ids)
+            assert await sync([1, 2]) == AssociationChanges({1, 2}, set())
+            assert await sync([2, 3]) == AssociationChanges({3}, {1})
+            assert not (await sync([3, 2])).changed
+            # 逻辑删除了的关联会被清理, 重新关联时当作新增
+            await curd_user.set_user_roles(db, user_id=2, role_ids=[1])
+            await db.execute(UserRole.__table__.update().where(UserRole.role_id == 3).values(is_deleted=1))
+            assert await sync([2, 3]) == AssociationChanges({3}, set())
+            rows = (await db.execute(
+                select(UserRole.user_id, UserRole.role_id, UserRole.is_deleted).order_by(UserRole.user_id, UserRole.role_id)
+            )).all()
+            assert [tuple(i) for i in rows] == [(1, 2, 0), (1, 3, 0), (2, 1, 0)]
+    run(main())
@@ -0,0 +1,42 @@
+import os
+import time
+
+from sqlalchemy import func, select, type_coerce
+
+from apps.permission.curd.curd_user import curd_user
+from apps.permission.models import Users
+from apps.permission.schemas import UserSchema
+from db.base_class import Base, PyTimestamp, dt2ts, ts_range
+from db.session import async_session_manager
+
+
+def test_only_users_index_created_time():
+    indexed = sorted((table.name, column.name) for table in Base.metadata.sorted_tables
+                     for index in table.indexes for column in index.columns
+                     if column.name in ("created_time", "modified_time"))
+    assert indexed == [("t_users", "created_time")]
+
+
+def test_ts_range_matches_dt2ts(run):
+    tz = os.environ.get("TZ")
+    os.environ["TZ"] = "Asia/Shanghai"  # 本地时区不是UTC时 ts_range 和 dt2ts 也要一致
+    time.tzset()
+    try:
+        async def main():
+            async with async_session_manager.session() as db:
+                await curd_user.create(db, obj_in=UserSchema(
+                    username="admin", phone="13800000000", email="admin@example.com"))
+            async with async_session_manager.session() as db:
+                ts = (await db.execute(select(dt2ts(Users.created_time)))).scalar()
+                assert abs(ts - time.time()) < 60
+                assert (await db.execute(select(type_coerce(Users.created_time, PyTimestamp())))).scalar() == ts
+                for ge_ts, le_ts, count in ((ts - 1, ts + 1, 1), (ts + 1, None, 0), (None, ts - 1, 0)):
+                    assert (await db.execute(select(func.count(Users.id)).where(
+                        *ts_range(Users.created_time, ge_ts=ge_ts, le_ts=le_ts)))).scalar() == count
+        run(main())
+    finally:
+        if tz is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = tz
+        time.tzset()
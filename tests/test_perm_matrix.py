@@ -0,0 +1,64 @@
+from apps.permission.curd.curd_perm_label import curd_perm_label
+from apps.permission.curd.curd_role import curd_role
+from apps.permission.curd.curd_user import curd_user
+from apps.permission.schemas import UserSchema
+from common.perm_matrix import perm_matrix
+from core import constants
+from db.session import async_session_manager
+
+
+async def create_user_with_label(label: str):
+    """ 创建一个用户, 用户的角色拥有权限标识 label, 返回 (user_id, role_id, label_id) """
+    async with async_session_manager.session() as db:
+        role_id = (await curd_role.create(db, obj_in={'key': "editor", 'name': "编辑"})).id
+        label_id = (await curd_perm_label.create(db, obj_in={'label': label, 'roles': [role_id]})).id
+        user_id = (await curd_user.create(db, obj_in=UserSchema(
+            username="editor", phone="13800000000", email="editor@example.com", roles=[role_id]))).id
+    return user_id, role_id, label_id
+
+
+def test_has_perm_after_role_change(run, redis):
+    async def main():
+        user_id, role_id, label_id = await create_user_with_label("system:user:list")
+        await perm_matrix.init(redis)
+        assert await perm_matrix.has_perm(user_id, ("system:user:list",))
+        assert await perm_matrix.has_perm(user_id, ("system:user:add", "system:user:list"))
+        assert not await perm_matrix.has_perm(user_id, ("system:user:add",))
+        assert not await perm_matrix.has_perm(user_id + 1, ("system:user:list",))
+        # 提交了权限相关表的修改后马上重新加载, 并通知其他worker (redis中的版本号加1)
+        version = int(await redis.get(constants.REDIS_KEY_PERM_MATRIX_VERSION) or 0)
+        async with async_session_manager.session() as db:
+            await curd_perm_label.set_label_roles(db, label_id=label_id, role_ids=[])
+        assert not await perm_matrix.has_perm(user_id, ("system:user:list",))
+        assert int(await redis.get(constants.REDIS_KEY_PERM_MATRIX_VERSION)) == version + 1
+        async with async_session_manager.session() as db:
+            await curd_perm_label.set_label_roles(db, label_id=label_id, role_ids=[role_id])
+        assert await perm_matrix.has_perm(user_id, ("system:user:list",))
+    run(main())
+
+
+def test_claims_invalid_after_role_change(run, redis):
+    async def main():
+        user_id, role_id, label_id = await create_user_with_label("system:user:list")
+        await perm_matrix.init(redis)
+        claims = await perm_matrix.token_claims(user_id, False)
+        assert claims == {'roles': [role_id], 'su': False, 'pv': claims['pv']}
+        assert await perm_matrix.claims_valid(claims['pv'])
+        assert perm_matrix.roles_have_perm(claims['roles'], ("system:user:list",))
+        # 修改权限标识的角色后, 之前签发的token中的权限信息失效, 重新判断权限
+        async with async_session_manager.session() as db:
+            await curd_perm_label.set_label_roles(db, label_id=label_id, role_ids=[])
+        assert not await perm_matrix.claims_valid(claims['pv'])
+        new_claims = await perm_matrix.token_claims(user_id, False)
+        assert new_claims['pv'] != claims['pv'] and await perm_matrix.claims_valid(new_claims['pv'])
+        assert not perm_matrix.roles_have_perm(new_claims['roles'], ("system:user:list",))
+        assert not await perm_matrix.claims_valid(None)
+    run(main())
+
+
+def test_claims_need_redis(run):
+    async def main():
+        user_id, _, _ = await create_user_with_label("system:user:list")
+        await perm_matrix.init(None)    # 没有redis时没有全局的版本号, 不在token中放权限信息
+        assert await perm_matrix.token_claims(user_id, False) == {}
+    run(main())
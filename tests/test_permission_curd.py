@@ -0,0 +1,51 @@
+from apps.permission.curd.curd_menu import curd_menu
+from apps.permission.curd.curd_perm_label import curd_perm_label
+from apps.permission.curd.curd_role import curd_role
+from apps.permission.curd.curd_user import curd_user
+from apps.permission.schemas import UserSchema
+from db.session import async_session_manager
+
+
+def test_get_role_and_perm_label_by_id(run):
+    async def main():
+        async with async_session_manager.session() as db:
+            menu_id = await curd_menu.create(db, obj_in={'path': "/system", 'title': "系统管理"})
+            role_id = (await curd_role.create(db, obj_in={'key': "admin", 'name': "管理员", 'menus': [menu_id]})).id
+            label_id = (await curd_perm_label.create(db, obj_in={'label': "system:user:list", 'roles': [role_id]})).id
+        async with async_session_manager.session() as db:
+            assert await curd_role.get(db, role_id) == {
+                'id': role_id, 'key': "admin", 'name': "管理员", 'order_num': 0, 'status': 0,
+                'menus': [{'id': menu_id}],
+            }
+            assert await curd_perm_label.get(db, label_id) == {
+                'id': label_id, 'label': "system:user:list", 'remark': "", 'status': 0, 'roles': [role_id],
+            }
+            assert await curd_role.get(db, role_id + 100) is None
+            assert await curd_perm_label.get(db, label_id + 100) is None
+    run(main())
+
+
+def test_create_user_with_roles(run):
+    async def main():
+        async with async_session_manager.session() as db:
+            role_id = (await curd_role.create(db, obj_in={'key': "admin", 'name': "管理员"})).id
+            user = await curd_user.create(db, obj_in=UserSchema(
+                username="admin", phone="13800000000", email="admin@example.com", roles=[role_id]))
+            user_id = user.id
+        async with async_session_manager.session() as db:
+            user = await curd_user.get(db, user_id)
+            assert (user['username'], user['roles']) == ("admin", [role_id])
+    run(main())
+
+
+def test_update_perm_label_roles(run):
+    async def main():
+        async with async_session_manager.session() as db:
+            role_ids = [(await curd_role.create(db, obj_in={'key': key, 'name': key})).id for key in ("a", "b")]
+            label_id = (await curd_perm_label.create(db, obj_in={'label': "system:user:list", 'roles': role_ids[:1]})).id
+            await curd_perm_label.update(db, _id=label_id, obj_in={'remark': "用户列表", 'roles': role_ids[1:]})
+            await curd_perm_label.update(db, _id=label_id, obj_in={'status': 1})    # 不传 roles 时不修改
+        async with async_session_manager.session() as db:
+            label = await curd_perm_label.get(db, label_id)
+            assert (label['remark'], label['status'], label['roles']) == ("用户列表", 1, role_ids[1:])
+    run(main())
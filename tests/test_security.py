@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from common import security
+from core import constants
+from core.config import settings
+
+
+def test_init_password_policy_calibrates_once(run, redis, monkeypatch):
+    calls = []
+
+    def calibrate(scheme, target_ms, memory_cost=0):
+        calls.append(scheme)
+        time.sleep(0.05)
+        return security.PasswordHashPolicy(scheme, 11 + len(calls), memory_cost)
+
+    monkeypatch.setattr(settings, "PASSWORD_HASH_ROUNDS", 0)
+    monkeypatch.setattr(settings, "PASSWORD_HASH_TARGET_MS", 250)
+    monkeypatch.setattr(security, "calibrate_password_policy", calibrate)
+    policy = security.pwd_policy
+    try:
+        async def main():
+            # 多个worker同时启动: 只有一个校准, 其他的读取它保存的结果
+            return await asyncio.gather(*[security.init_password_policy(redis) for _ in range(3)])
+        assert run(main()) == [security.PasswordHashPolicy(settings.PASSWORD_HASH_SCHEME, 12, policy.memory_cost)] * 3
+        assert len(calls) == 1
+        assert redis.data[constants.REDIS_KEY_PASSWORD_HASH_POLICY]
+        # 修改了目标耗时: 重新校准并覆盖旧的结果
+        monkeypatch.setattr(settings, "PASSWORD_HASH_TARGET_MS", 500)
+        assert run(security.init_password_policy(redis)).rounds == 13
+        assert run(security.init_password_policy(redis)).rounds == 13
+        assert len(calls) == 2
+    finally:
+        security.set_password_policy(policy)
+
+
+def test_get_password_hash_many(run, monkeypatch):
+    monkeypatch.setattr(settings, "PASSWORD_HASH_PROCESSES", 2)
+    policy = security.pwd_policy
+    security.set_password_policy(security.PasswordHashPolicy("bcrypt", 10))
+    try:
+        passwords = [f"password{i}" for i in range(5)]
+        hashes = run(security.get_password_hash_many(passwords))
+        assert security._password_hash_processes == 2
+        assert len(hashes) == 5 and all(h.startswith("$2b$10$") for h in hashes)
+        assert all(security.verify_password(p, h) for p, h in zip(passwords, hashes))
+    finally:
+        if security._password_hash_process_pool is not None:
+            security._password_hash_process_pool.shutdown()
+            security._password_hash_process_pool, security._password_hash_processes = None, 0
+        security.set_password_policy(policy)
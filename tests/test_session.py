@@ -0,0 +1,33 @@
+from sqlalchemy import select
+
+from apps.permission.curd.curd_menu import curd_menu
+from apps.permission.models.menu import Menus
+from db.session import async_session_manager
+
+
+def test_read_session_releases_connection_after_read(run):
+    async def main():
+        async with async_session_manager.session() as db:
+            menu_id = await curd_menu.create(db, obj_in={'path': "/system", 'title': "系统管理"})
+        async with async_session_manager.read_session() as db:
+            menu = (await db.execute(select(Menus).where(Menus.id == menu_id))).scalar()
+            assert (await curd_menu.get(db, menu_id))['path'] == "/system"
+            assert not db.in_transaction()
+            assert menu.title == "系统管理"     # 提前结束事务后已经加载的对象没有过期
+            assert (await curd_menu.get(db, menu_id))['path'] == "/system"    # session 还可以继续使用
+            assert db.info['read_only'] and not db.in_transaction()
+    run(main())
+
+
+def test_keep_transaction(run):
+    async def main():
+        # 普通session 查询后不提前结束事务, 和之后的写操作在同一个事务中
+        async with async_session_manager.session() as db:
+            await curd_menu.get(db, 1)
+            assert db.in_transaction()
+        # 显式开始的事务不提前结束
+        async with async_session_manager.read_session() as db:
+            async with db.begin():
+                await curd_menu.get(db, 1)
+                assert db.in_transaction()
+    run(main())
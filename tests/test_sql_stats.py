@@ -0,0 +1,21 @@
+import pytest
+from sqlalchemy import exc, text
+
+from db.session import async_session_manager
+from db.sql_stats import end_request_sql_stats, start_request_sql_stats
+
+
+def test_failed_statement_leaves_no_start_time(run):
+    async def main():
+        stats, token = start_request_sql_stats("test")
+        try:
+            async with async_session_manager.connect() as conn:
+                with pytest.raises(exc.OperationalError):
+                    await conn.execute(text("SELECT * FROM not_exists_table"))
+                await conn.execute(text("SELECT 1"))
+                info = (await conn.get_raw_connection()).info
+        finally:
+            end_request_sql_stats(token)
+        assert stats.count == 1
+        assert not info.get('sql_stats_start_time')     # 出错的语句没有在连接上留下开始时间
+    run(main())
@@ -0,0 +1,49 @@
+import codecs
+import csv
+import json
+from itertools import islice
+from typing import AsyncGenerator, Iterator, List
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+
+def get_upload_format(file: UploadFile) -> str:
+    """
+    根据文件名/Content-Type 判断上传的数据文件格式: csv 或 ndjson
+    """
+    filename = (file.filename or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")) or "ndjson" in (file.content_type or ""):
+        return "ndjson"
+    if filename.endswith(".csv") or "csv" in (file.content_type or ""):
+        return "csv"
+    raise ValueError("only support .csv / .ndjson / .jsonl file")
+
+
+def _iter_ndjson(lines: Iterator[str]) -> Iterator[dict]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            row = None
+        yield row if isinstance(row, dict) else {}  # 格式错误的行返回空字典, 由后面的数据校验报错, 保证行号正确
+
+
+async def iter_upload_rows(file: UploadFile, fmt: str = None,
+                           batch_size: int = 1000) -> AsyncGenerator[List[dict], None]:
+    """
+    分批读取上传的 csv/ndjson 文件, 每次返回 batch_size 行 (csv 第一行为表头), 不会一次把整个文件读到内存中。
+    读取和解析在线程池中进行, 不阻塞事件循环
+    """
+    fmt = fmt or get_upload_format(file)
+    await file.seek(0)
+    lines = codecs.iterdecode(file.file, "utf-8-sig")
+    rows = csv.DictReader(lines) if fmt == "csv" else _iter_ndjson(lines)
+    while True:
+        batch = await run_in_threadpool(lambda: list(islice(rows, batch_size)))
+        if not batch:
+            break
+        yield batch